@@ -95,6 +95,12 @@ class SoftwareSwitchBase (object):
     self.log = logging.getLogger(self.name)
     self._connection = None
 
+    # A run of flow_mods is applied as a FlowTable batch if the connection
+    # tells us when it has delivered all it read (see set_connection()).
+    # The batch ends there, or at the next message of another type.
+    self._batch_flow_mods = False
+    self._flow_mod_batch = None # Table with a batch open
+
     # buffer for packets during packet_in
     self._packet_buffer = []
 
@@ -242,14 +248,33 @@ class SoftwareSwitchBase (object):
                          % (ofp_type_map.get(ofp_type), ofp_type))
 
     self.log.debug("Got %s with XID %s",ofp_type_map.get(ofp_type),msg.xid)
+    if ofp_type == OFPT_FLOW_MOD:
+      if self._batch_flow_mods and self._flow_mod_batch is None:
+        self._flow_mod_batch = self.table
+        self.table.start_batch()
+    elif self._flow_mod_batch is not None:
+      # E.g., a barrier: finish what came before it first
+      self.end_flow_mod_batch()
     h(msg, connection=connection)
 
+  def end_flow_mod_batch (self, connection=None):
+    """
+    Raises the table events of flow_mods applied as a batch, if any
+    """
+    table = self._flow_mod_batch
+    if table is None: return
+    self._flow_mod_batch = None
+    table.end_batch()
+
   def set_connection (self, connection):
     """
     Set this switch's connection.
     """
     self._has_sent_hello = False
     connection.set_message_handler(self.rx_message)
+    self._batch_flow_mods = hasattr(connection, 'on_messages_done')
+    if self._batch_flow_mods:
+      connection.on_messages_done = self.end_flow_mod_batch
     self._connection = connection
 
   def send (self, message, connection = None):
@@ -293,7 +318,8 @@ class SoftwareSwitchBase (object):
     """
     Handles flow mods
     """
-    self.log.debug("Flow mod details: %s", ofp.show())
+    if self.log.isEnabledFor(logging.DEBUG):
+      self.log.debug("Flow mod details: %s", ofp.show())
 
     #self.table.process_flow_mod(ofp)
     #self._process_flow_mod(ofp, connection=connection, table=self.table)
@@ -805,11 +831,10 @@ class SoftwareSwitchBase (object):
     priority = flow_mod.priority
 
     modified = False
-    for entry in table.entries:
+    for entry in table.matching_entries(match, priority, strict):
       # update the actions field in the matching flows
-      if entry.is_matched_by(match, priority=priority, strict=strict):
-        entry.actions = flow_mod.actions
-        modified = True
+      entry.actions = flow_mod.actions
+      modified = True
 
     if not modified:
       # if no matching entry is found, modify acts as add
@@ -1098,6 +1123,7 @@ class OFConnection (object):
     self.unpackers = make_type_to_unpacker_table()
 
     self.on_message_received = None
+    self.on_messages_done = None # Called with self at the end of read()
 
   def set_message_handler (self, handler):
     self.on_message_received = handler
@@ -1171,6 +1197,8 @@ class OFConnection (object):
         if r is False: break
         continue
 
+    if self.on_messages_done is not None:
+      self.on_messages_done(self)
     return True
 
   def _error_handler (self, reason, info):
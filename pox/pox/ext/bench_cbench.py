@@ -0,0 +1,415 @@
+#!/usr/bin/python
+
+"""
+A cbench-style controller benchmark that needs no oflops cbench binary.
+
+Starts POX with the component to benchmark in a subprocess, and connects
+emulated switches to it over TCP loopback.  Every switch is a
+datapaths.switch SoftwareSwitchBase talking through an OFConnection, so it
+goes through the real OpenFlow handshake.  Like cbench, it then sends
+PacketIns and counts the answers, in one of two modes:
+
+  throughput: every switch keeps --outstanding PacketIns in flight.
+  latency:    every switch sends its next PacketIn once the last one has
+              been answered.
+
+A PacketIn counts as answered by the first flow_mod or packet_out for it.
+That message is found by buffer_id, by the packet it carries or by the
+flow it matches.  A message that names none of these, like the empty
+flow_mod misc.cbench answers with, answers the oldest outstanding PacketIn.
+
+Switches can be spread over several generator processes with --processes,
+so that generating load does not become the bottleneck.  --idle holds
+that many more connections open that never send anything, to see how the
+controller's OpenFlow loop copes with many switches.  --workers runs the
+benchmark once for each number of openflow.of_01 worker processes, to see
+how the controller scales with cores.
+
+    e.g. python bench_cbench.py -c misc.cbench -s 16 -m throughput
+         python bench_cbench.py -c forwarding.l2_learning -m latency
+         python bench_cbench.py -c jellyfish -t jelly,25,4,3
+         python bench_cbench.py -c misc.cbench -i 3000 --pox-args=--no_epoll
+         python bench_cbench.py -c misc.cbench -s 64 -p 4 -w 1,2,4
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import random
+import select
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+sys.path.append("../../")
+
+import pox.core
+if pox.core.core is None:
+    pox.core.initialize() # pox.datapaths needs core.getLogger to import
+import pox.openflow.libopenflow_01 as of
+from pox.datapaths.switch import SoftwareSwitchBase, OFConnection
+from pox.lib.packet import ethernet
+
+from bench_flow_setup import percentile
+from utils import make_tcp_packet
+
+POX_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+class _SocketWorker(object):
+    """
+    The part of a pox.lib.ioworker IOWorker that OFConnection uses, over a
+    plain blocking socket that is only read when select() says so.
+    """
+    def __init__(self, sock):
+        self.socket = sock
+        self.rx_handler = None
+        self._buf = b''
+
+    def peek(self):
+        return self._buf
+
+    def consume_receive_buf(self, length):
+        self._buf = self._buf[length:]
+
+    def send(self, data):
+        self.socket.sendall(data)
+
+    def shutdown(self):
+        self.socket.close()
+
+    def read(self):
+        data = self.socket.recv(4096)
+        if not data:
+            raise RuntimeError("Controller closed the connection")
+        self._buf += data
+        self.rx_handler(self)
+
+
+class BenchSwitch(SoftwareSwitchBase):
+    """
+    An emulated switch that sends PacketIns and times the answers.
+
+    flows is a list of (in_port, src host, dst host) the PacketIns cycle
+    through, with hosts named and addressed like topologies' hosts; each PacketIn gets its own TCP source port and
+    buffer_id, so that answers can be told apart.  flow_mods and packet_outs
+    are only counted: there is no flow table or dataplane.
+    """
+    def __init__(self, dpid, ports, flows, window):
+        SoftwareSwitchBase.__init__(self, dpid, ports=ports)
+        self.log.setLevel(logging.WARNING)
+        self.flows = flows
+        self.window = window
+        self.sending = False
+        self.messages = 0 # received from the controller
+        self.features_requested = False
+        self.outstanding = OrderedDict() # buffer_id -> (send time, flow key)
+        self.by_flow = {} # (src mac, dst mac, tp_src) -> buffer_id
+        self.latencies = []
+        self._next = 0
+
+    def rx_message(self, connection, msg):
+        self.messages += 1
+        SoftwareSwitchBase.rx_message(self, connection, msg)
+
+    def _rx_features_request(self, ofp, connection):
+        self.features_requested = True
+        SoftwareSwitchBase._rx_features_request(self, ofp, connection)
+
+    def _rx_set_config(self, config, connection):
+        pass
+
+    def _rx_flow_mod(self, ofp, connection):
+        if ofp.command not in (of.OFPFC_ADD, of.OFPFC_MODIFY,
+                                                      of.OFPFC_MODIFY_STRICT):
+            return
+        match = ofp.match
+        flow = None
+        if match.dl_src is not None and match.dl_dst is not None:
+            flow = (match.dl_src.raw, match.dl_dst.raw, match.tp_src)
+        self._answered(ofp.buffer_id, flow)
+
+    def _rx_packet_out(self, packet_out, connection):
+        flow = None
+        if packet_out.data:
+            packet = ethernet(packet_out.data)
+            l4 = packet.find('tcp')
+            flow = (packet.src.raw, packet.dst.raw, l4.srcport if l4 else None)
+        self._answered(packet_out.buffer_id, flow)
+
+    def _answered(self, buffer_id, flow):
+        if buffer_id is not None and buffer_id in self.outstanding:
+            pass
+        elif flow is not None:
+            buffer_id = self.by_flow.get(flow)
+            if buffer_id is None and flow[2] is not None:
+                buffer_id = self.by_flow.get(flow[:2] + (None,))
+            # Otherwise it is a second answer to a PacketIn answered already.
+            if buffer_id is None: return
+        elif self.outstanding:
+            buffer_id = next(iter(self.outstanding))
+        else:
+            return
+
+        sent, flow = self.outstanding.pop(buffer_id)
+        self.by_flow.pop(flow, None)
+        self.latencies.append(time.time() - sent)
+        if self.sending: self.send_packet_ins()
+
+    def send_packet_ins(self):
+        "Sends PacketIns until window of them are outstanding."
+        while len(self.outstanding) < self.window:
+            self._next += 1
+            in_port, src, dst = self.flows[self._next % len(self.flows)]
+            tp_src = 1024 + self._next % 64000
+            buffer_id = self._next & 0x7fffffff
+            packet = make_tcp_packet(src, dst, tp_src=tp_src)
+            flow = (packet.src.raw, packet.dst.raw, tp_src)
+            self.outstanding[buffer_id] = (time.time(), flow)
+            self.by_flow[flow] = buffer_id
+            self.send_packet_in(in_port, buffer_id=buffer_id,
+                                packet=packet.pack())
+
+
+def connect(address, port):
+    "Connects to the controller, waiting up to 30s for it to listen."
+    deadline = time.time() + 30
+    while True:
+        try:
+            return socket.create_connection((address, port))
+        except socket.error:
+            if time.time() > deadline: raise
+            time.sleep(0.2)
+
+def hold_idle(address, port, count, ready, done):
+    """
+    Opens count connections to the controller that never get past the
+    hello, and holds them open until done is set.  This runs in a process
+    of its own, to keep their fds out of the switches' select().
+    """
+    idle = [connect(address, port) for i in range(count)]
+    ready.set()
+    done.wait()
+
+def run_switches(args):
+    """
+    Connects the switches in specs, a list of (dpid, ports, flows), to the
+    controller, and runs loops of duration seconds of PacketIns.
+
+    Returns [(answered, latencies)] for each loop.
+    """
+    address, port, specs, window, loops, duration = args
+    switches = [BenchSwitch(dpid, ports, flows, window)
+                            for dpid, ports, flows in specs]
+
+    workers = {} # socket -> _SocketWorker
+    for switch in switches:
+        sock = connect(address, port)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        worker = _SocketWorker(sock)
+        switch.set_connection(OFConnection(worker))
+        workers[sock] = worker
+
+    def poll(until):
+        while True:
+            timeout = until - time.time()
+            if timeout <= 0: return
+            readable, _, _ = select.select(list(workers), [], [], timeout)
+            for sock in readable:
+                workers[sock].read()
+
+    # Wait for the handshakes, and for whatever the controller sends on
+    # ConnectionUp, to be over.
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        before = sum(s.messages for s in switches)
+        poll(time.time() + 0.5)
+        if (all(s.features_requested for s in switches) and
+                sum(s.messages for s in switches) == before):
+            break
+
+    results = []
+    for switch in switches:
+        switch.sending = bool(switch.flows)
+        if switch.sending: switch.send_packet_ins()
+    for i in range(loops):
+        for switch in switches:
+            switch.latencies = []
+        poll(time.time() + duration)
+        latencies = [l for s in switches for l in s.latencies]
+        results.append((len(latencies), latencies))
+
+    for switch in switches:
+        switch.sending = False
+    for worker in workers.values():
+        worker.shutdown()
+    return results
+
+
+def generic_specs(switches, hosts):
+    """
+    cbench's network: switches with dpids 1..switches, each with hosts hosts
+    on its ports, sending to hosts anywhere in the network.
+    """
+    def host(s, h):
+        # Addressed by its dpid like topologies' hosts, e.g. 10.0.s.h
+        return 'h%d' % ((s << 8) | h)
+    specs = []
+    for s in range(1, switches + 1):
+        flows = []
+        for h in range(1, hosts + 1):
+            dst = (s, h)
+            while dst == (s, h) and switches * hosts > 1:
+                dst = (random.randint(1, switches), random.randint(1, hosts))
+            flows.append((h, host(s, h), host(*dst)))
+        specs.append((s, hosts, flows))
+    return specs
+
+def jellyfish_specs(topo):
+    """
+    The switches of a Jellyfish topology, each sending from its hosts to
+    random hosts elsewhere in the network.
+    """
+    from topologies import node_name_to_dpid
+    hosts = topo.hosts()
+    specs = []
+    for s in topo.switches():
+        flows = []
+        ports = [port for peer, port in topo.neighbors(s)]
+        for peer, port in topo.neighbors(s):
+            if topo.isSwitch(peer): continue
+            dst = random.choice([h for h in hosts if h != peer])
+            flows.append((port, peer, dst))
+        specs.append((node_name_to_dpid(s), max(ports), flows))
+    return specs
+
+def benchmark(args, specs, component, window, workers):
+    """
+    Starts the controller with workers of_01 processes, and runs the
+    switches in specs against it.
+
+    Returns the flows/s of every loop and all the latencies.
+    """
+    command = ([sys.executable, 'pox.py', 'log.level', '--WARNING',
+                'openflow.of_01', '--port=%d' % args.port,
+                '--workers=%d' % workers] +
+               args.pox_args.split() + component)
+    controller = subprocess.Popen(command, cwd=POX_DIR)
+    try:
+        if args.idle:
+            ready, done = multiprocessing.Event(), multiprocessing.Event()
+            holder = multiprocessing.Process(target=hold_idle,
+                args=('127.0.0.1', args.port, args.idle, ready, done))
+            holder.start()
+            ready.wait()
+        jobs = [('127.0.0.1', args.port, specs[i::args.processes], window,
+                 args.loops, args.duration) for i in range(args.processes)]
+        if args.processes == 1:
+            results = [run_switches(jobs[0])]
+        else:
+            pool = multiprocessing.Pool(args.processes)
+            results = pool.map(run_switches, jobs, chunksize=1)
+            pool.close()
+    finally:
+        if args.idle:
+            done.set()
+            holder.join()
+        controller.terminate()
+        controller.wait()
+
+    rates = []
+    latencies = []
+    for i in range(args.loops):
+        answered = sum(result[i][0] for result in results)
+        rates.append(answered / args.duration)
+        latencies.extend(l for result in results for l in result[i][1])
+    return rates, latencies
+
+# Set up argument parser.
+parser = argparse.ArgumentParser()
+parser.add_argument('-c','--component', default='misc.cbench',
+    help='POX component(s) to benchmark, or jellyfish for the '
+         'JellyfishController')
+parser.add_argument('-m','--mode', default='throughput',
+    help='One of throughput, latency')
+parser.add_argument('-s','--switches', type=int, default=16,
+    help='Number of switches (ignored for jellyfish)')
+parser.add_argument('-M','--hosts', type=int, default=64,
+    help='Hosts per switch (ignored for jellyfish)')
+parser.add_argument('-o','--outstanding', type=int, default=64,
+    help='PacketIns in flight per switch in throughput mode')
+parser.add_argument('-l','--loops', type=int, default=5,
+    help='Number of measurement loops')
+parser.add_argument('-d','--duration', type=float, default=2.0,
+    help='Seconds per loop')
+parser.add_argument('-p','--processes', type=int, default=1,
+    help='Number of processes to spread the switches over')
+parser.add_argument('--port', type=int, default=6653,
+    help='Port for the controller to listen on')
+parser.add_argument('-t','--topology', default='jelly,25,4,3',
+    help='Jellyfish topology as jelly,n,k,r, for jellyfish')
+parser.add_argument('-r','--routing', default='ecmp',
+    help='Routing for jellyfish')
+parser.add_argument('--seed', type=int, default=0,
+    help='What random seed to use for this experiment.')
+parser.add_argument('-i','--idle', type=int, default=0,
+    help='Number of idle connections to hold open to the controller')
+parser.add_argument('-w','--workers', default='1',
+    help='Comma-separated numbers of of_01 worker processes to try')
+parser.add_argument('--pox-args', default='',
+    help='Extra arguments for pox.py, e.g. "openflow.of_01 --foo=bar"')
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    if args.mode not in ('throughput', 'latency'):
+        print("We only know THROUGHPUT and LATENCY modes")
+        raise SystemExit
+    window = args.outstanding if args.mode == 'throughput' else 1
+    random.seed(args.seed)
+
+    component = args.component.split()
+    config = None
+    if args.component == 'jellyfish':
+        from topologies import jellyfish_graph
+        topo_name, n, k, r = args.topology.split(',')
+        topo = jellyfish_graph(random_seed=args.seed, n=int(n), k=int(k),
+                               r=int(r))
+        specs = jellyfish_specs(topo)
+        fd, config = tempfile.mkstemp(prefix='jellyconfig')
+        with os.fdopen(fd, 'w') as config_file:
+            config_file.write('n=%s\nk=%s\nr=%s\nseed=%d\nrouting=%s\n'
+                              'route_cache=\n' % (n, k, r, args.seed,
+                                                   args.routing))
+        component = ['ext.jellyfish_controller', '--config=' + config]
+    else:
+        specs = generic_specs(args.switches, args.hosts)
+
+    summary = []
+    try:
+        for workers in map(int, args.workers.split(',')):
+            rates, latencies = benchmark(args, specs, component, window,
+                                         workers)
+            for i, rate in enumerate(rates):
+                print("loop %d: %10.1f flows/s" % (i + 1, rate))
+
+            mean = sum(rates) / len(rates)
+            stdev = (sum((r - mean) ** 2 for r in rates) / len(rates)) ** 0.5
+            print("RESULT: %d switches %d idle %d workers %d loops %s mode "
+                  "min/max/avg/stdev = %.1f/%.1f/%.1f/%.1f flows/s" % (
+                  len(specs), args.idle, workers, args.loops, args.mode,
+                  min(rates), max(rates), mean, stdev))
+            print("latency: p50 %.3fms p90 %.3fms p99 %.3fms" % (
+                  percentile(latencies, 50) * 1000,
+                  percentile(latencies, 90) * 1000,
+                  percentile(latencies, 99) * 1000))
+            summary.append((workers, mean))
+    finally:
+        if config: os.remove(config)
+
+    if len(summary) > 1:
+        base = summary[0][1]
+        for workers, mean in summary:
+            print("%2d workers: %10.1f flows/s (%.2fx)" % (
+                  workers, mean, mean / base if base else 0.0))
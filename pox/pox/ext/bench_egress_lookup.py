@@ -0,0 +1,105 @@
+#!/usr/bin/python
+
+"""
+Microbenchmark of Routing.get_egress_port, the per-PacketIn routing lookup.
+
+Compares lookups per second of the compiled per-switch egress table against
+the old lookup, which picked a path from routing_paths and scanned it for the
+switch with path.index().  Every lookup is also checked to give the same port
+both ways.
+
+    e.g. python bench_egress_lookup.py -t jelly,25,4,3 -r kshort
+"""
+
+import argparse
+import logging
+import random
+import sys
+import time
+sys.path.append("../../")
+
+from topologies import topologies, dpid_to_switch
+from routing import Routing
+from utils import make_tcp_packet
+
+def path_scan_egress_port(routing, packet, switch_dpid):
+    """
+    The lookup get_egress_port did before the egress table was compiled.
+    """
+    paths = routing.routing_paths[str(packet.src)][str(packet.dst)]
+
+    index = routing._ecmp_hash(packet) % len(paths)
+    path = paths[index]
+    switch_id = dpid_to_switch(switch_dpid)
+    switch_index = path.index(switch_id)
+    if switch_index + 1 < len(path):
+        next_hop = path[switch_index + 1]
+    else:
+        next_hop = routing.mac_to_hostname[str(packet.dst)]
+    return routing.port_map[switch_id][next_hop]
+
+def make_lookups(routing, hosts, count):
+    """
+    Returns count (packet, switch dpid) lookups for random flows, at a random
+    switch on the path each flow hashes to.
+    """
+    lookups = []
+    for i in range(count):
+        src, dst = random.sample(hosts, 2)
+        packet = make_tcp_packet(src, dst, tp_src=random.randint(1024, 65535))
+        # Parse it back, like a PacketIn would.
+        packet = packet.__class__(packet.pack())
+        paths = routing.routing_paths[str(packet.src)][str(packet.dst)]
+        path = paths[routing._ecmp_hash(packet) % len(paths)]
+        switch = random.choice(path)
+        lookups.append((packet, int(switch[1:])))
+    return lookups
+
+def lookups_per_second(fn, lookups, rounds):
+    start = time.time()
+    for i in range(rounds):
+        for packet, dpid in lookups:
+            fn(packet, dpid)
+    return len(lookups) * rounds / (time.time() - start)
+
+# Set up argument parser.
+parser = argparse.ArgumentParser()
+parser.add_argument('-t','--topology', default='jelly,25,4,3',
+    help='Jellyfish topology as jelly,n,k,r')
+parser.add_argument('-r','--routing', default='ecmp',
+    help='One of ecmp, ecmp64, kshort.  What routing algorithm to use')
+parser.add_argument('-s','--seed', type=int, default=0,
+    help='What random seed to use for this experiment.')
+parser.add_argument('-l','--lookups', type=int, default=10000,
+    help='Number of distinct lookups')
+parser.add_argument('--rounds', type=int, default=10,
+    help='Number of times to repeat the lookups')
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    log = logging.getLogger('bench_egress_lookup')
+    topo_name, n, k, r = args.topology.split(',')
+
+    topo = topologies['jelly'](random_seed=args.seed, n=int(n), k=int(k),
+                               r=int(r))
+    routing = Routing(topo, args.routing, log, seed=args.seed)
+    start = time.time()
+    routing.generate_routing_paths()
+    print('Routing paths generated in: {:.3f}s'.format(time.time() - start))
+    start = time.time()
+    routing.compile_egress_table()
+    print('Egress table compiled in: {:.3f}s'.format(time.time() - start))
+
+    random.seed(args.seed)
+    lookups = make_lookups(routing, sorted(topo.hosts()), args.lookups)
+    for packet, dpid in lookups:
+        assert (routing.get_egress_port(packet, dpid) ==
+                path_scan_egress_port(routing, packet, dpid))
+
+    before = lookups_per_second(
+        lambda packet, dpid: path_scan_egress_port(routing, packet, dpid),
+        lookups, args.rounds)
+    after = lookups_per_second(routing.get_egress_port, lookups, args.rounds)
+    print('path scan:    {:12.0f} lookups/s'.format(before))
+    print('egress table: {:12.0f} lookups/s ({:.1f}x)'.format(after,
+                                                           after / before))
@@ -0,0 +1,157 @@
+#!/usr/bin/python
+
+"""
+Benchmarks PacketIn load, flow-setup latency and flow table sizes of the
+JellyfishController's modes, on an in-process loopback emulation of the
+Jellyfish topology (see loopback.py), so it needs neither Mininet nor root.
+
+Traffic is random permutation traffic, with --flows TCP flows per host pair
+and --packets packets per flow.  Flow-setup latency is the time from a flow's
+first packet entering the network until it reaches its destination.  It is
+measured in-process, so it leaves out the control channel RTT that every
+PacketIn costs on a real network; multiply PacketIns/flow by your RTT.
+
+    e.g. python bench_flow_setup.py -t jelly,25,4,3 -r ecmp
+"""
+
+import argparse
+import multiprocessing
+import random
+import sys
+import time
+import logging
+sys.path.append("../../")
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values: return 0.0
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+def run_mode(mode, n, k, r, seed, routing, flows, packets, buckets):
+    """
+    Runs the benchmark for one controller mode and returns its results.
+
+    This is run in a fresh process per mode, so that each controller has
+    POX (and core.openflow) to itself.
+    """
+    import pox.core
+    pox.core.initialize()
+    import pox.openflow
+    pox.openflow.launch()
+
+    import loopback
+    from topologies import jellyfish_graph
+    from routing import Routing
+    from jellyfish_controller import JellyfishController, log
+
+    topo = jellyfish_graph(random_seed=seed, n=n, k=k, r=r)
+    my_routing = Routing(topo, routing, log, seed=seed)
+    my_routing.generate_rtable()
+
+    start = time.time()
+    JellyfishController(topo, my_routing, mode, buckets=buckets)
+    net = loopback.LoopbackNetwork(topo)
+    net.connect()
+    connect_time = time.time() - start
+    connect_messages = net.counters['to_switch']
+
+    # Random permutation traffic.
+    random.seed(seed)
+    hosts = sorted(topo.hosts())
+    dsts = hosts[:]
+    while any(s == d for s, d in zip(hosts, dsts)):
+        random.shuffle(dsts)
+
+    setup_latencies = []
+    lost = 0
+    packet_ins = net.counters['OFPT_PACKET_IN']
+    to_switch = net.counters['to_switch']
+    to_switch_bytes = net.counters['to_switch_bytes']
+    for src, dst in zip(hosts, dsts):
+        for f in range(flows):
+            tp_src = 10000 + f
+            start = time.time()
+            if not net.send(src, dst, tp_src=tp_src): lost += 1
+            setup_latencies.append(time.time() - start)
+    setup_packet_ins = net.counters['OFPT_PACKET_IN'] - packet_ins
+    setup_to_switch = net.counters['to_switch'] - to_switch
+    setup_to_switch_bytes = net.counters['to_switch_bytes'] - to_switch_bytes
+
+    packet_ins = net.counters['OFPT_PACKET_IN']
+    for src, dst in zip(hosts, dsts):
+        for f in range(flows):
+            for p in range(packets - 1):
+                if not net.send(src, dst, tp_src=10000 + f): lost += 1
+    steady_packet_ins = net.counters['OFPT_PACKET_IN'] - packet_ins
+
+    n_flows = len(setup_latencies)
+    table_sizes = [len(sw.table) for sw in net.switches.itervalues()]
+    return {
+        'mode': mode,
+        'connect_time': connect_time,
+        'connect_messages': connect_messages,
+        'flows': n_flows,
+        'lost': lost,
+        'setup_packet_ins': setup_packet_ins,
+        'steady_packet_ins': steady_packet_ins,
+        'packet_ins_per_flow': float(setup_packet_ins) / n_flows,
+        'to_switch_per_flow': float(setup_to_switch) / n_flows,
+        'to_switch_bytes_per_flow': float(setup_to_switch_bytes) / n_flows,
+        'setup_mean': sum(setup_latencies) / n_flows,
+        'setup_p50': percentile(setup_latencies, 50),
+        'setup_p99': percentile(setup_latencies, 99),
+        'table_mean': float(sum(table_sizes)) / len(table_sizes),
+        'table_max': max(table_sizes),
+        'to_switch': net.counters['to_switch'],
+        'to_switch_bytes': net.counters['to_switch_bytes'],
+    }
+
+def _run_mode(args):
+    return run_mode(*args)
+
+def print_results(results):
+    print("%-10s %8s %8s %10s %10s %12s %10s %12s %12s %12s %10s %10s %10s" % (
+        'mode', 'connect', 'flows', 'PI(setup)', 'PI(steady)', 'PI/flow',
+        'msgs/flow', 'bytes/flow', 'setup p50', 'setup p99', 'lost',
+        'rules/sw', 'max rules'))
+    for res in results:
+        print("%-10s %7.2fs %8d %10d %10d %12.2f %10.2f %12.1f %10.3fms "
+              "%10.3fms %10d %10.1f %10d" % (
+            res['mode'], res['connect_time'], res['flows'],
+            res['setup_packet_ins'], res['steady_packet_ins'],
+            res['packet_ins_per_flow'], res['to_switch_per_flow'],
+            res['to_switch_bytes_per_flow'], res['setup_p50'] * 1000,
+            res['setup_p99'] * 1000, res['lost'], res['table_mean'],
+            res['table_max']))
+
+# Set up argument parser.
+parser = argparse.ArgumentParser()
+parser.add_argument('-t','--topology', default='jelly,25,4,3',
+    help='Jellyfish topology as jelly,n,k,r')
+parser.add_argument('-r','--routing', default='ecmp',
+    help='One of ecmp, ecmp64, kshort.  What routing algorithm to use')
+parser.add_argument('-s','--seed', type=int, default=0,
+    help='What random seed to use for this experiment.')
+parser.add_argument('-f','--flows', type=int, default=8,
+    help='Number of TCP flows per random permutation host pair')
+parser.add_argument('-p','--packets', type=int, default=4,
+    help='Number of packets sent per flow')
+parser.add_argument('-m','--modes', default='reactive,proactive,aggregate',
+    help='Comma-separated controller modes to compare')
+parser.add_argument('-b','--buckets', type=int, default=4,
+    help='Source buckets per destination host in aggregate mode')
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    topo_name, n, k, r = args.topology.split(',')
+    modes = args.modes.split(',')
+
+    pool = multiprocessing.Pool(1, maxtasksperchild=1)
+    results = pool.map(_run_mode, [(mode, int(n), int(k), int(r), args.seed,
+        args.routing, args.flows, args.packets, args.buckets)
+        for mode in modes],
+        chunksize=1)
+    pool.close()
+
+    print_results(results)
@@ -0,0 +1,107 @@
+#!/usr/bin/python
+
+"""
+Benchmarks FlowTable, the software switch's flow table, filled with the
+exact-match flows JellyfishController installs reactively: one per
+(dl_src, dl_dst, 5-tuple), plus a few low-priority wildcarded ones.
+
+For every table size it reports how long filling the table took, and
+entry_for_packet lookups/s for packets that hit a flow.  Up to
+--linear-max entries, it also times the linear scan entry_for_packet did
+before the table was indexed.
+
+    e.g. python bench_flow_table.py -n 10000,100000,1000000
+"""
+
+import argparse
+import random
+import sys
+import time
+sys.path.append("../../")
+
+import pox.openflow.libopenflow_01 as of
+from pox.openflow.flow_table import FlowTable, TableEntry
+from pox.lib.addresses import EthAddr, IPAddr
+from pox.lib.packet import ethernet, ipv4, tcp
+
+def make_flow(i):
+    "Returns (match, packet) of the i-th flow."
+    host = lambda n: (EthAddr('00:00:%02x:%02x:%02x:%02x' % (
+        n >> 24 & 0xff, n >> 16 & 0xff, n >> 8 & 0xff, n & 0xff)),
+        IPAddr(0x0a000000 + n))
+    src_mac, src_ip = host(i // 64)
+    dst_mac, dst_ip = host(i // 64 + 1)
+    l4 = tcp(srcport=1024 + i % 64, dstport=5001, off=5)
+    ip = ipv4(srcip=src_ip, dstip=dst_ip, protocol=ipv4.TCP_PROTOCOL)
+    ip.payload = l4
+    eth = ethernet(src=src_mac, dst=dst_mac, type=ethernet.IP_TYPE)
+    eth.payload = ip
+    packet = ethernet(eth.pack())
+    match = of.ofp_match.from_packet(packet, 1, spec_frags=True)
+    return match, packet
+
+def linear_entry_for_packet(table, packet, in_port):
+    "What FlowTable.entry_for_packet did before it had an index."
+    packet_match = of.ofp_match.from_packet(packet, in_port, spec_frags=True)
+    for entry in table.entries:
+        if entry.match.matches_with_wildcards(packet_match,
+                                              consider_other_wildcards=False):
+            return entry
+    return None
+
+def lookups_per_second(lookup, table, packets, seconds):
+    "Returns lookups/s of lookup over packets, run for about seconds."
+    count = 0
+    start = time.time()
+    while True:
+        for packet in packets:
+            assert lookup(table, packet, 1) is not None
+        count += len(packets)
+        elapsed = time.time() - start
+        if elapsed >= seconds:
+            return count / elapsed
+
+# Set up argument parser.
+parser = argparse.ArgumentParser()
+parser.add_argument('-n','--entries', default='10000,100000,1000000',
+    help='Comma-separated numbers of exact-match entries to try')
+parser.add_argument('-w','--wildcarded', type=int, default=16,
+    help='Number of wildcarded entries below the exact ones')
+parser.add_argument('-l','--lookups', type=int, default=1000,
+    help='Number of distinct packets to look up')
+parser.add_argument('-d','--duration', type=float, default=2.0,
+    help='Seconds to time lookups for')
+parser.add_argument('--linear-max', type=int, default=100000,
+    help='Largest table to time the linear scan on')
+parser.add_argument('--seed', type=int, default=0,
+    help='What random seed to use for this experiment.')
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    random.seed(args.seed)
+    for size in map(int, args.entries.split(',')):
+        table = FlowTable()
+        start = time.time()
+        for i in range(args.wildcarded):
+            table.add_entry(TableEntry(priority=i + 1, match=of.ofp_match(
+                dl_type=0x800, nw_dst=IPAddr(0x0a000000 + i)),
+                actions=[of.ofp_action_output(port=of.OFPP_CONTROLLER)]))
+        for i in range(size):
+            match = make_flow(i)[0]
+            table.add_entry(TableEntry(match=match,
+                actions=[of.ofp_action_output(port=2)]))
+        fill = time.time() - start
+        packets = [make_flow(random.randrange(size))[1]
+                   for i in range(args.lookups)]
+
+        indexed = lookups_per_second(FlowTable.entry_for_packet, table,
+                                     packets, args.duration)
+        line = '{:8} entries: filled in {:6.1f}s, {:8.0f} lookups/s'.format(
+               size, fill, indexed)
+        if size <= args.linear_max:
+            linear = lookups_per_second(linear_entry_for_packet, table,
+                                        packets[:10], args.duration)
+            line += ' (linear scan {:8.1f}/s, {:.0f}x)'.format(
+                    linear, indexed / linear)
+        print(line)
+        sys.stdout.flush()
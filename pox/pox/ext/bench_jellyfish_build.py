@@ -0,0 +1,105 @@
+#!/usr/bin/python
+
+"""
+Benchmarks building Jellyfish topologies: the links alone, with
+topologies.jellyfish_links against the construction JellyfishTopo used
+before it, and whole topologies, as a Mininet JellyfishTopo and as the
+TopologyGraph the controller uses.
+
+The old construction is quadratic in n, so it is only run up to
+--legacy-max switches.
+
+    e.g. python bench_jellyfish_build.py -n 100,500,1000,5000 -k 24 -r 12
+"""
+
+import argparse
+import random
+import sys
+import time
+from collections import defaultdict
+sys.path.append("../../")
+
+from topologies import topologies, jellyfish_graph, jellyfish_links
+
+def legacy_jellyfish_links(switches, r):
+    """
+    The construction JellyfishTopo used before jellyfish_links: a shuffle and
+    a scan of the remaining switches for every link added.
+    """
+    switch_ports_remaining = dict((s, r) for s in switches)
+    remaining_switches = list(switches)
+    connections = defaultdict(lambda: [])
+    temp_links = []
+
+    def find_available_pair():
+        random.shuffle(remaining_switches)
+        for s1 in remaining_switches:
+            for s2 in remaining_switches:
+                if s1 == s2: continue
+                if s2 in connections[s1]: continue
+                return (s1, s2)
+        return None
+
+    while True:
+        p = find_available_pair()
+        if not p: break
+        temp_links.append(p)
+        connections[p[0]].append(p[1])
+        connections[p[1]].append(p[0])
+        for s in p:
+            switch_ports_remaining[s] -= 1
+            if switch_ports_remaining[s] == 0:
+                remaining_switches.remove(s)
+
+    if remaining_switches:
+        s = remaining_switches[0]
+        connected = connections[s]
+        possible = filter(lambda l: l[0] not in connected and
+                          l[1] not in connected, temp_links)
+        if possible:
+            l = possible[0]
+            temp_links.remove(l)
+            temp_links.append((s, l[0]))
+            temp_links.append((s, l[1]))
+    return temp_links
+
+def time_links(fn, n, r, seed):
+    random.seed(seed)
+    switches = ['s{}'.format(i) for i in range(1, n + 1)]
+    start = time.time()
+    fn(switches, r)
+    return time.time() - start
+
+# Set up argument parser.
+parser = argparse.ArgumentParser()
+parser.add_argument('-n', default='100,250,500,1000,2500,5000',
+    help='Comma-separated numbers of switches')
+parser.add_argument('-k', type=int, default=24,
+    help='Ports per switch')
+parser.add_argument('-r', type=int, default=12,
+    help='Ports per switch connected to other switches')
+parser.add_argument('-s','--seed', type=int, default=0,
+    help='What random seed to use for this experiment.')
+parser.add_argument('--legacy-max', type=int, default=1000,
+    help='Largest n to run the old construction for')
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    print("%8s %12s %12s %10s %14s %14s" % ('n', 'old links', 'new links',
+        'speedup', 'JellyfishTopo', 'TopologyGraph'))
+    for n in [int(n) for n in args.n.split(',')]:
+        new = time_links(jellyfish_links, n, args.r, args.seed)
+        if n <= args.legacy_max:
+            old = time_links(legacy_jellyfish_links, n, args.r, args.seed)
+            old_str, speedup = '%11.3fs' % old, '%9.1fx' % (old / new)
+        else:
+            old_str, speedup = '%12s' % '-', '%10s' % '-'
+        start = time.time()
+        topologies['jelly'](random_seed=args.seed, n=n, k=args.k, r=args.r)
+        build = time.time() - start
+        start = time.time()
+        jellyfish_graph(random_seed=args.seed, n=n, k=args.k, r=args.r)
+        graph_build = time.time() - start
+        print("%8d %s %11.3fs %s %13.3fs %13.3fs" % (n, old_str, new, speedup,
+                                                     build, graph_build))
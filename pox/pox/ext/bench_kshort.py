@@ -0,0 +1,71 @@
+#!/usr/bin/python
+
+"""
+Benchmarks k-shortest-paths route computation on the switch graph of a
+Jellyfish topology: the generic NetworkX implementation of Yen's algorithm
+in yens.py against the unweighted one Routing uses.  Both run on the same
+random sample of switch pairs.  The unweighted one is checked against
+NetworkX's shortest_simple_paths; the generic one can return a path twice.
+
+    e.g. python bench_kshort.py -t jelly,686,24,12 -p 200
+"""
+
+import argparse
+import itertools
+import random
+import sys
+import time
+sys.path.append("../../")
+
+import networkx as nx
+
+from topologies import topologies
+from routing import k_shortest_paths
+import yens
+
+def pairs_per_second(fn, pairs):
+    start = time.time()
+    results = [fn(src, dst) for src, dst in pairs]
+    return len(pairs) / (time.time() - start), results
+
+# Set up argument parser.
+parser = argparse.ArgumentParser()
+parser.add_argument('-t','--topology', default='jelly,686,24,12',
+    help='Jellyfish topology as jelly,n,k,r')
+parser.add_argument('-k', type=int, default=8,
+    help='Number of shortest paths per switch pair')
+parser.add_argument('-s','--seed', type=int, default=0,
+    help='What random seed to use for this experiment.')
+parser.add_argument('-p','--pairs', type=int, default=200,
+    help='Number of random switch pairs to compute paths for')
+parser.add_argument('-c','--check', type=int, default=20,
+    help='Number of switch pairs to check path lengths of')
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    topo_name, n, k, r = args.topology.split(',')
+
+    topo = topologies['jelly'](random_seed=args.seed, n=int(n), k=int(k),
+                               r=int(r))
+    switches = sorted(topo.switches())
+    g = nx.Graph()
+    g.add_nodes_from(switches)
+    g.add_edges_from(l for l in topo.links() if l[0] in switches and
+                     l[1] in switches)
+
+    random.seed(args.seed)
+    pairs = [tuple(random.sample(switches, 2)) for i in range(args.pairs)]
+
+    before, old_paths = pairs_per_second(
+        lambda src, dst: yens.k_shortest_paths(g, src, dst, args.k)[1], pairs)
+    after, new_paths = pairs_per_second(
+        lambda src, dst: k_shortest_paths(g, src, dst, args.k), pairs)
+    for (src, dst), paths in zip(pairs[:args.check], new_paths):
+        shortest = itertools.islice(nx.shortest_simple_paths(g, src, dst),
+                                    args.k)
+        assert map(len, paths) == map(len, shortest)
+        assert len(set(map(tuple, paths))) == len(paths)
+
+    print('networkx yen: {:10.1f} pairs/s'.format(before))
+    print('unit yen:     {:10.1f} pairs/s ({:.1f}x)'.format(after,
+                                                          after / before))
@@ -0,0 +1,100 @@
+#!/usr/bin/python
+
+"""
+Benchmarks how fast libopenflow_01 packs and unpacks the messages a
+reactive controller handles most: flow_mods and packet_outs going out and
+packet_ins coming in.
+
+Flow_mods are timed three ways: packing one built beforehand, building an
+ofp_match and a flow_mod for every packet and packing them, and the same
+with an ofp_match_tuple instead of the ofp_match.  --baseline runs the same
+cases with another copy of libopenflow_01.py, e.g. one from an older
+checkout, to compare against.
+
+    e.g. python bench_of_pack.py -n 100000
+         python bench_of_pack.py --baseline /tmp/old/libopenflow_01.py
+"""
+
+import argparse
+import imp
+import sys
+import time
+sys.path.append("../../")
+
+import pox.openflow.libopenflow_01 as of
+from pox.lib.addresses import EthAddr, IPAddr
+
+def rate(fn, count, repeat):
+    "Returns the best calls/s of fn over repeat runs of count calls."
+    best = 0
+    for r in range(repeat):
+        start = time.time()
+        for i in xrange(count):
+            fn(i)
+        best = max(best, count / (time.time() - start))
+    return best
+
+def cases(of):
+    """
+    Returns [(name, fn)] of the cases to time with the libopenflow_01 of.
+    """
+    src, dst = EthAddr('00:00:00:00:00:01'), EthAddr('00:00:00:00:00:02')
+    nw_src, nw_dst = IPAddr('10.0.0.1'), IPAddr('10.0.0.2')
+    actions = [of.ofp_action_output(port=2)]
+
+    def flow_mod(i):
+        return of.ofp_flow_mod(xid=i, idle_timeout=10, buffer_id=i,
+                               actions=actions,
+                               match=of.ofp_match(in_port=1, dl_src=src,
+                                   dl_dst=dst, dl_type=0x800, nw_proto=6,
+                                   nw_src=nw_src, nw_dst=nw_dst,
+                                   tp_src=i & 0xffff, tp_dst=80))
+    prebuilt = flow_mod(1)
+    packet_in = of.ofp_packet_in(xid=1, in_port=1, buffer_id=1,
+                                 data='\xab' * 128).pack()
+    unpack_packet_in = of.ofp_packet_in.unpack_new
+
+    result = [
+        ('pack flow_mod', lambda i: prebuilt.pack()),
+        ('build+pack flow_mod', lambda i: flow_mod(i).pack()),
+    ]
+    if hasattr(of, 'ofp_match_tuple'):
+        def tuple_flow_mod(i):
+            return of.ofp_flow_mod(xid=i, idle_timeout=10, buffer_id=i,
+                                   actions=actions,
+                                   match=of.ofp_match_tuple.make(in_port=1,
+                                       dl_src=src, dl_dst=dst, dl_type=0x800,
+                                       nw_proto=6, nw_src=nw_src,
+                                       nw_dst=nw_dst, tp_src=i & 0xffff,
+                                       tp_dst=80)).pack()
+        result.append(('build+pack flow_mod (tuple)', tuple_flow_mod))
+    result += [
+        ('pack packet_out', lambda i: of.ofp_packet_out(xid=i, buffer_id=i,
+                                          in_port=1, actions=actions).pack()),
+        ('unpack packet_in', lambda i: unpack_packet_in(packet_in)),
+    ]
+    return result
+
+# Set up argument parser.
+parser = argparse.ArgumentParser()
+parser.add_argument('-n','--count', type=int, default=50000,
+    help='Messages per run')
+parser.add_argument('--repeat', type=int, default=3,
+    help='Number of runs to take the best of')
+parser.add_argument('--baseline',
+    help='Path of a libopenflow_01.py to compare against')
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    baseline = {}
+    if args.baseline:
+        old = imp.load_source('baseline_libopenflow_01', args.baseline)
+        for name, fn in cases(old):
+            baseline[name] = rate(fn, args.count, args.repeat)
+    for name, fn in cases(of):
+        after = rate(fn, args.count, args.repeat)
+        line = '{:28} {:10.0f} msgs/s'.format(name, after)
+        if name in baseline:
+            line += '  (baseline {:10.0f}, {:.2f}x)'.format(baseline[name],
+                                                        after / baseline[name])
+        print(line)
@@ -0,0 +1,141 @@
+#!/usr/bin/python
+
+"""
+Benchmarks how fast of_01.Connection.read takes OpenFlow messages off a
+socket and unpacks them: the old read(), which appended every recv to a
+string and re-sliced it, against the bytearray/recv_into one, at several
+read sizes.
+
+A child process writes a stream of PacketIns into one end of a socket pair
+in chunks of --chunk bytes, and a Connection reads the other end until it
+is closed.  Messages are counted by a PacketIn handler that does nothing
+else, so the numbers are for receiving and parsing alone.  The best of
+--repeat runs is reported.
+
+    e.g. python bench_of_read.py -n 200000 -d 128 -r 2048,16384,65536
+"""
+
+import argparse
+import multiprocessing
+import socket
+import sys
+import time
+sys.path.append("../../")
+
+import pox.core
+if pox.core.core is None:
+    pox.core.initialize() # pox.openflow needs core.getLogger to import
+import pox.openflow.libopenflow_01 as of
+import pox.openflow.of_01 as of_01
+
+class BenchConnection(of_01.Connection):
+    "A Connection that discards what it sends, e.g. the hello."
+    def send(self, data):
+        pass
+
+class LegacyConnection(BenchConnection):
+    "The old of_01 read path, for comparison."
+    def __init__(self, sock):
+        BenchConnection.__init__(self, sock)
+        self.buf = ''
+
+    def read(self):
+        try:
+            d = self.sock.recv(2048)
+        except:
+            return False
+        if len(d) == 0:
+            return False
+        self.buf += d
+        buf_len = len(self.buf)
+
+        offset = 0
+        while buf_len - offset >= 8:
+            ofp_type = ord(self.buf[offset+1])
+            if ord(self.buf[offset]) != of.OFP_VERSION:
+                if ofp_type != of.OFPT_HELLO:
+                    return False
+            msg_length = ord(self.buf[offset+2]) << 8 | ord(self.buf[offset+3])
+            if buf_len - offset < msg_length: break
+            new_offset, msg = of_01.unpackers[ofp_type](self.buf, offset)
+            assert new_offset - offset == msg_length
+            offset = new_offset
+            try:
+                of_01.handlers[ofp_type](self, msg)
+            except:
+                continue
+
+        if offset != 0:
+            self.buf = self.buf[offset:]
+        return True
+
+def make_stream(count, data_len):
+    messages = [of.ofp_packet_in(xid=i, in_port=1 + i % 48, buffer_id=i,
+                                 data='\xab' * data_len).pack()
+                for i in range(min(count, 1000))]
+    return ''.join(messages[i % len(messages)] for i in range(count))
+
+def write_stream(sock, stream, chunk):
+    for i in range(0, len(stream), chunk):
+        sock.sendall(stream[i:i+chunk])
+    sock.close()
+
+def messages_per_second(con_class, stream, chunk, count):
+    """
+    Returns messages/s and reads/s reading stream with a con_class.
+    """
+    received = [0]
+    def handle(con, msg):
+        received[0] += 1
+    old_handler = of_01.handlers[of.OFPT_PACKET_IN]
+    of_01.handlers[of.OFPT_PACKET_IN] = handle
+
+    reader, writer = socket.socketpair()
+    con = con_class(reader)
+    process = multiprocessing.Process(target=write_stream,
+                                      args=(writer, stream, chunk))
+    start = time.time()
+    process.start()
+    writer.close()
+    reads = 0
+    while con.read():
+        reads += 1
+    elapsed = time.time() - start
+    process.join()
+    reader.close()
+    of_01.handlers[of.OFPT_PACKET_IN] = old_handler
+
+    assert received[0] == count, (received[0], count)
+    return count / elapsed, reads / elapsed
+
+# Set up argument parser.
+parser = argparse.ArgumentParser()
+parser.add_argument('-n','--messages', type=int, default=200000,
+    help='Number of PacketIns to send')
+parser.add_argument('-d','--data', type=int, default=128,
+    help='Bytes of packet data in every PacketIn')
+parser.add_argument('-c','--chunk', type=int, default=65536,
+    help='Bytes the writer sends at a time')
+parser.add_argument('--repeat', type=int, default=3,
+    help='Number of runs to take the best of')
+parser.add_argument('-r','--read-sizes', default='2048,16384,65536',
+    help='Comma-separated read sizes to try')
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    stream = make_stream(args.messages, args.data)
+    print('{} PacketIns, {} bytes'.format(args.messages, len(stream)))
+
+    def best(con_class):
+        return max(messages_per_second(con_class, stream, args.chunk,
+                                       args.messages)
+                   for i in range(args.repeat))
+
+    before, reads = best(LegacyConnection)
+    print('legacy read (2048): {:10.0f} msgs/s {:8.0f} reads/s'.format(
+          before, reads))
+    for read_size in map(int, args.read_sizes.split(',')):
+        BenchConnection.read_size = read_size
+        after, reads = best(BenchConnection)
+        print('recv_into ({:>6}): {:10.0f} msgs/s {:8.0f} reads/s '
+              '({:.2f}x)'.format(read_size, after, reads, after / before))
@@ -0,0 +1,217 @@
+#!/usr/bin/python
+
+"""
+Runs sweeps of the controller-side experiments over Jellyfish topologies and
+routing schemes in parallel, and writes their results to a JSON file.
+
+There are two experiments:
+  - link_load: how many random permutation paths cross each link, as in
+    Figure 9 of the Jellyfish paper (see figure9.py).
+  - routes: route generation as the controller does it, with the time each
+    phase took.  It also fills the route cache, so that run.py's controller
+    starts without computing routes (see table1.sh).
+
+Every topology of the sweep (n, k, r, seed) is built once, before the
+process pool forks, so that workers share it.  Work is split into tasks, a
+chunk of a topology's host pairs for link_load and a routing scheme for
+routes, spread over the pool.  The shortest paths of a host pair are found
+once for all ECMP schemes, which only differ in how many of them they keep.
+
+    e.g. python experiments.py -n 25,50 -k 4 -r 3 --seeds 0,1,2 -o results.json
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import multiprocessing
+import sys
+import time
+sys.path.append("../../")
+
+import networkx as nx
+import numpy as np
+
+from topologies import jellyfish_graph
+from routing import Routing, k_shortest_paths
+from link_load import LinkLoad
+
+log = logging.getLogger('experiments')
+
+# How many of a host pair's shortest paths each ECMP scheme keeps, as in
+# routing.path_fn_for.
+ECMP_WAYS = {'ecmp': 8, 'ecmp8': 8, 'ecmp64': 64}
+
+# Per-process cache of (topology, host graph, LinkLoad), by (n, k, r, seed).
+_topologies = {}
+
+def topology(key):
+    "Returns (topo, host graph, LinkLoad) of the Jellyfish topology key."
+    if key not in _topologies:
+        n, k, r, seed = key
+        topo = jellyfish_graph(random_seed=seed, n=n, k=k, r=r)
+        g = nx.Graph()
+        g.add_nodes_from(topo.nodes())
+        g.add_edges_from(topo.links())
+        _topologies[key] = (topo, g, LinkLoad(topo))
+    return _topologies[key]
+
+def permutation_pairs(key):
+    "Returns the host pairs Routing.generate_random_permutation_paths uses."
+    topo, g, _ = topology(key)
+    return Routing(topo, 'ecmp', log, seed=key[3]).random_permutation_pairs(g)
+
+def _link_load_task(key, schemes, pairs):
+    """
+    Returns (key, scheme -> (number of paths, link counts)) for the paths
+    between pairs.
+    """
+    topo, g, link_load = topology(key)
+    paths = dict((s, []) for s in schemes)
+    for src, dst in pairs:
+        shortest = None
+        for s in schemes:
+            if s == 'kshort':
+                paths[s].extend(k_shortest_paths(g, src, dst, k=8))
+                continue
+            if shortest is None:
+                shortest = list(nx.all_shortest_paths(g, src, dst))
+            paths[s].extend(shortest[:ECMP_WAYS[s]])
+    return key, dict((s, (len(p), link_load.count(p)))
+                     for s, p in paths.iteritems())
+
+def _routes_task(key, rproto, cache_dir):
+    "Returns (key, rproto, phase timings, route cache file) of key's routes."
+    topo = topology(key)[0]
+    routing = Routing(topo, rproto, log, seed=key[3], cache_dir=cache_dir)
+    routing.generate_rtable()
+    return key, rproto, dict(routing.timings), routing.route_cache_file()
+
+def _run_task(task):
+    fn, args = task
+    return fn, fn(*args)
+
+def _record(experiment, key, rproto, **results):
+    n, k, r, seed = key
+    record = {'experiment': experiment, 'n': n, 'k': k, 'r': r, 'seed': seed,
+              'routing': rproto}
+    record.update(results)
+    return record
+
+def run_sweep(keys, link_load_routing=(), routes_routing=(), workers=None,
+              cache_dir=None):
+    """
+    Runs the experiments for every topology in keys, (n, k, r, seed), and
+    returns a list of result records, in the order of keys and routing.
+
+    workers is the number of processes to use, or None for one per CPU.
+    """
+    workers = workers or multiprocessing.cpu_count()
+    pairs = dict((key, permutation_pairs(key)) for key in keys)
+
+    # Route generation takes the longest, so it goes first.  A few link_load
+    # chunks per worker, so that uneven chunks even out.
+    tasks = [(_routes_task, (key, rproto, cache_dir))
+             for key in keys for rproto in routes_routing]
+    if link_load_routing:
+        chunks = max(1, workers * 4 // len(keys))
+        for key in keys:
+            size = max(1, -(-len(pairs[key]) // chunks))
+            tasks.extend((_link_load_task,
+                          (key, list(link_load_routing), pairs[key][i:i + size]))
+                         for i in range(0, len(pairs[key]), size))
+
+    if workers <= 1:
+        results = map(_run_task, tasks)
+    else:
+        pool = multiprocessing.Pool(workers)
+        try:
+            results = pool.map(_run_task, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    routes = {}
+    link_loads = {}
+    for key in keys:
+        zeros = np.zeros(len(topology(key)[2].links), dtype=np.int64)
+        link_loads[key] = dict((s, (0, zeros)) for s in link_load_routing)
+    for fn, result in results:
+        if fn is _routes_task:
+            key, rproto, timings, cache_file = result
+            routes[(key, rproto)] = (timings, cache_file)
+        else:
+            key, counts = result
+            totals = link_loads[key]
+            for s, (paths, link_counts) in counts.iteritems():
+                totals[s] = (totals[s][0] + paths, totals[s][1] + link_counts)
+
+    records = []
+    for key in keys:
+        for rproto in routes_routing:
+            timings, cache_file = routes[(key, rproto)]
+            records.append(_record('routes', key, rproto, timings=timings,
+                                   seconds=sum(timings.values()),
+                                   cache_file=cache_file))
+        for s in link_load_routing:
+            paths, link_counts = link_loads[key][s]
+            link_counts = sorted(np.asarray(link_counts).tolist())
+            records.append(_record('link_load', key, s,
+                                   pairs=len(pairs[key]), paths=paths,
+                                   link_counts=link_counts,
+                                   mean=float(sum(link_counts)) / len(link_counts),
+                                   max=link_counts[-1]))
+    return records
+
+def write_results(filename, records, **info):
+    "Writes records, and any other info given, to filename as JSON."
+    results = dict(info)
+    results['results'] = records
+    with open(filename, 'w') as f:
+        json.dump(results, f, indent=1, sort_keys=True)
+
+def _ints(s):
+    return [int(x) for x in s.split(',') if x]
+
+def _names(s):
+    return [x for x in s.split(',') if x]
+
+# Set up argument parser.
+parser = argparse.ArgumentParser()
+parser.add_argument('-n', type=_ints, default=[25],
+    help='Comma-separated numbers of switches')
+parser.add_argument('-k', type=_ints, default=[4],
+    help='Comma-separated numbers of ports per switch')
+parser.add_argument('-r', type=_ints, default=[],
+    help='Comma-separated numbers of ports to other switches (default k-1)')
+parser.add_argument('-s','--seeds', type=_ints, default=[0],
+    help='Comma-separated random seeds of topologies and traffic')
+parser.add_argument('-l','--link-load', type=_names,
+    default=['kshort', 'ecmp8', 'ecmp64'],
+    help='Comma-separated routing schemes to analyze link load of')
+parser.add_argument('--routes', type=_names, default=[],
+    help='Comma-separated routing schemes to generate routes for')
+parser.add_argument('-c','--route-cache', default='__route_cache',
+    help='Directory to cache generated routes in, shared with run.py')
+parser.add_argument('--no-route-cache', action='store_true',
+    help='Always compute routes, instead of reusing cached ones')
+parser.add_argument('-w','--workers', type=int, default=None,
+    help='Number of processes to use (default: one per CPU)')
+parser.add_argument('-o','--out', default='results.json',
+    help='File to write results to')
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    keys = [(n, k, r, seed)
+            for n, k, seed in itertools.product(args.n, args.k, args.seeds)
+            for r in (args.r or [k - 1])]
+    cache_dir = None if args.no_route_cache else args.route_cache
+
+    start = time.time()
+    records = run_sweep(keys, args.link_load, args.routes, args.workers,
+                        cache_dir)
+    elapsed = time.time() - start
+    write_results(args.out, records, elapsed=elapsed,
+                  workers=args.workers or multiprocessing.cpu_count())
+    print('{} experiments on {} topologies in {:.1f}s, written to {}'.format(
+          len(records), len(keys), elapsed, args.out))
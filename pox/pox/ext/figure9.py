@@ -5,23 +5,14 @@ import time
 
 import sys
 sys.path.append("../../")
-from pox.core import core
-from topologies import JellyfishTopo
-from routing import Routing
+from experiments import run_sweep, write_results
 
 """
 Reproduce Figure 9 from https://people.inf.ethz.ch/asingla/papers/jellyfish-nsdi12.pdf
-and save to 'figure9.png'
+and save to 'figure9.png', and the link loads plotted to 'figure9.json'
 """
-log = core.getLogger()
-
-def plot_line(topo, proto, label, color, linestyle='-', linewidth=2):
-    start = time.time()
-
-    routing = Routing(topo, proto, log)
-    paths = routing.generate_random_permutation_paths()
-    edge_counts = sorted(routing.edge_counts(paths).values())
 
+def plot_line(edge_counts, label, color, linestyle='-', linewidth=2):
     x = [0]
     y = [0]
     for i in range(len(edge_counts)):
@@ -36,25 +27,22 @@ def plot_line(topo, proto, label, color, linestyle='-', linewidth=2):
     plt.plot(x, y, color=color, linestyle=linestyle,
         linewidth=linewidth, label=label)
 
-    finish = time.time()
-    log.info('{} ran in: {}'.format(label, finish - start))
-
-def figure9():
+def figure9(workers=None):
+    print("Analyzing kshort, ecmp8 and ecmp64 paths...")
     start = time.time()
-    topo = JellyfishTopo(n=686, k=7)
-    topo_build_time = time.time() - start
-    log.info('Topology built in: {}'.format(topo_build_time))
+    records = run_sweep([(686, 7, 6, 0)], ['kshort', 'ecmp8', 'ecmp64'],
+                        workers=workers)
+    print("Paths analyzed in: %.1fs" % (time.time() - start))
+    write_results('figure9.json', records)
+    counts = dict((r['routing'], r['link_counts']) for r in records)
 
     plt.grid(True)
     plt.ylabel('# Distinct Paths Link is on')
     plt.xlabel('Rank of Link')
 
-    print("Started analyzing kshort paths...")
-    plot_line(topo, 'kshort', '8 Shortest Paths', 'blue', linewidth=7)
-    print("Finished kshort. Starting ecmp8...")
-    plot_line(topo, 'ecmp8', '8-way ECMP', 'olive')
-    print("Finished ecmp64. Starting ecmp64...")
-    plot_line(topo, 'ecmp64', '64-way ECMP', 'red', linestyle=':')
+    plot_line(counts['kshort'], '8 Shortest Paths', 'blue', linewidth=7)
+    plot_line(counts['ecmp8'], '8-way ECMP', 'olive')
+    plot_line(counts['ecmp64'], '64-way ECMP', 'red', linestyle=':')
 
     plt.legend(loc=2)
     plt.savefig('figure9.png')
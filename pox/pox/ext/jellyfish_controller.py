@@ -18,16 +18,21 @@ JellyfishController class.
 
 import sys
 import os
+import signal
 sys.path.append("../../")
 from pox.core import core
 from pox.lib.util import dpidToStr
-from utils import build_topology, dpid_to_str
+from utils import build_topology, dpid_to_str, read_jellyconfig
 from pox.lib.revent import EventMixin
 import pox.openflow.libopenflow_01 as of
+import pox.openflow.nicira as nx
 from routing import Routing
 from switch import Switch
-from pox.lib.packet import ipv4, tcp, udp
-from topologies import topologies
+from pox.lib.packet.ethernet import ethernet, ETHER_BROADCAST
+from zlib import crc32
+from pox.lib.addresses import EthAddr
+from topologies import jellyfish_graph, node_name_to_dpid
+from tracing import Tracer
 
 class FakeLogger():
   def info(self, txt):
@@ -35,6 +40,30 @@ class FakeLogger():
 
 log = core.getLogger() if core else FakeLogger()
 
+# How the controller gets forwarding rules into the switches:
+#   reactive:  install an exact-match rule per flow on its first PacketIn.
+#   proactive: push every switch's rules from the routing tables as soon as
+#              the switch comes up, so steady-state traffic never reaches
+#              the controller.
+#   aggregate: like proactive, but with rules per destination host and
+#              bucket of sources instead of per host pair, so flow tables
+#              stay small (see Routing.generate_aggregate_rules).
+#   multipath: like aggregate, but switches hash each flow onto one of the
+#              next hops themselves, with Nicira extensions, so it needs
+#              Open vSwitch.
+MODES = ['reactive', 'proactive', 'aggregate', 'multipath']
+
+# Priorities of aggregate rules: those of a bucket of sources override the
+# one for all traffic to the destination.
+AGGREGATE_PRIORITY = of.OFP_DEFAULT_PRIORITY
+AGGREGATE_BUCKET_PRIORITY = of.OFP_DEFAULT_PRIORITY + 1
+
+# Multipath pipeline: the hash table picks a next hop per flow and stores
+# its index in MULTIPATH_REG, and the forward table outputs on it.
+MULTIPATH_HASH_TABLE = 0
+MULTIPATH_FORWARD_TABLE = 1
+MULTIPATH_REG = nx.NXM_NX_REG0
+
 class JellyfishController (EventMixin):
   """
   An JellyfishController object is created once, and it is in charge of instantiating
@@ -46,8 +75,16 @@ class JellyfishController (EventMixin):
   The Jellyfish Controller consumes ALL packet_in events and demultiplexes
   them to the correct switch and switch action, after determining what
   action must occur using an internal routing class.
+
+  In proactive mode (see MODES), all forwarding rules are installed on
+  ConnectionUp, and PacketIns only happen for traffic the routing tables
+  don't know about.
+
+  What happens per packet is traced to self.tracer (see tracing.py) rather
+  than logged.
   """
-  def __init__ (self, topology, routing):
+  def __init__ (self, topology, routing, mode='reactive', tracer=None,
+                buckets=4):
     # Keep track of the connection to the switch so that we can
     # send it messages!
     self.routing = routing
@@ -56,12 +93,26 @@ class JellyfishController (EventMixin):
     self.routing = routing  # Master Routing object, passed in and reused.
     self.all_switches_up = False  # Sequences event handling.
     self.switch_dst_eth_seen = [] # Keeps track of what (switch, dst_eth) pairs we've seen
+    self.tracer = tracer if tracer is not None else Tracer(sample=0)
+
+    if mode not in MODES: raise Exception('Unknown controller mode')
+    self.mode = mode
+    if self.mode == 'proactive':
+      self.routing.generate_switch_rules()
+    elif self.mode == 'aggregate':
+      self.routing.generate_aggregate_rules(buckets)
+    elif self.mode == 'multipath':
+      self.routing.generate_multipath_rules()
 
     # Make this controller listen to openflow events, like when switches come up
     # or when a packet comes into a switch.
     self.listenTo(core.openflow, priority=0)
 
-  def forward(self, connection, packet, switch, egress_port):
+    # With openflow.of_01 --workers, also route around failures of switches
+    # connected to other processes (see _handle_GoingUpEvent).
+    self.listenTo(core)
+
+  def forward(self, connection, packet, switch, egress_port, packet_in):
     """
     Forward a packet along the given egress port of
     the given switch.
@@ -69,13 +120,17 @@ class JellyfishController (EventMixin):
     Forwarding actually only happens the first time, because the first time
     we install a flow rule in the switch so that we don't have to get repeated
     requests for an egress port.
+
+    packet_in is the PacketIn the packet came in.  If the switch buffered
+    the packet, the flow_mod releases it (see Switch.send_flow_mod_and_packet).
     """
 
    # if (switch, packet.dst) in self.switch_dst_eth_seen:
       # This should not happen
     #  log.warn("Saw packet heading to to the same place on same switch again :(")
 
-    log.info("Sending packet out of port %d from switch %d" % (egress_port, switch.dpid))
+    self.tracer.trace('forward', "Sending packet out of port %d from switch %d",
+                      egress_port, switch.dpid)
 
     # 1) Tell the switch to always send these packets with these
     #    hash properties from this port
@@ -84,22 +139,205 @@ class JellyfishController (EventMixin):
     msg.match.dl_dst = packet.dst
     msg.match.dl_src = packet.src
     msg.match.dl_type = packet.type
-    if isinstance(packet.next, ipv4):
-      ip = packet.next
-      msg.match.nw_proto = ip.protocol
-      msg.match.nw_dst = ip.dstip.toUnsigned()
-      msg.match.nw_src = ip.srcip.toUnsigned()
-      if isinstance(ip.next, tcp) or isinstance(ip.next, udp):
-        l4 = ip.next
-        msg.match.tp_src = l4.srcport
-        msg.match.tp_dst = l4.dstport
+    if packet.type == ethernet.IP_TYPE and packet.is_ipv4:
+      msg.match.nw_proto = packet.nw_proto
+      msg.match.nw_dst = packet.nw_dst
+      msg.match.nw_src = packet.nw_src
+      if packet.tp_src is not None:
+        msg.match.tp_src = packet.tp_src
+        msg.match.tp_dst = packet.tp_dst
     msg.actions.append(of.ofp_action_output(port = egress_port))
-    connection.send(msg)
 
     #self.switch_dst_eth_seen.append((switch, packet.dst))
 
     # 2) But send we have to send this packet out ourselves..
-    switch.send_packet_data(egress_port, packet)
+    switch.send_flow_mod_and_packet(msg, packet_in, egress_port)
+
+  def install_switch_rules(self, connection, switch_name):
+    """
+    Pushes all of the forwarding rules the routing tables have for
+    the given switch.  What they match on depends on the mode:
+
+      proactive: (dl_src, dl_dst), with everything else wildcarded, so
+        one rule covers every flow between a pair of hosts.
+      aggregate: dl_dst, for the traffic to a host from anywhere, and at a
+        higher priority dl_dst plus each of the nw_src prefixes of a bucket
+        of sources that takes another path.
+      multipath: dl_dst in the Nicira hash table, which outputs on the one
+        port or hashes the flow into reg0 and resubmits, and (dl_dst, reg0)
+        in the forward table, which outputs on the port picked.
+    """
+    if self.mode == 'aggregate':
+      rules = self.routing.aggregate_rules.get(switch_name, {})
+      for (dst_mac, bucket), egress_port in rules.iteritems():
+        for msg in self._aggregate_flow_mods(dst_mac, bucket, egress_port):
+          connection.send(msg)
+    elif self.mode == 'multipath':
+      rules = []
+      dsts = self.routing.multipath_rules.get(switch_name, {})
+      for dst_mac, ports in dsts.iteritems():
+        rules.extend(self._multipath_flow_mods(switch_name, dst_mac, ports))
+      for msg in rules:
+        connection.send(msg)
+    else:
+      rules = self.routing.switch_rules.get(switch_name, {})
+      for (src_mac, dst_mac), egress_port in rules.iteritems():
+        connection.send(self._pair_flow_mod(src_mac, dst_mac, egress_port))
+
+    log.info("Installed %d rules on switch %s" % (len(rules), switch_name))
+
+  def _pair_flow_mod(self, src_mac, dst_mac, egress_port=None):
+    """
+    Returns a flow_mod for all traffic between a pair of hosts: one that
+    outputs it on egress_port, or deletes its rules if egress_port is None.
+    """
+    if egress_port is None:
+      msg = of.ofp_flow_mod(command=of.OFPFC_DELETE)
+    else:
+      msg = of.ofp_flow_mod()
+      msg.actions.append(of.ofp_action_output(port = egress_port))
+    msg.match.dl_src = EthAddr(src_mac)
+    msg.match.dl_dst = EthAddr(dst_mac)
+    return msg
+
+  def _aggregate_flow_mods(self, dst_mac, bucket, egress_port=None):
+    """
+    Returns the flow_mods for the traffic to a host from a bucket of
+    sources (all of it if bucket is None), one per nw_src prefix of the
+    bucket: ones that output it on egress_port, or that delete its rules if
+    egress_port is None.
+    """
+    def flow_mod():
+      if egress_port is None:
+        msg = of.ofp_flow_mod(command=of.OFPFC_DELETE_STRICT)
+      else:
+        msg = of.ofp_flow_mod()
+        msg.actions.append(of.ofp_action_output(port = egress_port))
+      msg.match.dl_dst = EthAddr(dst_mac)
+      return msg
+
+    if bucket is None:
+      msg = flow_mod()
+      msg.priority = AGGREGATE_PRIORITY
+      return [msg]
+    msgs = []
+    for prefix in self.routing.aggregate_prefixes(bucket):
+      msg = flow_mod()
+      msg.priority = AGGREGATE_BUCKET_PRIORITY
+      msg.match.dl_type = ethernet.IP_TYPE
+      msg.match.set_nw_src(*prefix)
+      msgs.append(msg)
+    return msgs
+
+  def _multipath_flow_mods(self, switch_name, dst_mac, ports=None):
+    """
+    Returns the flow_mods that send the traffic to a host out of one of
+    ports, picked per flow by the switch, or that delete its rules if ports
+    is None.
+
+    With a single port, the hash table outputs on it directly.  Otherwise,
+    it hashes the flow into MULTIPATH_REG and resubmits to the forward
+    table, which has a rule per port.  The hash is seeded per switch, so
+    that switches along a path do not all make the same choice.
+    """
+    if ports is None:
+      msgs = []
+      for table in (MULTIPATH_HASH_TABLE, MULTIPATH_FORWARD_TABLE):
+        msg = nx.nx_flow_mod(command=of.OFPFC_DELETE, table_id=table)
+        msg.match.eth_dst = EthAddr(dst_mac)
+        msgs.append(msg)
+      return msgs
+
+    msg = nx.nx_flow_mod(table_id=MULTIPATH_HASH_TABLE)
+    msg.match.eth_dst = EthAddr(dst_mac)
+    if len(ports) == 1:
+      msg.actions.append(of.ofp_action_output(port = ports[0]))
+      return [msg]
+    msg.actions.append(nx.nx_action_multipath(
+        fields=nx.NX_HASH_FIELDS_SYMMETRIC_L4,
+        basis=crc32(switch_name) & 0xffff,
+        algorithm=nx.NX_MP_ALG_HASH_THRESHOLD,
+        max_link=len(ports) - 1, dst=MULTIPATH_REG, nbits=16))
+    msg.actions.append(nx.nx_action_resubmit.resubmit_table(
+        table=MULTIPATH_FORWARD_TABLE))
+    msgs = [msg]
+    for i, port in enumerate(ports):
+      msg = nx.nx_flow_mod(table_id=MULTIPATH_FORWARD_TABLE)
+      msg.match.eth_dst = EthAddr(dst_mac)
+      msg.match.reg0 = i
+      msg.actions.append(of.ofp_action_output(port = port))
+      msgs.append(msg)
+    return msgs
+
+  def update_switch_rules(self, changes):
+    """
+    Brings flow tables in line with repaired routes, touching only the
+    switches and host pairs in changes (see Routing.remove_link).
+
+    Stale rules of a host pair are deleted, which also removes the exact-match
+    rules installed reactively for its flows, so that their next packet
+    comes back to the controller.  In proactive mode, the pair's new rule
+    replaces the old one instead.
+    """
+    if self.mode == 'aggregate':
+      self._update_aggregate_rules()
+      return
+    if self.mode == 'multipath':
+      self._update_multipath_rules()
+      return
+    for switch_name, pairs in changes.iteritems():
+      switch = self.switches.get(node_name_to_dpid(switch_name))
+      if switch is None or switch.connection is None: continue
+      rules = {}
+      if self.mode == 'proactive':
+        rules = self.routing.switch_rules.get(switch_name, {})
+      for src_mac, dst_mac in pairs:
+        egress_port = rules.get((src_mac, dst_mac))
+        switch.connection.send(self._pair_flow_mod(src_mac, dst_mac,
+                                                   egress_port))
+      switch.connection.send(of.ofp_barrier_request())
+
+    log.info("Updated rules on %d switches" % (len(changes),))
+
+  def _update_aggregate_rules(self):
+    """
+    Replaces the aggregate rules that repaired routes changed.
+    """
+    changes = self.routing.update_aggregate_rules()
+    for switch_name, keys in changes.iteritems():
+      switch = self.switches.get(node_name_to_dpid(switch_name))
+      if switch is None or switch.connection is None: continue
+      rules = self.routing.aggregate_rules.get(switch_name, {})
+      for dst_mac, bucket in keys:
+        for msg in self._aggregate_flow_mods(dst_mac, bucket,
+                                             rules.get((dst_mac, bucket))):
+          switch.connection.send(msg)
+      switch.connection.send(of.ofp_barrier_request())
+
+    log.info("Updated aggregate rules on %d switches" % (len(changes),))
+
+  def _update_multipath_rules(self):
+    """
+    Replaces the multipath rules of the destinations whose next hops
+    repaired routes changed.
+    """
+    changes = self.routing.update_multipath_rules()
+    for switch_name, dsts in changes.iteritems():
+      switch = self.switches.get(node_name_to_dpid(switch_name))
+      if switch is None or switch.connection is None: continue
+      rules = self.routing.multipath_rules.get(switch_name, {})
+      for dst_mac in dsts:
+        # Clear both tables first: the destination may have fewer next
+        # hops than before.
+        msgs = self._multipath_flow_mods(switch_name, dst_mac)
+        if dst_mac in rules:
+          msgs += self._multipath_flow_mods(switch_name, dst_mac,
+                                            rules[dst_mac])
+        for msg in msgs:
+          switch.connection.send(msg)
+      switch.connection.send(of.ofp_barrier_request())
+
+    log.info("Updated multipath rules on %d switches" % (len(changes),))
 
   def _handle_ConnectionUp (self, event):
     """
@@ -107,8 +345,8 @@ class JellyfishController (EventMixin):
     and registers it in the controller.
     """
     log.info('Connection up')
-    log.info(event.connection.features)
-    log.info(event.ofp)
+    log.debug("%s", event.connection.features)
+    log.debug("%s", event.ofp)
     switch_dpid = event.dpid
     switch = self.switches.get(event.dpid)
 
@@ -140,11 +378,60 @@ class JellyfishController (EventMixin):
     # But does not affect ping all success.
     clear = of.ofp_flow_mod(command=of.OFPFC_DELETE)
     event.connection.send(clear)
+
+    if self.mode == 'multipath':
+      # Lets flow_mods pick a table.  Sent after the clear, which then
+      # still covers every table.
+      event.connection.send(nx.nx_flow_mod_table_id())
+
+    if self.mode in ('proactive', 'aggregate', 'multipath'):
+      self.install_switch_rules(event.connection, switch_name_str)
+
     event.connection.send(of.ofp_barrier_request())
 
 
+  def _handle_GoingUpEvent (self, event):
+    if core.hasComponent('openflow_shards'):
+      self.listenTo(core.openflow_shards)
+
   def _handle_ConnectionDown (self, event):
-    self.switches.get(event.dpid).disconnect()
+    switch = self.switches.get(event.dpid)
+    if switch is None: return
+    switch.disconnect()
+    self._route_around_switch(event.dpid)
+
+  def _handle_RemoteConnectionDown (self, event):
+    """
+    A switch of another of_01 shard went down.  Every shard keeps its own
+    routing tables, and updates the rules of its own switches.
+    """
+    if dpid_to_str(event.dpid) in self.routing.graph:
+      self._route_around_switch(event.dpid)
+
+  def _route_around_switch (self, dpid):
+    # Route around the switch, unless everything is going down.
+    if not core.running: return
+    changes = self.routing.remove_switch(dpid_to_str(dpid))
+    self.update_switch_rules(changes)
+
+  def _handle_PortStatus (self, event):
+    """
+    Routes around links between switches that go down.
+
+    Also handles RemotePortStatus, for switches of other of_01 shards.
+    """
+    desc = event.ofp.desc
+    down = (event.deleted or desc.state & of.OFPPS_LINK_DOWN or
+            desc.config & of.OFPPC_PORT_DOWN)
+    if not down: return
+
+    switch_name = dpid_to_str(event.dpid)
+    for peer, port in self.routing.port_map.get(switch_name, {}).items():
+      if port == event.port and peer in self.routing.graph:
+        changes = self.routing.remove_link(switch_name, peer)
+        self.update_switch_rules(changes)
+
+  _handle_RemotePortStatus = _handle_PortStatus
 
   def _handle_PacketIn (self, event):
     """
@@ -158,13 +445,13 @@ class JellyfishController (EventMixin):
     switch_dpid = event.dpid
 
 
-    # Get packet data
-    packet = event.parsed
+    # Get packet data.  Only header fields are needed, so don't parse it.
+    packet = event.headers
     if not packet.parsed:
       log.warning("Ignoring incomplete packet.")
       return
 
-    if str(packet.dst) == "ff:ff:ff:ff:ff:ff":
+    if packet.dst == ETHER_BROADCAST:
       # We should not be dealing with any broadcast packets.
       # These are usually DHCP, we can ignore since we have knowledge
       # of all topology addressing.
@@ -191,12 +478,20 @@ class JellyfishController (EventMixin):
         log.warning("Saw an event for a switch that hasn't come up. Ignoring.")
         return
 
+    if egress_port is None:
+        log.warning("No route for %s -> %s. Dropping." % (packet.src, packet.dst))
+        return
+
     # Send packet along
-    self.forward(event.connection, packet, switch, egress_port)
+    self.forward(event.connection, packet, switch, egress_port, event.ofp)
+
+# How long an of_01 shard other than the first waits for the first one's
+# routes to show up in the route cache, before computing its own.
+SHARD_ROUTE_WAIT = 60
 
-def launch ():
+def launch (config = 'pox/ext/__jellyconfig'):
   """
-  Starts the Controller:
+  Starts the Controller, configured by the file run.py writes:
 
       - topo is a string with comma-separated arguments specifying what
         topology to build.
@@ -204,6 +499,23 @@ def launch ():
 
       - routing is a string indicating what routing mechanism to use:
           e.g.: 'ecmp8', 'kshort'
+
+      - mode is one of MODES, and defaults to 'reactive'.
+
+      - buckets is the number of source buckets per destination in
+        aggregate mode, and defaults to 4.
+
+      - workers is the number of processes used to compute routes.
+
+      - route_cache is the directory computed routes are cached in, and
+        defaults to pox/ext/__route_cache.  Empty to not cache routes.
+
+      - trace_sample is how many packets there are per one traced (see
+        tracing.py), and defaults to 100.  0 to trace none.  trace_size is
+        how many trace records are kept, and defaults to 4096.  Send the
+        controller SIGUSR1 to dump them to stderr.
+
+  config is the path of that file, relative to the POX directory.
   """
 
   # NOTE: currently only support jellyfish topology.
@@ -212,19 +524,35 @@ def launch ():
   # Read out configuration from file.
 
   # NOTE: assumes jellyfish has been installed in the home directory.
-  config_loc = 'pox/ext/__jellyconfig'
-  with open(config_loc, 'r', os.O_NONBLOCK) as config_file:
-    log.info("inside")
-    n = int(config_file.readline().split('=')[1])
-    k = int(config_file.readline().split('=')[1])
-    r = int(config_file.readline().split('=')[1])
-    seed = int(config_file.readline().split('=')[1])
-    routing = config_file.readline().split('=')[1].strip()
-
-  jelly_topology = topologies["jelly"](random_seed=seed, n=n, k=k, r=r)
-  my_routing = Routing(jelly_topology, routing, log, seed=seed)
+  config = read_jellyconfig(config)
+  n = int(config['n'])
+  k = int(config['k'])
+  r = int(config['r'])
+  seed = int(config['seed'])
+  routing = config['routing']
+  mode = config.get('mode', 'reactive')
+  buckets = int(config.get('buckets', 4))
+  workers = int(config.get('workers', 1))
+  cache_dir = config.get('route_cache', 'pox/ext/__route_cache') or None
+  tracer = Tracer(size=int(config.get('trace_size', 4096)),
+                  sample=int(config.get('trace_sample', 100)))
+
+  # With openflow.of_01 --workers, shard 0 computes the routes and writes
+  # them to the route cache before it starts the other shards, which only
+  # load them from there (see openflow.shards).
+  from pox.openflow.shards import SHARD_ENV
+  shard = int(os.environ.get(SHARD_ENV, 0))
+
+  jelly_topology = jellyfish_graph(random_seed=seed, n=n, k=k, r=r)
+  my_routing = Routing(jelly_topology, routing, log, seed=seed, workers=workers,
+                       cache_dir=cache_dir,
+                       cache_wait=SHARD_ROUTE_WAIT if shard else 0)
   my_routing.generate_rtable()
-  core.registerNew(JellyfishController, jelly_topology, my_routing)
+  core.registerNew(JellyfishController, jelly_topology, my_routing, mode,
+                   tracer, buckets)
+
+  if hasattr(signal, 'SIGUSR1'):
+    signal.signal(signal.SIGUSR1, lambda signum, frame: tracer.dump())
 
 
 # for debugging
@@ -0,0 +1,62 @@
+"""
+Vectorized link-load analysis: how many of a set of paths use each link of
+a topology, as in Figure 9 of the Jellyfish paper.
+
+Links get integer ids, in topo.links() order, and every path hop is mapped
+to one with a binary search over a sorted array of link keys, so counting
+is a single np.bincount over the hops of all paths.
+
+    e.g. load = LinkLoad(topo).count(routing.generate_random_permutation_paths())
+"""
+
+import numpy as np
+
+
+class LinkLoad(object):
+    def __init__(self, topo):
+        self.links = [(l[0], l[1]) for l in topo.links()]
+        self.node_ids = dict((n, i) for i, n in enumerate(topo.nodes()))
+        self.num_nodes = len(self.node_ids)
+
+        ends = np.array([(self.node_ids[a], self.node_ids[b])
+                         for a, b in self.links], dtype=np.int64)
+        keys = self._keys(ends[:, 0], ends[:, 1])
+        self.order = np.argsort(keys, kind='mergesort')
+        self.sorted_keys = keys[self.order]
+
+    def _keys(self, a, b):
+        "Return a key per link between nodes a and b, the same both ways."
+        return np.minimum(a, b) * self.num_nodes + np.maximum(a, b)
+
+    def link_ids(self, paths):
+        """
+        Returns the id of the link of every hop of every path, as one array.
+        """
+        node_ids = self.node_ids
+        nodes = np.fromiter((node_ids[n] for p in paths for n in p),
+                            dtype=np.int64)
+        if len(nodes) < 2:
+            return np.zeros(0, dtype=np.int64)
+        # Drop the "hops" from the last node of a path to the next one's first.
+        hops = np.ones(len(nodes) - 1, dtype=bool)
+        path_ends = np.cumsum([len(p) for p in paths])
+        hops[path_ends[path_ends < len(nodes)] - 1] = False
+
+        keys = self._keys(nodes[:-1][hops], nodes[1:][hops])
+        positions = np.searchsorted(self.sorted_keys, keys)
+        positions[positions == len(self.sorted_keys)] = 0
+        if (self.sorted_keys[positions] != keys).any():
+            raise Exception('Path uses a link that is not in the topology')
+        return self.order[positions]
+
+    def count(self, paths):
+        """
+        Returns an array with the number of paths that use each link, indexed
+        by link id.  A path that crosses a link twice counts twice.
+        """
+        return np.bincount(self.link_ids(paths), minlength=len(self.links))
+
+    def edge_counts(self, paths):
+        "Returns the same map as Routing.edge_counts."
+        return dict((tuple(sorted(l)), c)
+                    for l, c in zip(self.links, self.count(paths).tolist()))
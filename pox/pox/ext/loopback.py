@@ -0,0 +1,219 @@
+"""
+In-process loopback emulation of a topology, for exercising controllers
+without Mininet.
+
+Every switch in the topology becomes a pox.datapaths SoftwareSwitch, and
+every switch talks to the controller through a LoopbackConnection: a real
+of_01.Connection whose socket is replaced by a message queue.  Messages are
+packed and unpacked on both ends, so the controller goes through the normal
+OpenFlow handshake and sees exactly what it would see on the wire.
+
+NOTE: outside of pox.py, pox.core must be initialized and pox.openflow
+      launched before this module is imported:
+
+        import pox.core
+        pox.core.initialize()
+        import pox.openflow
+        pox.openflow.launch()
+"""
+
+from collections import defaultdict, deque
+
+from pox.core import core
+import pox.openflow.libopenflow_01 as of
+import pox.openflow.of_01 as of_01
+from pox.openflow import ConnectionIn
+from pox.datapaths.switch import SoftwareSwitch, DpPacketOut
+
+from topologies import node_name_to_dpid
+from utils import make_tcp_packet
+
+
+class _DatapathEnd (object):
+  """
+  The switch's end of a LoopbackConnection.
+
+  Implements the part of datapaths.switch.OFConnection a SoftwareSwitch uses.
+  """
+  def __init__ (self, connection):
+    self.connection = connection
+    self.on_message_received = None
+    self.on_messages_done = None
+
+  def set_message_handler (self, handler):
+    self.on_message_received = handler
+
+  def send (self, data):
+    if type(data) is not bytes:
+      data = data.pack()
+    self.connection.network._enqueue(self.connection._rx_raw, data)
+
+
+class LoopbackConnection (of_01.Connection):
+  """
+  The controller's end of an in-process connection to a SoftwareSwitch.
+  """
+  def __init__ (self, network, datapath):
+    self.network = network
+    self.datapath = datapath
+    self.datapath_end = _DatapathEnd(self)
+    datapath.set_connection(self.datapath_end)
+    of_01.Connection.__init__(self, None)
+
+  def fileno (self):
+    return -1
+
+  def send (self, data):
+    if self.disconnected: return
+    if type(data) is not bytes:
+      assert isinstance(data, of.ofp_header)
+      data = data.pack()
+    self.network._enqueue(self._tx_raw, data)
+
+  def _unpack_all (self, data):
+    offset = 0
+    while offset < len(data):
+      ofp_type = ord(data[offset+1])
+      offset, msg = of_01.unpackers[ofp_type](data, offset)
+      yield ofp_type, msg
+
+  def _tx_raw (self, data):
+    """
+    Delivers raw data from the controller to the switch.
+    """
+    for ofp_type, msg in self._unpack_all(data):
+      self.network.counters['to_switch'] += 1
+      self.network.counters['to_switch_bytes'] += len(msg)
+      self.network.counters[of.ofp_type_map.get(ofp_type)] += 1
+      self.datapath_end.on_message_received(self.datapath_end, msg)
+    if self.datapath_end.on_messages_done is not None:
+      self.datapath_end.on_messages_done(self.datapath_end)
+
+  def _rx_raw (self, data):
+    """
+    Delivers raw data from the switch to the controller.
+    """
+    for ofp_type, msg in self._unpack_all(data):
+      self.network.counters['to_controller'] += 1
+      self.network.counters['to_controller_bytes'] += len(msg)
+      self.network.counters[of.ofp_type_map.get(ofp_type)] += 1
+      of_01.handlers[ofp_type](self, msg)
+
+
+class LoopbackNetwork (object):
+  """
+  Emulates a Mininet topology object with SoftwareSwitches.
+
+  Nothing happens concurrently: control messages and dataplane packets are
+  put on a single queue, and run() processes it until the network is idle.
+  """
+  def __init__ (self, topo, miss_send_len=None):
+    self.topo = topo
+    self.queue = deque()
+    self.counters = defaultdict(int)  # Message/packet counts, see _tx_raw.
+    self.received = defaultdict(list) # host -> [packets received]
+    self.connections = {}             # switch name -> LoopbackConnection
+
+    # node name -> (port -> (peer name, peer port))
+    self.node_ports = defaultdict(dict)
+    for n1, n2, info in topo.links(withInfo=True):
+      self.node_ports[n1][info['port1']] = (n2, info['port2'])
+      self.node_ports[n2][info['port2']] = (n1, info['port1'])
+
+    self.switches = {} # switch name -> SoftwareSwitch
+    self.failed = set() # names of switches that have been failed
+    for s in topo.switches():
+      sw = SoftwareSwitch(node_name_to_dpid(s), name=s,
+                          ports=max(self.node_ports[s].keys()))
+      if miss_send_len is not None:
+        sw.miss_send_len = miss_send_len
+      sw.addListener(DpPacketOut, self._handle_DpPacketOut)
+      self.switches[s] = sw
+
+    self._listener = core.OpenFlowConnectionArbiter.addListener(ConnectionIn,
+        self._handle_ConnectionIn)
+
+  def _handle_ConnectionIn (self, event):
+    # Hand our connections to whatever is core.openflow right now.
+    if getattr(event.connection, "network", None) is self:
+      event.nexus = core.openflow
+
+  def _enqueue (self, fn, *args):
+    self.queue.append((fn, args))
+
+  def _handle_DpPacketOut (self, event):
+    self.counters['dataplane'] += 1
+    peer, peer_port = self.node_ports[event.node.name][event.port.port_no]
+    if peer in self.failed:
+      return
+    if peer in self.switches:
+      self._enqueue(self.switches[peer].rx_packet, event.packet, peer_port)
+    else:
+      self.received[peer].append(event.packet)
+
+  def run (self, max_steps=1000000):
+    """
+    Processes messages and packets until the network is idle.
+    """
+    steps = 0
+    while self.queue:
+      fn, args = self.queue.popleft()
+      fn(*args)
+      steps += 1
+      if steps > max_steps:
+        raise RuntimeError("Loopback network did not settle (forwarding loop?)")
+    return steps
+
+  def connect (self):
+    """
+    Connects every switch to the controller and runs the handshakes.
+    """
+    for name in sorted(self.switches):
+      self.connections[name] = LoopbackConnection(self, self.switches[name])
+    self.run()
+
+  def disconnect (self):
+    for con in self.connections.values():
+      con.disconnect()
+    self.connections = {}
+    core.OpenFlowConnectionArbiter.removeListener(self._listener)
+
+  def fail_link (self, a, b):
+    """
+    Takes the link between switches a and b down, like pulling the cable:
+    both ports go LINK_DOWN and both switches send a PortStatus.
+    """
+    for node, peer in ((a, b), (b, a)):
+      if node in self.failed: continue
+      sw = self.switches[node]
+      for port_no, (n, _) in self.node_ports[node].items():
+        if n != peer: continue
+        sw.ports[port_no].state |= of.OFPPS_LINK_DOWN
+        sw.send_port_status(sw.ports[port_no], of.OFPPR_MODIFY)
+    self.run()
+
+  def fail_switch (self, s):
+    """
+    Takes switch s down: its controller connection drops, and its links go
+    down as seen by its neighbours.
+    """
+    for peer, _ in self.node_ports[s].values():
+      if peer in self.switches:
+        self.fail_link(s, peer)
+    self.failed.add(s)
+    self.connections[s].disconnect()
+    self.run()
+
+  def send (self, src, dst, tp_src=10000, tp_dst=5001):
+    """
+    Sends one packet from host src to host dst and runs the network until
+    it is idle.
+
+    Returns True if dst received the packet.
+    """
+    packet = make_tcp_packet(src, dst, tp_src, tp_dst)
+    (switch, switch_port), = self.node_ports[src].values()
+    received = len(self.received[dst])
+    self._enqueue(self.switches[switch].rx_packet, packet, switch_port)
+    self.run()
+    return len(self.received[dst]) > received
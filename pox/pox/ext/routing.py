@@ -1,12 +1,21 @@
 #!/usr/bin/python
 
-from collections import defaultdict
+from array import array
+from collections import defaultdict, OrderedDict
+import errno
 from functools import partial
+import hashlib
 import networkx as nx
 import itertools
+import mmap
+import multiprocessing
+import os
 import random
-from pox.lib.packet import ipv4, tcp, udp
-from struct import pack
+import sys
+import time
+from pox.lib.packet import ipv4, tcp, udp, ethernet_view
+from pox.lib.addresses import EthAddr, IPAddr
+from struct import Struct
 from zlib import crc32
 
 from topologies import dpid_to_mac_addr, node_name_to_dpid, dpid_to_switch
@@ -14,10 +23,205 @@ import pox.openflow.libopenflow_01 as of
 
 import yens
 
+# Packs the 5-tuple hashed by Routing._ecmp_hash.
+_ecmp_hash_struct = Struct('LLHHH')
+
+_BROADCAST = EthAddr('ff:ff:ff:ff:ff:ff').raw
+
+# (graph, node count, edge count, UnitGraph) of the last graph searched by
+# k_shortest_paths.  Routing only ever removes nodes and edges from a graph,
+# so a change in either count means the UnitGraph must be rebuilt.
+_unit_graph = (None, 0, 0, None)
+
+def k_shortest_paths(g, src, dst, k=8):
+    global _unit_graph
+    graph, nodes, edges, unit_graph = _unit_graph
+    if (graph is not g or nodes != g.number_of_nodes() or
+        edges != g.number_of_edges()):
+        unit_graph = yens.UnitGraph(g)
+        _unit_graph = (g, g.number_of_nodes(), g.number_of_edges(), unit_graph)
+    return yens.unit_k_shortest_paths(unit_graph, src, dst, k)[1]
+
+def ecmp_paths(g, src, dst, k=8):
+    paths = list(nx.all_shortest_paths(g, src, dst))
+    if len(paths) > k: paths = paths[:k]
+    return paths
+
+def _uses_link(path, a, b):
+    "Return True if the path crosses the link between nodes a and b."
+    for u, v in zip(path, path[1:]):
+        if (u == a and v == b) or (u == b and v == a):
+            return True
+    return False
+
+def path_fn_for(rproto):
+    """
+    Returns the function f(g, src, dst) -> [paths] for a routing protocol.
+    """
+    if rproto == 'kshort': # use 8 as k
+        return partial(k_shortest_paths, k=8)
+    elif rproto == 'ecmp8' or rproto == 'ecmp':
+        return partial(ecmp_paths, k=8)
+    elif rproto == 'ecmp64':
+        return partial(ecmp_paths, k=64)
+    raise Exception('Unknown routing protocol')
+
+def _paths_between(g, path_fn, pairs):
+    """
+    Returns [(src, dst, paths)] for each (src, dst) pair, with paths as tuples.
+    """
+    return [(src, dst, [tuple(p) for p in path_fn(g, src, dst)])
+            for src, dst in pairs]
+
+# Per-process state of route computation workers, see _init_route_worker.
+_worker_args = None
+
+def _init_route_worker(g, rproto):
+    global _worker_args
+    _worker_args = (g, path_fn_for(rproto))
+
+def _route_worker(pairs):
+    g, path_fn = _worker_args
+    return _paths_between(g, path_fn, pairs)
+
+# On-disk route cache: see Routing.generate_routing_paths.  Bump the format
+# when the file layout changes; changes to how paths are computed are picked
+# up by _code_version.
+ROUTE_CACHE_FORMAT = 1
+
+def _code_version():
+    "Returns a digest of the source of the modules that compute paths."
+    digest = hashlib.sha1()
+    for module in (__name__, yens.__name__):
+        filename = sys.modules[module].__file__
+        if filename.endswith(('.pyc', '.pyo')): filename = filename[:-1]
+        with open(filename, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+def _write_route_cache(filename, switches, results):
+    """
+    Writes [(src, dst, paths)] as a flat array of switch indices:
+    for each pair, the number of paths, then each path's length and nodes.
+    """
+    index = dict((s, i) for i, s in enumerate(switches))
+    data = array('i')
+    for a, b, paths in results:
+        data.append(len(paths))
+        for path in paths:
+            data.append(len(path))
+            data.extend(index[s] for s in path)
+    try:
+        os.makedirs(os.path.dirname(filename))
+    except OSError as e:
+        # Another process may have just made it.
+        if e.errno != errno.EEXIST: raise
+    # Write and rename, so that readers never see a partial file.
+    tmp = '{}.{}.tmp'.format(filename, os.getpid())
+    try:
+        with open(tmp, 'wb') as f:
+            data.tofile(f)
+        os.rename(tmp, filename)
+    except:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+def _read_route_cache(filename, switches, pairs):
+    """
+    Reads back what _write_route_cache wrote for pairs.
+
+    The file is mapped read-only rather than read in, so that processes
+    loading the same routes at once (e.g. OpenFlow shards) share its pages.
+    """
+    with open(filename, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        item = array('i').itemsize
+        structs = {}
+        def ints(i, n):
+            if n not in structs: structs[n] = Struct('{}i'.format(n))
+            return structs[n].unpack_from(data, i * item)
+        results = []
+        i = 0
+        for a, b in pairs:
+            paths = []
+            count, = ints(i, 1)
+            i += 1
+            for j in range(count):
+                length, = ints(i, 1)
+                paths.append(tuple(switches[n] for n in ints(i + 1, length)))
+                i += 1 + length
+            results.append((a, b, paths))
+        if i * item != len(data):
+            raise Exception('Route cache {} does not match topology'
+                            .format(filename))
+    finally:
+        data.close()
+    return results
+
+def _range_prefixes(lo, hi):
+    """
+    Returns the fewest (nw_src, prefix length) that cover the host
+    addresses 10.x.y.z with x.y.z in [lo, hi).
+    """
+    prefixes = []
+    while lo < hi:
+        # The largest aligned block that starts at lo and fits.
+        size = lo & -lo or 1 << 24
+        while size > hi - lo: size >>= 1
+        prefixes.append((IPAddr((10 << 24) | lo), 33 - size.bit_length()))
+        lo += size
+    return prefixes
+
+def _aligned_between(lo, hi):
+    "Returns the number in [lo, hi] with the most trailing zero bits."
+    for bit in range(24, 0, -1):
+        n = hi >> bit << bit
+        if n >= lo: return n
+    return hi
+
+def source_buckets(host_ids, buckets):
+    """
+    Splits the host addresses into buckets ranges that hold as many of
+    host_ids as each other, give or take one, and returns each range as
+    the list of (nw_src, prefix length) that covers it.
+
+    Ranges end on well aligned ids wherever that keeps the split even, so
+    that they take few prefixes.
+    """
+    ids = sorted(host_ids)
+    bounds = [0]
+    for b in range(1, buckets):
+        i = b * len(ids) // buckets
+        if i == 0:
+            bounds.append(0)
+        else:
+            bounds.append(_aligned_between(ids[i - 1] + 1, ids[i]))
+    bounds.append(1 << ids[-1].bit_length() if ids else 0)
+    return [_range_prefixes(lo, hi) for lo, hi in zip(bounds, bounds[1:])]
+
 class Routing():
-    def __init__(self, topo, rproto, log, seed=0):
+    def __init__(self, topo, rproto, log, seed=0, workers=1, cache_dir=None,
+                 cache_wait=0):
+        """
+        workers is the number of processes used to compute routes, or None
+        to use one per CPU.  Routes do not depend on it.
+
+        cache_dir is a directory to keep computed routes in, so that they are
+        only computed once for a topology and routing protocol, or None.
+
+        cache_wait is how many seconds to wait for another process to write
+        the route cache, if there is none yet, before computing routes.
+        """
         self.topo = topo
         self.log = log
+        self.workers = workers or multiprocessing.cpu_count()
+        self.cache_dir = cache_dir
+        self.cache_wait = cache_wait
+        self.timings = OrderedDict() # phase -> seconds, for the last run
 
         self.log.info("Setting proto")
         self.set_path_fn(rproto)
@@ -25,37 +229,52 @@ class Routing():
         self.hostname_to_mac = {} # Maps hostnames to mac addresses.
         for host in topo.hosts():
             self.hostname_to_mac[host] = dpid_to_mac_addr(node_name_to_dpid(host))
+        self.mac_to_hostname = dict((mac, host) for host, mac
+                                    in self.hostname_to_mac.iteritems())
+        self.host_raw = dict((host, EthAddr(mac).raw) for host, mac
+                             in self.hostname_to_mac.iteritems())
         self.log.info(self.hostname_to_mac)
 
         random.seed(seed)
 
     def set_path_fn(self, rproto):
-        self.path_fn = None
-
-        if rproto == 'kshort': # use 8 as k
-            self.path_fn = partial(self.k_shortest_paths, k=8)
-        elif rproto == 'ecmp8' or rproto == 'ecmp':
-            self.path_fn = partial(self.ecmp_paths, k=8)
-        elif rproto == 'ecmp64':
-            self.path_fn = partial(self.ecmp_paths, k=64)
-
-        if not self.path_fn: raise Exception('Unknown routing protocol')
+        self.rproto = rproto
+        self.path_fn = path_fn_for(rproto)
 
     def generate_rtable(self):
         self.generate_routing_paths()
+        self.compile_egress_table()
 
     def k_shortest_paths(self, g, src, dst, k=8):
-        return yens.k_shortest_paths(g, src, dst, k)[1]
+        return k_shortest_paths(g, src, dst, k)
 
     def ecmp_paths(self, g, src, dst, k=8):
-        paths = list(nx.all_shortest_paths(g, src, dst))
-        if len(paths) > k: paths = paths[:k]
-        return paths
+        return ecmp_paths(g, src, dst, k)
+
+    def _phase_done(self, phase, start):
+        "Records how long a phase of route generation took since start."
+        now = time.time()
+        self.timings[phase] = now - start
+        self.log.info('Routing phase {} took {:.3f}s'.format(phase, now - start))
+        return now
 
     # Creates path map:
-    # host src eth -> (host src eth -> [possible paths])
+    # host src eth -> (host dst eth -> [possible paths])
+    #
+    # Paths only contain switches: they run from the source host's switch to
+    # the destination host's switch.  Routes are computed once per switch
+    # pair in switch_paths, and every host pair between the same two switches
+    # shares that entry.  The graph is undirected, so each unordered pair is
+    # computed once and the reverse direction gets the paths reversed.
+    #
+    # With more than one worker, switch pairs are split across a process
+    # pool.  Results are merged in order, so routing_paths comes out the same
+    # whatever the number of workers.
     def generate_routing_paths(self):
+        self.timings.clear()
+        start = time.time()
         self.routing_paths = defaultdict(lambda: dict())
+        self.switch_paths = {} # (src switch, dst switch) -> [possible paths]
 
         # create map from node name -> (node name -> egress port)
         links = self.topo.links(withInfo=True)
@@ -63,45 +282,486 @@ class Routing():
         for l in links:
             self.port_map[l[0]][l[1]] = l[2]['port1']
             self.port_map[l[1]][l[0]] = l[2]['port2']
+        start = self._phase_done('port_map', start)
 
         hosts = self.topo.hosts()
-        g = nx.Graph()
-        g.add_nodes_from(self.topo.nodes())
-        g.add_edges_from(self.topo.links())
+        switches = self.topo.switches()
+        self.host_switch = {} # host name -> name of the switch it hangs off
+        self.hosts_on = defaultdict(list) # switch name -> [host names]
+        for h in hosts:
+            self.host_switch[h], = self.port_map[h].keys()
+            self.hosts_on[self.host_switch[h]].append(h)
+        self.graph = g = nx.Graph() # switches only, kept for repairs
+        g.add_nodes_from(switches)
+        g.add_edges_from(l for l in self.topo.links() if
+                         l[0] not in self.host_switch and
+                         l[1] not in self.host_switch)
+        start = self._phase_done('graph', start)
 
-        # find paths from each host to each host
+        # find paths between each pair of switches that have hosts
         # note: we do not know how to route to other switches, only other hosts
+        edge_switches = sorted(set(self.host_switch.values()), key=switches.index)
+        self.switch_pairs = pairs = [(a, b) for i, a in enumerate(edge_switches)
+                                     for b in edge_switches[i:]]
+        cache_file = self.route_cache_file()
+        results = None
+        if cache_file and self.cache_wait:
+            self._wait_for_file(cache_file, self.cache_wait)
+        if cache_file and os.path.exists(cache_file):
+            # A cache is never worth failing for: a bad one is replaced.
+            try:
+                results = _read_route_cache(cache_file, switches, pairs)
+                self.log.info('Loaded routes from {}'.format(cache_file))
+                start = self._phase_done('cache', start)
+            except Exception as e:
+                self.log.warning('Ignoring bad route cache {}: {}'.format(
+                                 cache_file, e))
+                try:
+                    os.remove(cache_file)
+                except OSError:
+                    pass
+        if results is None:
+            results = self._compute_switch_paths(g, pairs)
+            start = self._phase_done('paths', start)
+            if cache_file:
+                try:
+                    _write_route_cache(cache_file, switches, results)
+                    self.log.info('Saved routes to {}'.format(cache_file))
+                except (OSError, IOError) as e:
+                    self.log.warning('Could not save routes to {}: {}'.format(
+                                     cache_file, e))
+
+        for a, b, paths in results:
+            self.switch_paths[(a, b)] = paths
+            if a != b:
+                self.switch_paths[(b, a)] = [p[::-1] for p in paths]
         for src in hosts:
-            for dst in filter(lambda h: h != src, hosts):
-                paths = self.path_fn(g, src, dst)
-                # convert paths to egress ports
-                src_mac = self.hostname_to_mac[src]
+            src_mac = self.hostname_to_mac[src]
+            src_switch = self.host_switch[src]
+            for dst in hosts:
+                if dst == src: continue
                 dst_mac = self.hostname_to_mac[dst]
-                self.routing_paths[src_mac][dst_mac] = paths
+                self.routing_paths[src_mac][dst_mac] = \
+                    self.switch_paths[(src_switch, self.host_switch[dst])]
+        self._phase_done('merge', start)
+
+    def _wait_for_file(self, filename, timeout):
+        "Waits up to timeout seconds for filename to exist."
+        deadline = time.time() + timeout
+        if not os.path.exists(filename):
+            self.log.info('Waiting for routes in {}'.format(filename))
+        while not os.path.exists(filename):
+            if time.time() >= deadline:
+                self.log.warning('No routes in {} after {}s, computing them'
+                                 .format(filename, timeout))
+                return
+            time.sleep(0.1)
+
+    def _compute_switch_paths(self, g, pairs):
+        "Returns [(src, dst, paths)] for each pair of switches."
+        if self.workers <= 1:
+            return _paths_between(g, self.path_fn, pairs)
+        # A few chunks per worker, so that uneven chunks even out.
+        size = max(1, len(pairs) // (self.workers * 4))
+        chunks = [pairs[i:i + size] for i in range(0, len(pairs), size)]
+        pool = multiprocessing.Pool(self.workers, _init_route_worker,
+                                    (g, self.rproto))
+        try:
+            results = pool.map(_route_worker, chunks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+        return [r for result in results for r in result]
+
+    def route_cache_file(self):
+        """
+        Returns the file the routes of this topology are cached in, or None
+        if there is no cache_dir.
+
+        The name is a digest of everything the routes depend on: the switch
+        graph (in the order Routing builds it, since that breaks ties between
+        equal paths), the switch pairs routed, the routing protocol and the
+        code that computes paths.
+        """
+        if not self.cache_dir: return None
+        key = hashlib.sha1()
+        key.update(repr((ROUTE_CACHE_FORMAT, self.rproto, _code_version(),
+                         list(self.graph.nodes()), list(self.graph.edges()),
+                         self.switch_pairs)))
+        return os.path.join(self.cache_dir, 'routes-{}-{}.bin'.format(
+            self.rproto, key.hexdigest()[:16]))
+
+    # Creates the per-packet lookup table used by get_egress_port:
+    # switch dpid -> ((src eth, dst eth) -> (egress port per ECMP bucket))
+    #
+    # Addresses are raw 6-byte strings.  Bucket i is the egress port on path i
+    # of routing_paths, or None if that path does not cross the switch.  When
+    # every bucket has the same port, the tuple is collapsed to that one port
+    # and get_egress_port does not need to hash the packet at all.
+    def compile_egress_table(self):
+        start = time.time()
+        self.egress_table = defaultdict(dict)
+        self._interned_ports = {}
+
+        for (src_switch, dst_switch), paths in self.switch_paths.iteritems():
+            self._compile_egress_entries(src_switch, dst_switch, paths)
+
+        self._phase_done('egress_table', start)
+
+    def _host_pairs(self, src_switch, dst_switch):
+        "Return the (src host, dst host) pairs between two switches."
+        return [(src, dst) for src in self.hosts_on[src_switch]
+                for dst in self.hosts_on[dst_switch] if src != dst]
+
+    def _compile_egress_entries(self, src_switch, dst_switch, paths):
+        """
+        Fills in the egress table entries of every host pair between two
+        switches, and returns the set of switches that got entries.
+        """
+        host_pairs = [(self.host_raw[src], self.host_raw[dst], dst) for src, dst
+                      in self._host_pairs(src_switch, dst_switch)]
+        if not paths or not host_pairs: return set()
+
+        interned = self._interned_ports
+        def intern(ports):
+            if len(set(ports)) == 1: ports = ports[:1]
+            ports = tuple(ports)
+            return interned.setdefault(ports, ports)
+
+        # switch -> [egress port per bucket], towards dst_switch
+        buckets = defaultdict(lambda: [None] * len(paths))
+        for i, path in enumerate(paths):
+            for switch, next_hop in zip(path, path[1:]):
+                buckets[switch][i] = self.port_map[switch][next_hop]
+        for switch, ports in buckets.iteritems():
+            ports = intern(ports)
+            table = self.egress_table[node_name_to_dpid(switch)]
+            for src, dst, _ in host_pairs:
+                table[(src, dst)] = ports
+
+        # Every path ends on dst_switch, which hands off to the host.
+        table = self.egress_table[node_name_to_dpid(dst_switch)]
+        for src, dst, dst_host in host_pairs:
+            table[(src, dst)] = intern([self.port_map[dst_switch][dst_host]])
+
+        return set(buckets) | set([dst_switch])
+
+    # Creates per-switch forwarding rules for proactive installation:
+    # switch name -> ((src eth, dst eth) -> egress port)
+    #
+    # OpenFlow 1.0 switches cannot hash on their own, so each host pair is
+    # pinned to one of its paths, picked by a hash of the pair's addresses.
+    # Different pairs still spread over all ECMP/k-shortest paths.
+    def generate_switch_rules(self):
+        self.switch_rules = defaultdict(dict)
+
+        for src_mac, dsts in self.routing_paths.iteritems():
+            for dst_mac, paths in dsts.iteritems():
+                for switch, egress_port in self._pair_rules(src_mac, dst_mac,
+                                                            paths):
+                    self.switch_rules[switch][(src_mac, dst_mac)] = egress_port
+
+        return self.switch_rules
+
+    def _pair_rules(self, src_mac, dst_mac, paths):
+        "Return [(switch, egress port)] along the path a host pair is pinned to."
+        if not paths: return []
+        path = paths[self._pair_hash(src_mac, dst_mac) % len(paths)]
+        # every switch forwards towards the next hop, and the last
+        # one towards the destination host.
+        hops = path[1:] + (self.mac_to_hostname[dst_mac],)
+        return [(switch, self.port_map[switch][next_hop])
+                for switch, next_hop in zip(path, hops)]
+
+    def _pair_hash(self, src_mac, dst_mac):
+        "Return a path-selection hash for a (src eth, dst eth) host pair."
+        return crc32(src_mac + dst_mac) & 0xffffffff
+
+    # Creates per-switch forwarding rules that do not grow with the number
+    # of hosts talking to each other:
+    # switch name -> ((dst eth, bucket) -> egress port)
+    #
+    # Every switch forwards by destination host alone, to a next hop that is
+    # closer to the destination's switch, so rules compose hop by hop
+    # without loops.  Paths of routing_paths that are longer than that
+    # (kshort) are not used.  To spread traffic over the next hops, like
+    # ECMP does, sources are split into buckets of as many hosts each, and
+    # each bucket goes to one of the next hops.  OpenFlow 1.0 can only mask
+    # IP addresses by prefix, so a bucket is matched by the few nw_src
+    # prefixes that cover its range of host addresses (see source_buckets).
+    # Bucket None is the rule for all of a destination's traffic, and only
+    # buckets that leave on another port than it get rules of their own.
+    # So a switch holds at most hosts * buckets of them, however many flows
+    # there are.
+    def generate_aggregate_rules(self, buckets=4):
+        if buckets < 1:
+            raise Exception('Number of buckets must be at least 1')
+        start = time.time()
+        self.aggregate_buckets = buckets
+        # Host addresses are 10.x.y.z with the host dpid in x.y.z.
+        self._bucket_prefixes = source_buckets(
+            [node_name_to_dpid(h) for h in self.hostname_to_mac], buckets)
+        self.aggregate_rules = self._compile_aggregate_rules()
+        self._phase_done('aggregate_rules', start)
+
+        sizes = self.aggregate_table_sizes().values() or [0]
+        self.log.info('Aggregate rules: {} buckets, {}/{:.1f}/{} flow entries '
+                      'per switch (min/mean/max)'.format(buckets, min(sizes),
+                      float(sum(sizes)) / len(sizes), max(sizes)))
+        return self.aggregate_rules
+
+    def aggregate_prefixes(self, bucket):
+        "Return the [(nw_src, prefix length)] of a bucket of sources."
+        return self._bucket_prefixes[bucket]
+
+    def aggregate_table_sizes(self):
+        "Return switch name -> number of flow entries its aggregate rules take."
+        return dict((s, sum(1 if b is None else len(self._bucket_prefixes[b])
+                            for _, b in rules))
+                    for s, rules in self.aggregate_rules.iteritems())
+
+    def _compile_aggregate_rules(self):
+        rules = defaultdict(dict)
+        for switch, dsts in self._next_hop_ports().iteritems():
+            table = rules[switch]
+            for dst_mac, ports in dsts.iteritems():
+                # Rotate by a hash of the switch, so that not every
+                # switch sends bucket 0 to its lowest next hop.
+                offset = crc32(switch + dst_mac) & 0xffffffff
+                default = ports[offset % len(ports)]
+                table[(dst_mac, None)] = default
+                for b in range(self.aggregate_buckets):
+                    port = ports[(offset + b) % len(ports)]
+                    if port != default and self._bucket_prefixes[b]:
+                        table[(dst_mac, b)] = port
+        return rules
+
+    def _next_hop_ports(self):
+        """
+        Return switch name -> (dst eth -> [egress port]): the ports towards
+        next hops closer to the destination host's switch, or the host's
+        own port on that switch.
+        """
+        next_hop_ports = defaultdict(dict)
+        for dst_switch, dst_hosts in self.hosts_on.iteritems():
+            if dst_switch not in self.graph: continue
+            dist = nx.single_source_shortest_path_length(self.graph,
+                                                         dst_switch)
+            dst_macs = [self.hostname_to_mac[h] for h in dst_hosts]
+            for h, dst_mac in zip(dst_hosts, dst_macs):
+                port = self.port_map[dst_switch][h]
+                next_hop_ports[dst_switch][dst_mac] = [port]
+
+            for switch, d in dist.iteritems():
+                if switch == dst_switch: continue
+                next_hops = [p[1] for p in
+                             self.switch_paths.get((switch, dst_switch), ())]
+                next_hops = sorted(set(n for n in next_hops
+                                       if dist.get(n, d) < d))
+                if not next_hops:
+                    next_hops = sorted(n for n in self.graph[switch]
+                                       if dist.get(n, d) < d)
+                ports = [self.port_map[switch][n] for n in next_hops]
+                for dst_mac in dst_macs:
+                    next_hop_ports[switch][dst_mac] = ports
+        return next_hop_ports
+
+    def update_aggregate_rules(self):
+        """
+        Recompiles the aggregate rules for what is left of the graph, e.g.
+        after remove_link or remove_switch.
+
+        Returns switch name -> [(dst eth, bucket)] of the rules that changed
+        or went away on switches that are still up.
+        """
+        old = self.aggregate_rules
+        self.aggregate_rules = new = self._compile_aggregate_rules()
+        changes = {}
+        for s in set(old) | set(new):
+            if s not in self.graph: continue
+            o, n = old.get(s, {}), new.get(s, {})
+            keys = [k for k in set(o) | set(n) if o.get(k) != n.get(k)]
+            if keys: changes[s] = sorted(keys)
+        return changes
+
+    # Creates per-switch rules for switches that can hash flows over their
+    # next hops on their own (Open vSwitch's Nicira multipath action):
+    # switch name -> (dst eth -> [egress port])
+    #
+    # Like the aggregate rules, they forward by destination host alone, to
+    # next hops closer to the destination's switch, but every flow picks one
+    # of them in the datapath.
+    def generate_multipath_rules(self):
+        start = time.time()
+        self.multipath_rules = self._next_hop_ports()
+        self._phase_done('multipath_rules', start)
+
+        widths = [len(ports) for dsts in self.multipath_rules.itervalues()
+                  for ports in dsts.itervalues()] or [0]
+        self.log.info('Multipath rules: {:.2f} next hops per destination '
+                      '(max {})'.format(float(sum(widths)) / len(widths),
+                                        max(widths)))
+        return self.multipath_rules
+
+    def update_multipath_rules(self):
+        """
+        Recompiles the multipath rules for what is left of the graph.
+
+        Returns switch name -> [dst eth] of the destinations whose next hops
+        changed or went away on switches that are still up.
+        """
+        old = self.multipath_rules
+        self.multipath_rules = new = self._next_hop_ports()
+        changes = {}
+        for s in set(old) | set(new):
+            if s not in self.graph: continue
+            o, n = old.get(s, {}), new.get(s, {})
+            dsts = [d for d in set(o) | set(n) if o.get(d) != n.get(d)]
+            if dsts: changes[s] = sorted(dsts)
+        return changes
+
+    # Incremental repair: when a switch or a link between switches goes
+    # down, only the switch pairs that had a path through it get new routes,
+    # computed on what is left of the graph.  Routes of every other pair
+    # remain valid, since removing an edge only takes paths away.
+    #
+    # Both return a map of switch name -> [(src eth, dst eth)], the host
+    # pairs whose forwarding on that switch changed, so that the controller
+    # only needs to update those switches.
+    def remove_link(self, a, b):
+        if not self.graph.has_edge(a, b): return {}
+        self.log.info('Removing link {}-{} from routing'.format(a, b))
+        self.graph.remove_edge(a, b)
+        del self.port_map[a][b]
+        del self.port_map[b][a]
+        return self._repair(lambda path: _uses_link(path, a, b))
+
+    def remove_switch(self, s):
+        if s not in self.graph: return {}
+        self.log.info('Removing switch {} from routing'.format(s))
+        self.graph.remove_node(s)
+        for peer in self.port_map.pop(s, {}):
+            self.port_map[peer].pop(s, None)
+        self.egress_table.pop(node_name_to_dpid(s), None)
+        if hasattr(self, 'switch_rules'): self.switch_rules.pop(s, None)
+        return self._repair(lambda path: s in path)
+
+    def _repair(self, broken):
+        start = time.time()
+        changes = defaultdict(set)
+        repaired = 0
+
+        for a, b in self.switch_pairs:
+            old_paths = self.switch_paths[(a, b)]
+            if not any(broken(p) for p in old_paths): continue
+            repaired += 1
+            new_paths = []
+            if a in self.graph and b in self.graph:
+                try:
+                    new_paths = [tuple(p) for p in self.path_fn(self.graph, a, b)]
+                except nx.NetworkXException:
+                    pass # partitioned
+            self._replace_switch_paths(a, b, new_paths, changes)
+            if a != b:
+                self._replace_switch_paths(b, a, [p[::-1] for p in new_paths],
+                                           changes)
+
+        self._phase_done('repair', start)
+        self.log.info('Repaired routes of {} switch pairs, {} switches changed'
+                      .format(repaired, len(changes)))
+        return dict((s, sorted(pairs)) for s, pairs in changes.iteritems())
+
+    def _replace_switch_paths(self, src_switch, dst_switch, paths, changes):
+        """
+        Swaps in new paths between two switches, and records in changes the
+        switches where a host pair's egress ports or proactive rule differ.
+        """
+        old_paths = self.switch_paths[(src_switch, dst_switch)]
+        old_switches = set(s for p in old_paths for s in p)
+        self.switch_paths[(src_switch, dst_switch)] = paths
+
+        host_pairs = self._host_pairs(src_switch, dst_switch)
+        old_entries = {} # (src eth, dst eth) -> (switch -> old egress ports)
+        for src, dst in host_pairs:
+            src_mac = self.hostname_to_mac[src]
+            dst_mac = self.hostname_to_mac[dst]
+            self.routing_paths[src_mac][dst_mac] = paths
+
+            key = (self.host_raw[src], self.host_raw[dst])
+            old_entries[(src_mac, dst_mac)] = dict(
+                (s, self.egress_table.get(node_name_to_dpid(s), {}).pop(key, None))
+                for s in old_switches)
+
+            if hasattr(self, 'switch_rules'):
+                # The old rules can't be recomputed with the link gone from
+                # port_map, so take them from switch_rules.
+                old_rules = []
+                if old_paths:
+                    old_path = old_paths[self._pair_hash(src_mac, dst_mac) %
+                                         len(old_paths)]
+                    old_rules = [(s, self.switch_rules.get(s, {}).pop(
+                                     (src_mac, dst_mac), None))
+                                 for s in old_path]
+                new_rules = self._pair_rules(src_mac, dst_mac, paths)
+                for s, egress_port in new_rules:
+                    self.switch_rules[s][(src_mac, dst_mac)] = egress_port
+                for s, _ in set(old_rules) ^ set(new_rules):
+                    changes[s].add((src_mac, dst_mac))
+
+        new_switches = self._compile_egress_entries(src_switch, dst_switch,
+                                                    paths)
+        # With proactive rules installed, switches only forward by those.
+        if hasattr(self, 'switch_rules'): host_pairs = ()
+        for src, dst in host_pairs:
+            src_mac = self.hostname_to_mac[src]
+            dst_mac = self.hostname_to_mac[dst]
+            key = (self.host_raw[src], self.host_raw[dst])
+            old = old_entries[(src_mac, dst_mac)]
+            for s in old_switches | new_switches:
+                new = self.egress_table.get(node_name_to_dpid(s), {}).get(key)
+                if new != old.get(s):
+                    changes[s].add((src_mac, dst_mac))
+
+        # Nothing to tell switches that are gone.
+        for s in old_switches - set(self.graph):
+            changes.pop(s, None)
 
     # generates paths for random permutation traffic
     # (each host connected to only one other host)
     def generate_random_permutation_paths(self):
         all_paths = []
 
-        hosts = self.topo.hosts()
         g = nx.Graph()
         g.add_nodes_from(self.topo.nodes())
         g.add_edges_from(self.topo.links())
 
-        # find paths between pairs of nodes (that have paths)
-        pairs = itertools.combinations(hosts, 2)
-        pairs = filter(lambda p: nx.has_path(g, *p), pairs)
-
-        while pairs:
-            src, dst = random.choice(pairs)
-            # remove all pairs connected to nodes that already have paths
-            pairs = filter(lambda p: src not in p and dst not in p, pairs)
+        for src, dst in self.random_permutation_pairs(g):
             paths = self.path_fn(g, src, dst)
             all_paths.extend(paths)
 
         return all_paths
 
+    def random_permutation_pairs(self, g):
+        """
+        Pairs up hosts at random, each host in at most one pair, and only
+        with hosts it has a path to.
+
+        Picking random pairs of unpaired hosts until none are left gives
+        every such matching the same chance; so does shuffling the hosts of
+        each connected component and pairing them off in order, in O(H).
+        """
+        component_hosts = defaultdict(list) # component number -> [hosts]
+        for i, component in enumerate(nx.connected_components(g)):
+            for n in component:
+                if not self.topo.isSwitch(n): component_hosts[i].append(n)
+
+        pairs = []
+        for i in sorted(component_hosts):
+            hosts = sorted(component_hosts[i], key=node_name_to_dpid)
+            random.shuffle(hosts)
+            pairs.extend(zip(hosts[0::2], hosts[1::2]))
+        return pairs
+
     # returns a map from link to the number of distinct paths that link is on
     def edge_counts(self, paths):
         edge_counts = { tuple(sorted(e)): 0 for e in self.topo.links() }
@@ -113,6 +773,11 @@ class Routing():
 
     def _ecmp_hash(self, packet):
         "Return an ECMP-style 5-tuple hash for TCP/IP packets, otherwise 0."
+        if isinstance(packet, ethernet_view):
+            # Straight from the packet bytes, without parsing it.
+            five_tuple = packet.five_tuple
+            if five_tuple is None: return 0
+            return crc32(_ecmp_hash_struct.pack(*five_tuple))
         hash_input = [0] * 5
         if isinstance(packet.next, ipv4):
           ip = packet.next
@@ -123,28 +788,29 @@ class Routing():
             l4 = ip.next
             hash_input[3] = l4.srcport
             hash_input[4] = l4.dstport
-            return crc32(pack('LLHHH', *hash_input))
+            return crc32(_ecmp_hash_struct.pack(*hash_input))
         return 0
 
-    # get paths between src and dst mac address of packet
-    # choose path deterministically based on hash from packet data
-    # find current switch in path, and find egress port to get
-    # to next hop in the path
+    # look up the egress ports of the packet's (src, dst) pair on this
+    # switch, and if its paths leave the switch on different ports, choose
+    # one deterministically based on hash from packet data
     def get_egress_port(self, packet, switch_dpid):
 
         # This should actually never happen.
-        if str(packet.dst) == 'ff:ff:ff:ff:ff:ff':
+        if packet.dst.raw == _BROADCAST:
             self.log.warn('Broadcasting packet..')
             return of.OFPP_FLOOD
 
-        paths = self.routing_paths[str(packet.src)][str(packet.dst)]
+        ports = self.egress_table[switch_dpid].get((packet.src.raw,
+                                                    packet.dst.raw))
+        if ports is None:
+            # No route, e.g. the network is partitioned.
+            return None
+        if len(ports) == 1:
+            return ports[0]
 
         # ECMP hash.
-        index = self._ecmp_hash(packet) % len(paths)
-        path = paths[index]
-        switch_id = dpid_to_switch(switch_dpid)
-        switch_index = path.index(switch_id)
-        return self.port_map[switch_id][path[switch_index + 1]]
+        return ports[self._ecmp_hash(packet) % len(ports)]
 
     def register_switch(self, switch):
         """
@@ -263,6 +263,16 @@ parser.add_argument('-r','--routing',
     help='One of ecmp, kshort.  What routing algorithm to use', required=True)
 parser.add_argument('-s','--seed',
     help='What random seed to use for this experiment.', required=True)
+parser.add_argument('-m','--mode', default='reactive',
+    help='One of reactive, proactive, aggregate, multipath.  How the controller installs rules')
+parser.add_argument('-b','--buckets', type=int, default=4,
+    help='Source buckets per destination host in aggregate mode')
+parser.add_argument('-w','--workers', type=int, default=1,
+    help='Number of processes the controller uses to compute routes')
+parser.add_argument('--no-route-cache', action='store_true',
+    help='Always compute routes, instead of reusing ones cached by earlier runs')
+parser.add_argument('--trace-sample', type=int, default=100,
+    help='Trace 1 in this many packets the controller forwards, 0 for none')
 
 if __name__ == '__main__':
 
@@ -287,6 +297,11 @@ if __name__ == '__main__':
         print("We only know ECMP and KSHORT routing")
         raise SystemExit
 
+    mode = args['mode']
+    if mode not in ['reactive', 'proactive', 'aggregate', 'multipath']:
+        print("We only know REACTIVE, PROACTIVE, AGGREGATE and MULTIPATH controller modes")
+        raise SystemExit
+
 
     topo = topologies[topo_name](random_seed=seed,
         n=n,
@@ -300,6 +315,12 @@ if __name__ == '__main__':
         config_file.write('r=%d\n' % r)
         config_file.write('seed=%d\n' % seed)
         config_file.write('routing=%s\n' % routing)
+        config_file.write('mode=%s\n' % mode)
+        config_file.write('buckets=%d\n' % args['buckets'])
+        config_file.write('workers=%d\n' % args['workers'])
+        config_file.write('trace_sample=%d\n' % args['trace_sample'])
+        if args['no_route_cache']:
+            config_file.write('route_cache=\n')
         config_file.flush()
 
     # Create Mininet network with a custom controller
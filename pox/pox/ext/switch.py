@@ -34,5 +34,20 @@ class Switch(EventMixin):
     msg.actions.append(of.ofp_action_output(port = outport))
     self.connection.send(msg)
 
+  def send_flow_mod_and_packet(self, flow_mod, packet_in, outport):
+    """
+    Installs flow_mod, and sends the packet of packet_in out of outport.
+
+    If the switch buffered the packet, flow_mod carries its buffer_id, and
+    the switch applies the new rule to it: one message, and no payload.
+    Otherwise the raw data of the PacketIn goes back in a packet_out.
+    """
+    if packet_in.buffer_id is not None:
+      flow_mod.buffer_id = packet_in.buffer_id
+      self.connection.send(flow_mod)
+    else:
+      self.connection.send(flow_mod)
+      self.send_packet_data(outport, packet_in.data)
+
   def _handle_ConnectionDown (self, event):
     self.disconnect()
@@ -8,6 +8,10 @@ echo '**** Running test: random permutation traffic, 1 TCP flow, ECMP ****'
 rm test_out
 sudo mn -c
 
+# 0. Generate the routes of every run below in parallel, up front, so that
+#    each run's controller loads them from the route cache.
+python experiments.py -n 25,10 -k 4 -r 3 --seeds 0 --link-load '' --routes ecmp,kshort -o table1_routes.json
+
 # 1. Run random permutation traffic test on Jellyfish topology with
 #    n=25, k=4, r=3. With congestion control: TCP 1 flows, Routing: ECMP
 sudo python run.py -randpermtraffic --flows 1 -t jelly,25,4,3 --routing ecmp --seed 0 >> test_out
@@ -1,7 +1,18 @@
-from mininet.topo import Topo
 from collections import defaultdict
 import random
 
+from topology_graph import TopologyGraphBuilder
+
+try:
+    from mininet.topo import Topo
+except ImportError:
+    # Mininet is only needed to emulate a topology.  The controller side
+    # can use jellyfish_graph, which needs no Mininet.
+    class Topo(object):
+        def __init__(self, *args, **params):
+            raise ImportError('%s needs Mininet; use jellyfish_graph for a '
+                              'topology without it' % type(self).__name__)
+
 """
 Keep all topology definitions for PA2 in this file.
 
@@ -17,85 +28,134 @@ class JellyfishTopo(Topo):
     They are connected to each other using the jellyfish algorithm
     """
     def build(self, random_seed=0, n=15, k=NUM_PORTS, r=None):
-        if r is None: r = k-1
+        build_jellyfish(self, random_seed, n, k, r)
 
 
-        # For reproducing the topology in the controller and in the
-        # Mininet instance.
-        random.seed(random_seed)
+def jellyfish_graph(random_seed=0, n=15, k=NUM_PORTS, r=None):
+    """
+    Returns the topology JellyfishTopo builds for the same arguments, as a
+    TopologyGraph: same nodes, links and ports, without Mininet.
+    """
+    builder = TopologyGraphBuilder()
+    build_jellyfish(builder, random_seed, n, k, r)
+    return builder.graph()
 
-        self.switch_ports_remaining = dict()
-        self.remaining_switches = [] # switches that have >1 port left
-        self.connections = defaultdict(lambda: []) # switch -> list of connected switches
-        self.temp_links = []
-
-        # add n switches, each attached to k hosts
-        # The number x in (s|h)x must be globally unique
-        # across the topology.
-        #
-        # We assign a pid incrementally to every switch or host that comes up.
-        pid_ctr = 1
-        for i in range(1,n+1): # so that i is not 0
-            """
-            NOTE: setting the IP of the switch here doesn't seem to do anything,
-                  though the IP of the host is set.
-            """
-            s = self.addSwitch('s{}'.format(pid_ctr))
+def build_jellyfish(topo, random_seed=0, n=15, k=NUM_PORTS, r=None):
+    """
+    Adds a Jellyfish network to topo, a Topo or a TopologyGraphBuilder.
+    """
+    if r is None: r = k-1
+
+    # For reproducing the topology in the controller and in the
+    # Mininet instance.
+    random.seed(random_seed)
+
+    switches = []
+
+    # add n switches, each attached to k hosts
+    # The number x in (s|h)x must be globally unique
+    # across the topology.
+    #
+    # We assign a pid incrementally to every switch or host that comes up.
+    pid_ctr = 1
+    for i in range(1,n+1): # so that i is not 0
+        """
+        NOTE: setting the IP of the switch here doesn't seem to do anything,
+              though the IP of the host is set.
+        """
+        s = topo.addSwitch('s{}'.format(pid_ctr))
+        pid_ctr += 1
+        for j in range(k-r):
+            h = topo.addHost('h{}'.format(pid_ctr), mac=dpid_to_mac_addr(pid_ctr),
+                ip=dpid_to_ip_addr(pid_ctr))
+            topo.addLink(h, s, bw=BW)
             pid_ctr += 1
-            for j in range(k-r):
-                h = self.addHost('h{}'.format(pid_ctr), mac=dpid_to_mac_addr(pid_ctr),
-                    ip=dpid_to_ip_addr(pid_ctr))
-                self.addLink(h, s, bw=BW)
-                pid_ctr += 1
-            # Note: to actually add the ports to the switch, we could use
-            #       map(s.attach, range(NUM_PORTS))
-            #       however, switch numbers don't matter, only the number of
-            #       remaining switches, so this seemed simpler.
-            self.switch_ports_remaining[s] = r
-            self.remaining_switches.append(s)
-
-        # run jellyfish to connect switches to one another
-        self.make_jellyfish_topo()
-
-        # since there is not actual removeLink method, only add links at the end
-        for l in self.temp_links: self.addLink(*l, bw=BW)
-
-    def make_jellyfish_topo(self):
-        # while possible, join two random switches with free ports
-        while True:
-            p = self.find_available_pair()
-            if not p: break
-            self.temp_links.append(p)
-            self.connections[p[0]].append(p[1])
-            self.connections[p[1]].append(p[0])
-            for s in p:
-                self.switch_ports_remaining[s] -= 1
-                if self.switch_ports_remaining[s] == 0:
-                    self.remaining_switches.remove(s)
-
-        # if a switch remains with >=2 free ports (p1, p2),
-        # pick a random existing link (x, y), remove it,
-        # and connect (p1, x) and (p2, y)
-        if self.remaining_switches:
-            s = self.remaining_switches[0]
-            connected = self.connections[s]
-            # the switch must already be connected to neither switch
-            possible = filter(lambda l: l[0] not in connected and l[1] not in connected,
-                self.temp_links)
-            if possible:
-                l = possible[0]
-                self.temp_links.remove(l)
-                self.temp_links.append((s, l[0]))
-                self.temp_links.append((s, l[1]))
-
-    def find_available_pair(self):
-        random.shuffle(self.remaining_switches) # this is slow, but necessary...
-        for s1 in self.remaining_switches:
-            for s2 in self.remaining_switches:
-                if s1 == s2: continue
-                if s2 in self.connections[s1]: continue
-                return (s1, s2)
-        return None
+        switches.append(s)
+
+    # run jellyfish to connect switches to one another
+    for l in jellyfish_links(switches, r): topo.addLink(*l, bw=BW)
+
+
+def jellyfish_links(switches, r):
+    """
+    Returns the links of a Jellyfish network between switches, each of which
+    has r ports for other switches.
+
+    While possible, joins two random switches with free ports that are not
+    yet connected.  Then, while a switch remains with >=2 free ports
+    (p1, p2), picks a random existing link (x, y), removes it, and connects
+    (p1, x) and (p2, y).
+
+    Draws from the random module, so seed it first for a reproducible
+    topology.  Runs in time linear in the number of links: switches with
+    free ports are kept in a list with O(1) swap-remove, and adjacency in
+    sets.
+    """
+    ports_remaining = dict((s, r) for s in switches)
+    connections = dict((s, set()) for s in switches)
+    remaining = list(switches) # switches that have >=1 port left
+    position = dict((s, i) for i, s in enumerate(remaining))
+    links = []
+    link_position = {}
+
+    def swap_remove(items, index, item):
+        i = index.pop(item)
+        last = items.pop()
+        if last != item:
+            items[i] = last
+            index[last] = i
+
+    def connect(s1, s2):
+        link_position[(s1, s2)] = len(links)
+        links.append((s1, s2))
+        connections[s1].add(s2)
+        connections[s2].add(s1)
+        for s in (s1, s2):
+            ports_remaining[s] -= 1
+            if ports_remaining[s] == 0:
+                swap_remove(remaining, position, s)
+
+    def disconnect(l):
+        swap_remove(links, link_position, l)
+        connections[l[0]].discard(l[1])
+        connections[l[1]].discard(l[0])
+        for s in l:
+            if ports_remaining[s] == 0:
+                position[s] = len(remaining)
+                remaining.append(s)
+            ports_remaining[s] += 1
+
+    # A few random draws almost always find a pair.  Only once few switches
+    # are left can all of them already be connected; then check every pair.
+    while len(remaining) > 1:
+        for attempt in range(8):
+            s1, s2 = random.sample(remaining, 2)
+            if s2 not in connections[s1]: break
+        else:
+            pairs = [(s1, s2) for i, s1 in enumerate(remaining)
+                     for s2 in remaining[i+1:] if s2 not in connections[s1]]
+            if not pairs: break
+            s1, s2 = random.choice(pairs)
+        connect(s1, s2)
+
+    def unconnected(s, l):
+        return (s not in l and l[0] not in connections[s] and
+                l[1] not in connections[s])
+
+    for s in list(remaining):
+        while ports_remaining[s] >= 2 and links:
+            for attempt in range(8):
+                l = random.choice(links)
+                if unconnected(s, l): break
+            else:
+                possible = [l for l in links if unconnected(s, l)]
+                if not possible: break
+                l = random.choice(possible)
+            disconnect(l)
+            connect(s, l[0])
+            connect(s, l[1])
+
+    return links
 
 
 class DummyTopo(Topo):
@@ -155,7 +215,7 @@ def dpid_to_mac_addr(dpid):
             https://stackoverflow.com/questions/12638408/decorating-hex-function-to-pad-zeros
     """
     interm = "{0:0{1}x}".format(dpid,12)
-    return ':'.join(s.encode('hex') for s in interm.decode('hex'))
+    return ':'.join(interm[i:i+2] for i in range(0, 12, 2))
 
 def dpid_to_ip_addr(dpid):
     """
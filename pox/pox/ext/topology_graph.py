@@ -0,0 +1,143 @@
+"""
+A lightweight, read-only topology that needs neither Mininet nor NetworkX.
+
+TopologyGraph answers the questions the controller side asks of a
+mininet.topo.Topo (nodes, hosts, switches, links and ports), so Routing,
+JellyfishController and LoopbackNetwork can use either.  Adjacency is kept
+in CSR form: the neighbours of node i are
+
+    indices[indptr[i]:indptr[i+1]]
+
+and ports[j] is the port on node i that leads to neighbour indices[j].
+
+Build one with TopologyGraphBuilder, which takes the same addSwitch,
+addHost and addLink calls as a Topo, and numbers ports the way Mininet does,
+so that a topology built both ways gets the same ports.
+"""
+
+from array import array
+import re
+
+def _natural_key(name):
+    "Sort key that orders names like Mininet does: s2 before s10."
+    return [int(part) if part.isdigit() else part
+            for part in re.split(r'(\d+)', name)]
+
+
+class TopologyGraph(object):
+    def __init__(self, names, switch_flags, links):
+        """
+        names is the list of node names, switch_flags whether each is a
+        switch, and links a list of (node1, node2, port1, port2), by index.
+        """
+        self.names = names
+        self.index = dict((name, i) for i, name in enumerate(names))
+        self.switch_flags = bytearray(switch_flags)
+        self.sorted_names = sorted(names, key=_natural_key)
+        self.link_array = array('i')
+        for link in links: self.link_array.extend(link)
+
+        degree = [0] * len(names)
+        for n1, n2, port1, port2 in links:
+            degree[n1] += 1
+            degree[n2] += 1
+        self.indptr = array('i', [0])
+        for d in degree: self.indptr.append(self.indptr[-1] + d)
+        self.indices = array('i', [0]) * len(links) * 2
+        self.ports = array('i', [0]) * len(links) * 2
+        fill = list(self.indptr[:-1])
+        for n1, n2, port1, port2 in links:
+            for node, peer, port in ((n1, n2, port1), (n2, n1, port2)):
+                self.indices[fill[node]] = peer
+                self.ports[fill[node]] = port
+                fill[node] += 1
+
+    def __len__(self):
+        return len(self.names)
+
+    def nodes(self, sort=True):
+        "Return nodes, sorted like Topo.nodes does, or in the order added."
+        return list(self.sorted_names if sort else self.names)
+
+    def switches(self, sort=True):
+        return [n for n in self.nodes(sort) if self.isSwitch(n)]
+
+    def hosts(self, sort=True):
+        return [n for n in self.nodes(sort) if not self.isSwitch(n)]
+
+    def isSwitch(self, n):
+        return bool(self.switch_flags[self.index[n]])
+
+    def links(self, withInfo=False):
+        """
+        Returns links in the order they were added, as (node1, node2), or
+        (node1, node2, info) with the ports in info like Topo does.  Topo's
+        sort and withKeys are not supported.
+        """
+        names, a = self.names, self.link_array
+        if not withInfo:
+            return [(names[a[i]], names[a[i+1]]) for i in range(0, len(a), 4)]
+        return [(names[a[i]], names[a[i+1]],
+                 {'node1': names[a[i]], 'node2': names[a[i+1]],
+                  'port1': a[i+2], 'port2': a[i+3]})
+                for i in range(0, len(a), 4)]
+
+    def neighbors(self, n):
+        "Return [(neighbour name, port on n towards it)]."
+        i = self.index[n]
+        return [(self.names[self.indices[j]], self.ports[j])
+                for j in range(self.indptr[i], self.indptr[i+1])]
+
+    def port(self, src, dst):
+        """
+        Returns (port on src towards dst, port on dst towards src).
+        """
+        for peer, sport in self.neighbors(src):
+            if peer == dst:
+                for peer, dport in self.neighbors(dst):
+                    if peer == src: return (sport, dport)
+        raise Exception('No link between %s and %s' % (src, dst))
+
+
+class TopologyGraphBuilder(object):
+    """
+    Collects a topology through the Topo building calls, and turns it into a
+    TopologyGraph.  Node and link options are only needed by Mininet, and
+    are dropped.
+    """
+    def __init__(self):
+        self.names = []
+        self.index = {}
+        self.switch_flags = []
+        self.port_counts = []
+        self.link_list = []
+
+    def _add_node(self, name, is_switch):
+        if name in self.index:
+            raise Exception('Duplicate node %s' % name)
+        self.index[name] = len(self.names)
+        self.names.append(name)
+        self.switch_flags.append(is_switch)
+        self.port_counts.append(0)
+        return name
+
+    def addSwitch(self, name, **opts):
+        return self._add_node(name, True)
+
+    def addHost(self, name, **opts):
+        return self._add_node(name, False)
+
+    def _port(self, i, port):
+        # Like Topo.addPort: new switch ports count from 1, host ports from 0.
+        if port is None:
+            port = self.port_counts[i] + (1 if self.switch_flags[i] else 0)
+        self.port_counts[i] += 1
+        return port
+
+    def addLink(self, node1, node2, port1=None, port2=None, **opts):
+        n1, n2 = self.index[node1], self.index[node2]
+        self.link_list.append((n1, n2, self._port(n1, port1),
+                               self._port(n2, port2)))
+
+    def graph(self):
+        return TopologyGraph(self.names, self.switch_flags, self.link_list)
@@ -0,0 +1,60 @@
+"""
+Sampled tracing for the controller's per-packet code.
+
+Logging every PacketIn formats a string per packet, whether or not anyone
+reads it.  A Tracer keeps every sample-th record it is given in a
+fixed-size ring buffer, as the format string and its arguments, and only
+formats them when the buffer is dumped.  JellyfishController dumps its
+tracer on SIGUSR1.
+"""
+
+import sys
+import time
+from collections import deque
+
+
+class Tracer (object):
+  """
+  Keeps a sample of recent trace records in a ring buffer
+
+  A record is (time, event, format, args).  sample is how many calls to
+  trace() there are per record kept: 1 keeps every one, 0 none.  Once size
+  records are kept, each new one replaces the oldest.
+  """
+  def __init__ (self, size=4096, sample=1):
+    self.records = deque(maxlen=size)
+    self.set_sample(sample)
+
+  def set_sample (self, sample):
+    self.sample = sample
+    # Calls to trace() until the next one kept
+    self._skip = 1 if sample else sys.maxint
+
+  def trace (self, event, fmt, *args):
+    """
+    Records event, described by fmt % args, if this call is sampled
+    """
+    self._skip -= 1
+    if self._skip > 0: return
+    self._skip = self.sample or sys.maxint
+    self.records.append((time.time(), event, fmt, args))
+
+  def format (self):
+    """
+    Yields the records, oldest first, as lines of text
+    """
+    for t, event, fmt, args in list(self.records):
+      yield "%.6f %s: %s" % (t, event, fmt % args)
+
+  def dump (self, out=None):
+    """
+    Writes the records to out (default: stderr), and forgets them
+    """
+    if out is None: out = sys.stderr
+    count = 0
+    for line in self.format():
+      out.write(line + "\n")
+      count += 1
+    self.records.clear()
+    out.flush()
+    return count
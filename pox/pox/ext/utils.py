@@ -1,6 +1,8 @@
 # Utility functions
 
-from topologies import topologies
+from topologies import topologies, dpid_to_mac_addr, dpid_to_ip_addr, node_name_to_dpid
+from pox.lib.packet import ethernet, ipv4, tcp
+from pox.lib.addresses import EthAddr, IPAddr
 
 def build_topology(topo):
     """
@@ -26,5 +28,46 @@ def build_topology(topo):
         raise Exception( 'Invalid topo_name %s' % topo_name )
     return topologies[topo_name](*topo_seq_params, **topo_kw_params)
 
+def read_jellyconfig(config_loc):
+    """
+    Reads the experiment configuration that run.py persists for the
+    controller, one key=value pair per line.
+
+        e.g. {'n': '25', 'k': '4', 'r': '3', 'seed': '0', 'routing': 'ecmp'}
+    """
+    config = {}
+    with open(config_loc, 'r') as config_file:
+        for line in config_file:
+            if '=' not in line: continue
+            key, val = line.split('=', 1)
+            config[key.strip()] = val.strip()
+    return config
+
+def make_tcp_packet(src, dst, tp_src=10000, tp_dst=5001):
+    """
+    Builds a TCP SYN between two hosts (by name), addressed the same way
+    topologies addresses hosts.
+    """
+    src_dpid, dst_dpid = node_name_to_dpid(src), node_name_to_dpid(dst)
+
+    l4 = tcp()
+    l4.srcport = tp_src
+    l4.dstport = tp_dst
+    l4.off = 5
+    l4.flags = tcp.SYN_flag
+
+    ip = ipv4()
+    ip.protocol = ipv4.TCP_PROTOCOL
+    ip.srcip = IPAddr(dpid_to_ip_addr(src_dpid))
+    ip.dstip = IPAddr(dpid_to_ip_addr(dst_dpid))
+    ip.payload = l4
+
+    eth = ethernet()
+    eth.type = ethernet.IP_TYPE
+    eth.src = EthAddr(dpid_to_mac_addr(src_dpid))
+    eth.dst = EthAddr(dpid_to_mac_addr(dst_dpid))
+    eth.payload = ip
+    return eth
+
 def dpid_to_str(dpid):
     return "s%d" % dpid
@@ -11,8 +11,9 @@ with slight modifications from Sarah Tollman
 """
 __author__ = 'Guilherme Maia <guilhermemm@gmail.com>'
 
-__all__ = ['k_shortest_paths']
+__all__ = ['k_shortest_paths', 'UnitGraph', 'unit_k_shortest_paths']
 
+from collections import deque
 from heapq import heappush, heappop
 from itertools import count
 
@@ -61,7 +62,9 @@ def k_shortest_paths(G, source, target, k=1, weight='weight'):
     paths = [path]
     c = count()
     B = []
-    G_original = G.copy()
+    # Spur searches remove and re-add edges; do that on a copy, so that the
+    # caller's graph (and its edge order) comes back untouched.
+    G = G.copy()
 
     for i in range(1, k):
         for j in range(len(paths[-1]) - 1):
@@ -86,7 +89,7 @@ def k_shortest_paths(G, source, target, k=1, weight='weight'):
             if nx.has_path(G, spur_node, target):
                 spur_path_length, spur_path = nx.single_source_dijkstra(G, spur_node, target, weight=weight)
                 total_path = root_path[:-1] + spur_path
-                total_path_length = get_path_length(G_original, root_path, weight) + spur_path_length
+                total_path_length = get_path_length(G, root_path, weight) + spur_path_length
                 heappush(B, (total_path_length, next(c), total_path))
 
             for e in edges_removed:
@@ -112,3 +115,112 @@ def get_path_length(G, path, weight='weight'):
             length += 1
 
     return length
+
+
+class UnitGraph(object):
+    """
+    An unweighted NetworkX graph as integer-indexed adjacency lists, for
+    unit_k_shortest_paths.  Build it once and reuse it across searches.
+    """
+    def __init__(self, G):
+        self.nodes = list(G)
+        self.index = dict((node, i) for i, node in enumerate(self.nodes))
+        self.adj = [[self.index[v] for v in G[u]] for u in self.nodes]
+
+    def bfs_path(self, source, target, blocked_nodes, blocked_next):
+        """
+        Returns a shortest path (of indices) from source to target that visits
+        no node in blocked_nodes, and whose first hop is not in blocked_next,
+        or None if there is none.
+        """
+        if source == target:
+            return [source]
+        adj = self.adj
+        parent = [-1] * len(adj)
+        for node in blocked_nodes:
+            parent[node] = node
+        parent[source] = source
+        frontier = deque()
+        for v in adj[source]:
+            if parent[v] == -1 and v not in blocked_next:
+                parent[v] = source
+                frontier.append(v)
+        while frontier:
+            u = frontier.popleft()
+            if u == target:
+                path = [u]
+                while u != source:
+                    u = parent[u]
+                    path.append(u)
+                path.reverse()
+                return path
+            for v in adj[u]:
+                if parent[v] == -1:
+                    parent[v] = u
+                    frontier.append(v)
+        return None
+
+def unit_k_shortest_paths(G, source, target, k=1):
+    """Returns the k-shortest loopless paths from source to target in G,
+    counting every edge as length 1.
+
+    Same results format as k_shortest_paths, but much faster on unweighted
+    graphs: spur paths are found by BFS over a UnitGraph, with the root path
+    and removed edges masked out rather than removed from the graph.  Like
+    Lawler's variant of Yen's algorithm, a path only spurs from nodes at or
+    after the node where it left its parent path, since spurs from before
+    that were already tried for the parent.
+
+    Parameters
+    ----------
+    G : UnitGraph or NetworkX graph
+    source : node
+    target : node
+    k : integer, optional (default=1)
+
+    Raises
+    ------
+    NetworkXNoPath
+       If no path exists between source and target.
+    """
+    if not isinstance(G, UnitGraph):
+        G = UnitGraph(G)
+    if source == target:
+        return ([0], [[source]])
+
+    s = G.index[source]
+    t = G.index[target]
+    path = G.bfs_path(s, t, (), ())
+    if path is None:
+        raise nx.NetworkXNoPath('node %s not reachable from %s' % (target, source))
+
+    paths = [path]
+    deviations = [0] # index of the node where each path left its parent
+    seen = set([tuple(path)])
+    c = count()
+    B = []
+
+    while len(paths) < k:
+        last = paths[-1]
+        for j in range(deviations[-1], len(last) - 1):
+            root_path = last[:j + 1]
+            blocked_next = set(p[j + 1] for p in paths
+                               if len(p) > j + 1 and p[:j + 1] == root_path)
+            spur_path = G.bfs_path(last[j], t, root_path[:-1], blocked_next)
+            if spur_path is None:
+                continue
+            total_path = root_path[:-1] + spur_path
+            key = tuple(total_path)
+            if key not in seen:
+                seen.add(key)
+                heappush(B, (len(total_path), next(c), j, total_path))
+
+        if not B:
+            break
+        _, _, j, path = heappop(B)
+        paths.append(path)
+        deviations.append(j)
+
+    nodes = G.nodes
+    return ([len(p) - 1 for p in paths],
+            [[nodes[i] for i in p] for p in paths])
@@ -114,3 +114,83 @@ class EpollSelect(object):
 
   def close(self):
     self.epoll.close()
+
+
+class EdgeEpoll(object):
+  """ persistent, edge-triggered epoll registrations for a recoco Task.
+
+      Objects are registered once, when they are opened, instead of being
+      passed in on every wait like with select().  The epoll object's own fd
+      is readable whenever a registered fd has an event, so a Task waits with
+        rl, wl, xl = yield Select([edge_epoll], [], [], timeout)
+      and then calls poll() to get the objects that are ready.  The cost of a
+      wakeup is in the number of ready objects, not registered ones, and
+      there is no FD_SETSIZE limit on the registered fds.
+
+      Being edge-triggered, an object is only reported again once there is
+      new data for it (or new room to write).  A reader that stops before
+      it gets EAGAIN must call again(obj) to have obj reported in the next
+      poll().
+  """
+
+  def __init__(self):
+    self.epoll = select.epoll()
+    self.fd_to_obj = {}
+    self.obj_to_fd = {}
+    self._again = set()
+
+  def fileno(self):
+    return self.epoll.fileno()
+
+  def register(self, obj, write=True):
+    """ watch obj for reading, and also for writing if write is set """
+    fd = obj.fileno() if hasattr(obj, "fileno") else obj
+    mask = select.EPOLLIN | select.EPOLLPRI | select.EPOLLET
+    if write: mask |= select.EPOLLOUT
+    self.epoll.register(fd, mask)
+    self.fd_to_obj[fd] = obj
+    self.obj_to_fd[obj] = fd
+
+  def unregister(self, obj):
+    """ may be called before or after obj is closed """
+    fd = self.obj_to_fd.pop(obj, None)
+    if fd is None: return
+    del self.fd_to_obj[fd]
+    self._again.discard(obj)
+    try:
+      self.epoll.unregister(fd)
+    except (IOError, OSError):
+      pass # closing the fd already removed it
+
+  def again(self, obj):
+    """ report obj as readable in the next poll() """
+    if obj in self.obj_to_fd:
+      self._again.add(obj)
+
+  @property
+  def pending(self):
+    """ whether the next poll() has objects to report without waiting """
+    return len(self._again) > 0
+
+  def poll(self, timeout=0):
+    """ returns (readable, writable, error) lists of registered objects
+        that have had events since the last poll().
+    """
+    again = self._again
+    self._again = set()
+    retrl = list(again)
+    retwl = []
+    retxl = []
+    for (fd, event) in self.epoll.poll(timeout):
+      obj = self.fd_to_obj.get(fd)
+      if obj is None: continue
+      if event & (select.EPOLLIN|select.EPOLLPRI):
+        if obj not in again: retrl.append(obj)
+      if event & select.EPOLLOUT:
+        retwl.append(obj)
+      if event & (select.EPOLLERR|select.EPOLLHUP):
+        retxl.append(obj)
+    return (retrl, retwl, retxl)
+
+  def close(self):
+    self.epoll.close()
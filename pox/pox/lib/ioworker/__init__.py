@@ -24,9 +24,11 @@ import sys
 import errno
 from collections import deque
 import socket
+import select
 
 from pox.lib.util import assert_type, makePinger
 from pox.lib.recoco import Select, Task
+from pox.lib.epoll_select import EdgeEpoll
 
 from pox.core import core
 log = core.getLogger()
@@ -112,6 +114,8 @@ class IOWorker (object):
         loop._workers.discard(self)
       else:
         self._push_receive_data(data)
+        # A full read means there may be more to read
+        return len(data) == loop._BUF_SIZE
     except socket.error as (s_errno, strerror):
       if s_errno == errno.ENOENT:
         # SSL library does this sometimes
@@ -269,6 +273,7 @@ class RecocoIOWorker (IOWorker):
 
   # Set by register
   on_close = None
+  on_send = None
   pinger = None
 
   def __init__ (self, socket):
@@ -302,11 +307,11 @@ class RecocoIOWorker (IOWorker):
           return
 
     IOWorker.send(self, data)
-    self.pinger.ping()
+    self.on_send(self)
 
   def send (self, data):
     IOWorker.send(self, data)
-    self.pinger.ping()
+    self.on_send(self)
 
   def close (self):
     """ Register this socket to be closed. fire and forget """
@@ -355,7 +360,11 @@ class RecocoIOLoop (Task):
   _BUF_SIZE = 8192
   more_debugging = False
 
-  def __init__ (self, worker_type = RecocoIOWorker):
+  def __init__ (self, worker_type = RecocoIOWorker, use_epoll = None):
+    """
+    use_epoll picks edge-triggered epoll over select().  By default, it is
+    used where epoll is available (i.e., on Linux).
+    """
     super(RecocoIOLoop,self).__init__()
     self._worker_type = worker_type
     self._workers = set()
@@ -364,6 +373,15 @@ class RecocoIOLoop (Task):
     # other threads register open() and close() requests by adding lambdas
     # to this thread-safe queue.
     self._pending_commands = deque()
+    if use_epoll is None:
+      use_epoll = hasattr(select, 'epoll')
+    self._poller = None
+    if use_epoll:
+      self._poller = EdgeEpoll()
+      self._poller.register(self.pinger, write=False)
+    # Workers that have been given data to send, for the epoll loop, which
+    # only hears about sockets that become writable again.
+    self._sending = deque()
 
   def new_worker (self, *args, **kw):
     '''
@@ -396,17 +414,28 @@ class RecocoIOLoop (Task):
     def on_close (worker):
       def close_worker (worker):
         # Actually close the worker (called by Select loop)
+        if self._poller: self._poller.unregister(worker)
         worker.socket.close()
         self._workers.discard(worker)
       # schedule close_worker to be called by Select loop
       self._pending_commands.append(lambda: close_worker(worker))
       self.pinger.ping()
 
+    # Our callback for io_worker.send():
+    def on_send (worker):
+      if self._poller: self._sending.append(worker)
+      self.pinger.ping()
+
+    def add_worker (worker):
+      self._workers.add(worker)
+      if self._poller: self._poller.register(worker)
+
     worker.on_close = on_close
+    worker.on_send = on_send
     worker.pinger = self.pinger
 
     # Don't add immediately, since we may be in the wrong thread
-    self._pending_commands.append(lambda: self._workers.add(worker))
+    self._pending_commands.append(lambda: add_worker(worker))
     self.pinger.ping()
 
   def stop (self):
@@ -422,21 +451,38 @@ class RecocoIOLoop (Task):
         while len(self._pending_commands) > 0:
           self._pending_commands.popleft()()
 
-        # Now grab workers
-        read_sockets = list(self._workers) + [ self.pinger ]
-        write_sockets = [ worker for worker in self._workers
-                          if worker._ready_to_send ]
-        exception_sockets = list(self._workers)
-
-        if self.more_debugging:
-          log.debug("Select In : " + _format_lists(read_sockets,
-              write_sockets, exception_sockets))
-
-        rlist, wlist, elist = yield Select(read_sockets, write_sockets,
-                exception_sockets, self._select_timeout)
-
-        if self.more_debugging:
-          log.debug("Select Out: " + _format_lists(rlist, wlist, elist))
+        if self._poller:
+          poller = self._poller
+          yield Select([poller], [], [],
+                       0 if poller.pending else self._select_timeout)
+          rlist, wlist, elist = poller.poll()
+          # Reading finds out what went wrong, and reads what came first.
+          rlist.extend(w for w in elist if w not in rlist)
+          elist = []
+          # Writable sockets are only reported when they become writable,
+          # so also try the ones that have been given something to send.
+          writable = set(wlist)
+          while self._sending:
+            worker = self._sending.popleft()
+            if worker not in writable and worker in self._workers:
+              writable.add(worker)
+              wlist.append(worker)
+        else:
+          # Now grab workers
+          read_sockets = list(self._workers) + [ self.pinger ]
+          write_sockets = [ worker for worker in self._workers
+                            if worker._ready_to_send ]
+          exception_sockets = list(self._workers)
+
+          if self.more_debugging:
+            log.debug("Select In : " + _format_lists(read_sockets,
+                write_sockets, exception_sockets))
+
+          rlist, wlist, elist = yield Select(read_sockets, write_sockets,
+                  exception_sockets, self._select_timeout)
+
+          if self.more_debugging:
+            log.debug("Select Out: " + _format_lists(rlist, wlist, elist))
 
         if self.pinger in rlist:
           self.pinger.pongAll()
@@ -450,7 +496,9 @@ class RecocoIOLoop (Task):
             wlist.remove(worker)
 
         for worker in rlist:
-          worker._do_recv(self)
+          if worker._do_recv(self) and self._poller:
+            # Let the other workers read before reading the rest.
+            self._poller.again(worker)
 
         for worker in wlist:
           worker._do_send(self)
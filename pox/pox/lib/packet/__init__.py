@@ -46,6 +46,7 @@ from dns import *
 from eap import *
 from eapol import *
 from ethernet import *
+from ethernet_view import ethernet_view
 from ipv6 import *
 from ipv4 import *
 from icmpv6 import *
@@ -63,6 +64,7 @@ __all__ = [
   'eap',
   'eapol',
   'ethernet',
+  'ethernet_view',
   'ipv4',
   'ipv6',
   'icmp',
@@ -0,0 +1,194 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+A lazy view of the headers of a raw Ethernet frame
+
+Parsing a frame with ethernet() builds an object for every layer, even
+when all a forwarding module wants are the addresses and the 5-tuple.  An
+ethernet_view reads those straight out of the raw bytes at their fixed
+offsets, the first time one of them is asked for, and only builds the
+full pox.lib.packet objects if .packet (or .next or .find()) is used.
+"""
+
+import struct
+
+from pox.lib.addresses import EthAddr, IPAddr
+from ethernet import ethernet
+
+_ethertype = struct.Struct("!H")
+_ipv4 = struct.Struct("!BBH5xB2xLL") # vhl, tos, len, proto, src, dst
+_ports = struct.Struct("!HH")
+
+_VLAN_TYPE = 0x8100
+_IP_TYPE = 0x0800
+_TCP_PROTOCOL = 6
+_UDP_PROTOCOL = 17
+
+
+class ethernet_view (object):
+  """
+  Decodes Ethernet, IPv4 and TCP/UDP header fields of raw on demand
+
+  The fields follow ethernet and ofp_match: src, dst and type are those of
+  the Ethernet header, effective_ethertype looks past a VLAN tag, and
+  nw_src, nw_dst (as unsigned ints), nw_proto, nw_tos, tp_src and tp_dst
+  are None unless the frame has a complete header of that protocol.
+  """
+  __slots__ = ('raw', '_src', '_dst', '_packet', '_ip')
+
+  def __init__ (self, raw):
+    self.raw = raw
+    self._src = None
+    self._dst = None
+    self._packet = None
+    self._ip = None
+
+  @property
+  def parsed (self):
+    """
+    Whether there is a whole Ethernet header, like ethernet.parsed
+    """
+    return len(self.raw) >= 14
+
+  @property
+  def dst (self):
+    if self._dst is None:
+      self._dst = EthAddr(self.raw[:6])
+    return self._dst
+
+  @property
+  def src (self):
+    if self._src is None:
+      self._src = EthAddr(self.raw[6:12])
+    return self._src
+
+  @property
+  def type (self):
+    return _ethertype.unpack_from(self.raw, 12)[0]
+
+  @property
+  def effective_ethertype (self):
+    t = self.type
+    if t == _VLAN_TYPE and len(self.raw) >= 18:
+      t = _ethertype.unpack_from(self.raw, 16)[0]
+    return t
+
+  def _decode_ip (self):
+    """
+    Returns (tos, proto, src, dst, tp_src, tp_dst), or () if not IPv4
+    """
+    ip = self._ip
+    if ip is not None: return ip
+    ip = self._ip = ()
+    raw = self.raw
+    if len(raw) < 14: return ip
+
+    offset = 14
+    t = _ethertype.unpack_from(raw, 12)[0]
+    if t == _VLAN_TYPE:
+      if len(raw) < 18: return ip
+      offset = 18
+      t = _ethertype.unpack_from(raw, 16)[0]
+    # The same checks ipv4.parse() does before taking it for IPv4
+    if t != _IP_TYPE or len(raw) - offset < 20: return ip
+    vhl, tos, length, proto, src, dst = _ipv4.unpack_from(raw, offset)
+    hl = (vhl & 0x0f) * 4
+    if vhl >> 4 != 4 or hl < 20 or hl >= length or hl > len(raw) - offset:
+      return ip
+
+    tp_src = tp_dst = None
+    offset += hl
+    end = min(offset - hl + length, len(raw))
+    if ((proto == _TCP_PROTOCOL and end - offset >= 20) or
+        (proto == _UDP_PROTOCOL and end - offset >= 8)):
+      tp_src, tp_dst = _ports.unpack_from(raw, offset)
+    ip = self._ip = (tos, proto, src, dst, tp_src, tp_dst)
+    return ip
+
+  @property
+  def is_ipv4 (self):
+    return len(self._decode_ip()) != 0
+
+  @property
+  def nw_tos (self):
+    ip = self._decode_ip()
+    return ip[0] if ip else None
+
+  @property
+  def nw_proto (self):
+    ip = self._decode_ip()
+    return ip[1] if ip else None
+
+  @property
+  def nw_src (self):
+    ip = self._decode_ip()
+    return ip[2] if ip else None
+
+  @property
+  def nw_dst (self):
+    ip = self._decode_ip()
+    return ip[3] if ip else None
+
+  @property
+  def tp_src (self):
+    ip = self._decode_ip()
+    return ip[4] if ip else None
+
+  @property
+  def tp_dst (self):
+    ip = self._decode_ip()
+    return ip[5] if ip else None
+
+  @property
+  def srcip (self):
+    ip = self._decode_ip()
+    return IPAddr(ip[2]) if ip else None
+
+  @property
+  def dstip (self):
+    ip = self._decode_ip()
+    return IPAddr(ip[3]) if ip else None
+
+  @property
+  def five_tuple (self):
+    """
+    (nw_src, nw_dst, nw_proto, tp_src, tp_dst) of TCP and UDP, else None
+    """
+    ip = self._decode_ip()
+    if not ip or ip[4] is None: return None
+    return (ip[2], ip[3], ip[1], ip[4], ip[5])
+
+  @property
+  def packet (self):
+    """
+    The frame fully parsed by pox.lib.packet, built on first use
+    """
+    if self._packet is None:
+      self._packet = ethernet(self.raw)
+    return self._packet
+
+  @property
+  def next (self):
+    return self.packet.next
+
+  def find (self, proto):
+    return self.packet.find(proto)
+
+  def pack (self):
+    return self.raw
+
+  def __len__ (self):
+    return len(self.raw)
+
+  def __str__ (self):
+    return str(self.packet)
@@ -236,6 +236,7 @@ class Scheduler (object):
 
   def quit (self):
     self._hasQuit = True
+    self._event.set()
 
   def run (self):
     try:
@@ -37,6 +37,7 @@ from pox.lib.revent import *
 from pox.lib.util import dpidToStr
 import libopenflow_01 as of
 from pox.lib.packet.ethernet import ethernet
+from pox.lib.packet.ethernet_view import ethernet_view
 
 class ConnectionUp (Event):
   """
@@ -164,6 +165,7 @@ class PacketIn (Event):
   port (int) - number of port the packet came in on
   data (bytes) - raw packet data
   parsed (packet subclasses) - pox.lib.packet's parsed version
+  headers (ethernet_view) - lazily decoded header fields
   """
   def __init__ (self, connection, ofp):
     Event.__init__(self)
@@ -172,13 +174,25 @@ class PacketIn (Event):
     self.port = ofp.in_port
     self.data = ofp.data
     self._parsed = None
+    self._headers = None
     self.dpid = connection.dpid
 
   def parse (self):
     if self._parsed is None:
-      self._parsed = ethernet(self.data)
+      self._parsed = self.headers.packet
     return self._parsed
 
+  @property
+  def headers (self):
+    """
+    A pox.lib.packet.ethernet_view of the packet
+
+    Much cheaper than parsed when only a few header fields are needed.
+    """
+    if self._headers is None:
+      self._headers = ethernet_view(self.data)
+    return self._headers
+
   @property
   def parsed (self):
     """
@@ -328,6 +342,9 @@ class OpenFlowNexus (EventMixin):
   # Enable/Disable clearing of flows on switch connect
   clear_flows_on_connect = True
 
+  # Reaches switches connected to other processes (see openflow.shards)
+  remote = None
+
   def __init__ (self):
     self._connections = ConnectionDict() # DPID -> Connection
 
@@ -352,6 +369,8 @@ class OpenFlowNexus (EventMixin):
     if dpid in self._connections:
       self._connections[dpid].send(data)
       return True
+    elif self.remote is not None and self.remote.sendToDPID(dpid, data):
+      return True
     else:
       import logging
       log = logging.getLogger("openflow")
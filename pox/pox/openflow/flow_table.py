@@ -21,6 +21,9 @@ from pox.lib.revent import *
 
 import time
 import math
+from bisect import insort
+from heapq import heappush, heappop, heapify
+from operator import itemgetter
 
 # FlowTable Entries:
 #   match - ofp_match (13-tuple)
@@ -132,6 +135,21 @@ class TableEntry (object):
     if now is None: now = time.time()
     return self.is_idle_timed_out(now) or self.is_hard_timed_out(now)
 
+  @property
+  def deadline (self):
+    """
+    The time after which this entry is expired unless touched again
+
+    None if it has neither an idle nor a hard timeout.
+    """
+    deadline = None
+    if self.idle_timeout > 0:
+      deadline = self.last_touched + self.idle_timeout
+    if self.hard_timeout > 0:
+      hard = self.created + self.hard_timeout
+      if deadline is None or hard < deadline: deadline = hard
+    return deadline
+
   def __str__ (self):
     return type(self).__name__ + "\n  " + self.show()
 
@@ -181,6 +199,252 @@ class TableEntry (object):
     return fr
 
 
+# The fields ofp_match has a single wildcard bit for, in the order
+# _match_key() returns their values in.
+_key_fields = (
+  ('in_port', OFPFW_IN_PORT),
+  ('dl_vlan', OFPFW_DL_VLAN),
+  ('dl_src', OFPFW_DL_SRC),
+  ('dl_dst', OFPFW_DL_DST),
+  ('dl_type', OFPFW_DL_TYPE),
+  ('nw_proto', OFPFW_NW_PROTO),
+  ('tp_src', OFPFW_TP_SRC),
+  ('tp_dst', OFPFW_TP_DST),
+  ('dl_vlan_pcp', OFPFW_DL_VLAN_PCP),
+  ('nw_tos', OFPFW_NW_TOS),
+)
+
+def _prefix_mask (bits):
+  return (0xffFFffFF << (32 - bits)) & 0xffFFffFF
+
+def _match_key (match):
+  """
+  Returns (mask, values, nw_src, nw_dst) for an ofp_match
+
+  mask is (exact fields, nw_src prefix length, nw_dst prefix length), with
+  the exact fields as a tuple of indexes into _key_fields.  values has the
+  value of every field in _key_fields, None if it is wildcarded, with MACs
+  as raw bytes.  nw_src and nw_dst are unsigned ints, or None if
+  wildcarded.
+  """
+  wc = match.wildcards
+  exact = []
+  values = []
+  for i, (name, bit) in enumerate(_key_fields):
+    v = getattr(match, name)
+    if v is not None:
+      exact.append(i)
+      if name == 'dl_src' or name == 'dl_dst':
+        v = v.toRaw() if isinstance(v, EthAddr) else EthAddr(v).toRaw()
+    values.append(v)
+
+  addrs = []
+  for ip, bits in (match.get_nw_src(), match.get_nw_dst()):
+    if ip is None:
+      addrs.append((0, None))
+    else:
+      if isinstance(ip, IPAddr): ip = ip.toUnsigned()
+      elif not isinstance(ip, (int, long)): ip = IPAddr(ip).toUnsigned()
+      addrs.append((bits, ip & 0xffFFffFF))
+
+  mask = (tuple(exact), addrs[0][0], addrs[1][0])
+  return mask, values, addrs[0][1], addrs[1][1]
+
+
+class _SubTable (object):
+  """
+  The entries of a TupleSpace that all have the same mask
+  """
+  def __init__ (self, mask):
+    self.mask = mask
+    exact, self.src_bits, self.dst_bits = mask
+    self.src_mask = _prefix_mask(self.src_bits)
+    self.dst_mask = _prefix_mask(self.dst_bits)
+    if len(exact) == 0:
+      self._project = lambda values: ()
+    else:
+      getter = itemgetter(*exact)
+      if len(exact) == 1:
+        self._project = lambda values: (getter(values),)
+      else:
+        self._project = getter
+    self.buckets = {} # key -> [(-effective priority, -seq, entry)]
+    self.priorities = {} # effective priority -> number of entries
+    self.max_priority = None
+
+  def key (self, values, nw_src, nw_dst):
+    """
+    Returns the key of a packet or match in this subtable
+
+    Returns None if it lacks an address this subtable matches on.
+    """
+    key = self._project(values)
+    if self.src_bits:
+      if nw_src is None: return None
+      key += (nw_src & self.src_mask,)
+    if self.dst_bits:
+      if nw_dst is None: return None
+      key += (nw_dst & self.dst_mask,)
+    return key
+
+  def covers (self, mask):
+    """
+    Whether entries here have all the fields of mask, at least as exactly
+    """
+    exact, src_bits, dst_bits = mask
+    mine = self.mask[0]
+    return (self.src_bits >= src_bits and self.dst_bits >= dst_bits and
+            all(i in mine for i in exact))
+
+  def within (self, mask):
+    """
+    Whether entries here have no fields mask doesn't, or less exactly
+    """
+    exact, src_bits, dst_bits = mask
+    return (self.src_bits <= src_bits and self.dst_bits <= dst_bits and
+            all(i in exact for i in self.mask[0]))
+
+  def entries (self):
+    for bucket in self.buckets.itervalues():
+      for item in bucket:
+        yield item[2]
+
+
+class TupleSpace (object):
+  """
+  Classifies packets against a set of TableEntry by tuple space search
+
+  Entries are grouped into subtables by which fields they match and how
+  long their IP prefixes are, and each subtable is a dict from the values
+  of those fields to its entries.  A packet is looked up in one subtable
+  after another, in order of the highest priority each holds, until no
+  remaining subtable can beat the best entry found.  With only exact
+  matches, as a reactive controller installs, that is one dict lookup.
+
+  Entries are ordered as FlowTable orders them: by effective_priority,
+  then the most recently added first.  Their matches and priorities must
+  not change while they are in here.
+  """
+  def __init__ (self):
+    self._subtables = {} # mask -> _SubTable
+    self._order = None # Subtables, highest max_priority first
+    self._where = {} # entry -> (subtable, key, seq)
+    self._seq = 0
+
+  def __len__ (self):
+    return len(self._where)
+
+  def __contains__ (self, entry):
+    return entry in self._where
+
+  def add (self, entry):
+    if entry in self._where: self.remove(entry)
+    mask, values, nw_src, nw_dst = _match_key(entry.match)
+    st = self._subtables.get(mask)
+    if st is None:
+      st = self._subtables[mask] = _SubTable(mask)
+    key = st.key(values, nw_src, nw_dst)
+    self._seq += 1
+    priority = entry.effective_priority
+    insort(st.buckets.setdefault(key, []), (-priority, -self._seq, entry))
+    st.priorities[priority] = st.priorities.get(priority, 0) + 1
+    if st.max_priority is None or priority > st.max_priority:
+      st.max_priority = priority
+      self._order = None
+    self._where[entry] = (st, key, self._seq)
+
+  def remove (self, entry):
+    """
+    Removes entry, raising KeyError if it's not here
+    """
+    st, key, seq = self._where.pop(entry)
+    bucket = st.buckets[key]
+    for i, item in enumerate(bucket):
+      if item[2] is entry:
+        del bucket[i]
+        break
+    if not bucket: del st.buckets[key]
+
+    priority = -item[0]
+    count = st.priorities[priority] - 1
+    if count:
+      st.priorities[priority] = count
+    else:
+      del st.priorities[priority]
+      if not st.priorities:
+        del self._subtables[st.mask]
+        self._order = None
+      elif priority == st.max_priority:
+        st.max_priority = max(st.priorities)
+        self._order = None
+
+  def _sort_key (self, entry):
+    st, key, seq = self._where[entry]
+    return (-entry.effective_priority, -seq)
+
+  def sorted (self, entries=None):
+    """
+    Returns entries (default: all of them) in table order
+    """
+    if entries is None: entries = self._where
+    return sorted(entries, key=self._sort_key)
+
+  def _ordered (self):
+    if self._order is None:
+      self._order = sorted(self._subtables.itervalues(),
+                           key=lambda st: st.max_priority, reverse=True)
+    return self._order
+
+  def lookup (self, match):
+    """
+    Returns the first entry that matches every field of an exact match
+
+    For match, ofp_match.from_packet() of a packet.
+    """
+    mask, values, nw_src, nw_dst = _match_key(match)
+    best = None
+    for st in self._ordered():
+      if best is not None and st.max_priority < -best[0]: break
+      key = st.key(values, nw_src, nw_dst)
+      if key is None: continue
+      bucket = st.buckets.get(key)
+      if bucket and (best is None or bucket[0] < best):
+        best = bucket[0]
+    return None if best is None else best[2]
+
+  def narrower (self, match):
+    """
+    Yields entries whose matches match.matches_with_wildcards() might accept
+
+    That is, entries in subtables at least as exact as match.  Callers
+    still need to check them.
+    """
+    mask, values, nw_src, nw_dst = _match_key(match)
+    for st in self._subtables.itervalues():
+      if st.mask == mask:
+        # Only entries with the same values can be the same or narrower
+        bucket = st.buckets.get(st.key(values, nw_src, nw_dst), ())
+        for item in bucket:
+          yield item[2]
+      elif st.covers(mask):
+        for entry in st.entries():
+          yield entry
+
+  def wider (self, match):
+    """
+    Yields entries whose matches_with_wildcards(match) might be True
+
+    That is, the entries of subtables no more exact than match that have
+    the same values as match in the fields they match on.
+    """
+    mask, values, nw_src, nw_dst = _match_key(match)
+    for st in self._subtables.itervalues():
+      if st.within(mask):
+        bucket = st.buckets.get(st.key(values, nw_src, nw_dst), ())
+        for item in bucket:
+          yield item[2]
+
+
 class FlowTableModification (Event):
   def __init__ (self, added=[], removed=[], reason=None):
     Event.__init__(self)
@@ -199,62 +463,144 @@ class FlowTable (EventMixin):
 
   Maintains an ordered list of flow entries, and finds matching entries for
   packets and other entries. Supports expiration of flows.
+
+  The entries are kept in a TupleSpace, so that finding them does not mean
+  going through all of them.  Likewise, entries with a timeout are kept in
+  a heap by deadline, so expiring them only looks at those that are due.
+
+  Changes made between start_batch() and end_batch() take effect at once,
+  but are announced by a single FlowTableModification at the end (one per
+  removal reason, if there are several).
   """
   _eventMixin_events = set([FlowTableModification])
 
   def __init__ (self):
     EventMixin.__init__(self)
 
-    # Table is a list of TableEntry sorted by descending effective_priority.
-    self._table = []
+    self._index = TupleSpace()
+
+    # List of TableEntry sorted by descending effective_priority, built
+    # from _index when it's asked for.
+    self._sorted = None
+
+    # Heap of (deadline, seq, entry) of the entries with a timeout, and the
+    # seq of the live item of each.  Touching an entry leaves its item
+    # where it is; remove_expired_entries() queues it again when that comes
+    # due, so touch_packet() stays cheap.
+    self._expiry = []
+    self._expiry_seq = {}
+    self._next_seq = 0
+
+    # While batching, (added, {reason:removed}) not yet announced
+    self._batch = None
 
   def _dirty (self):
     """
     Call when table changes
     """
-    pass
+    self._sorted = None
+
+  @property
+  def _table (self):
+    if self._sorted is None:
+      self._sorted = self._index.sorted()
+    return self._sorted
 
   @property
   def entries (self):
     return self._table
 
   def __len__ (self):
-    return len(self._table)
+    return len(self._index)
+
+  def _schedule (self, entry):
+    """
+    Queues entry for expiry at its current deadline, if it has one
+    """
+    deadline = entry.deadline
+    if deadline is None: return
+    self._next_seq += 1
+    self._expiry_seq[entry] = self._next_seq
+    heappush(self._expiry, (deadline, self._next_seq, entry))
+
+    # Items of entries removed some other way stay until they come due;
+    # don't let them pile up.
+    if len(self._expiry) > 2 * len(self._expiry_seq) + 64:
+      seqs = self._expiry_seq
+      self._expiry = [i for i in self._expiry if seqs.get(i[2]) == i[1]]
+      heapify(self._expiry)
+
+  def start_batch (self):
+    """
+    Holds back FlowTableModification events until end_batch()
+    """
+    if self._batch is None:
+      self._batch = ([], {})
+
+  def end_batch (self):
+    """
+    Raises the FlowTableModification events held back since start_batch()
+    """
+    if self._batch is None: return
+    added, removed = self._batch
+    self._batch = None
+    if added or None in removed:
+      self.raiseEvent(FlowTableModification(added=added,
+                                            removed=removed.pop(None, [])))
+    for reason, entries in removed.iteritems():
+      self.raiseEvent(FlowTableModification(removed=entries, reason=reason))
+
+  def _modified (self, added=[], removed=[], reason=None):
+    if self._batch is None:
+      self.raiseEvent(FlowTableModification(added=added, removed=removed,
+                                            reason=reason))
+      return
+    self._batch[0].extend(added)
+    if removed:
+      self._batch[1].setdefault(reason, []).extend(removed)
 
   def add_entry (self, entry):
     assert isinstance(entry, TableEntry)
 
-    #self._table.append(entry)
-    #self._table.sort(key=lambda e: e.effective_priority, reverse=True)
-
-    # Use binary search to insert at correct place
-    # This is faster even for modest table sizes, and way, way faster
-    # as the tables grow larger.
-    priority = entry.effective_priority
-    table = self._table
-    low = 0
-    high = len(table)
-    while low < high:
-        middle = (low + high) // 2
-        if priority >= table[middle].effective_priority:
-          high = middle
-          continue
-        low = middle + 1
-    table.insert(low, entry)
+    # Among entries of the same priority, the newest comes first.
+    self._index.add(entry)
+    self._schedule(entry)
 
     self._dirty()
 
-    self.raiseEvent(FlowTableModification(added=[entry]))
+    self._modified(added=[entry])
+
+  def add_entries (self, entries):
+    """
+    Adds several entries, with one FlowTableModification for all of them
+
+    They end up in the table as if added one after the other.
+    """
+    batching = self._batch is not None
+    self.start_batch()
+    for entry in entries:
+      self.add_entry(entry)
+    if not batching:
+      self.end_batch()
 
   def remove_entry (self, entry, reason=None):
     assert isinstance(entry, TableEntry)
-    self._table.remove(entry)
+    try:
+      self._index.remove(entry)
+    except KeyError:
+      raise ValueError("entry is not in the table")
+    self._expiry_seq.pop(entry, None)
     self._dirty()
-    self.raiseEvent(FlowTableModification(removed=[entry], reason=reason))
+    self._modified(removed=[entry], reason=reason)
 
   def matching_entries (self, match, priority=0, strict=False, out_port=None):
     entry_match = lambda e: e.is_matched_by(match, priority, strict, out_port)
-    return [ entry for entry in self._table if entry_match(entry) ]
+    if strict:
+      # Entries with an equal match are all in the same bucket.
+      candidates = self._index.wider(match)
+    else:
+      candidates = self._index.narrower(match)
+    return self._index.sorted(e for e in candidates if entry_match(e))
 
   def flow_stats (self, match, out_port=None, now=None):
     mc_es = self.matching_entries(match=match, strict=False, out_port=out_port)
@@ -279,28 +625,32 @@ class FlowTable (EventMixin):
     #self._table = [entry for entry in self._table if entry not in flows]
     if not flows: return
     self._dirty()
-    remove_flows = set(flows)
-    i = 0
-    while i < len(self._table):
-      entry = self._table[i]
-      if entry in remove_flows:
-        del self._table[i]
-        remove_flows.remove(entry)
-        if not remove_flows: break
-      else:
-        i += 1
-    assert len(remove_flows) == 0
-    self.raiseEvent(FlowTableModification(removed=flows, reason=reason))
+    for entry in set(flows):
+      self._index.remove(entry)
+      self._expiry_seq.pop(entry, None)
+    self._modified(removed=flows, reason=reason)
 
   def remove_expired_entries (self, now=None):
     idle = []
     hard = []
+    touched = []
     if now is None: now = time.time()
-    for entry in self._table:
+    expiry = self._expiry
+    while expiry and expiry[0][0] < now:
+      deadline, seq, entry = heappop(expiry)
+      if self._expiry_seq.get(entry) != seq:
+        continue # Removed, or queued again since
       if entry.is_idle_timed_out(now):
         idle.append(entry)
       elif entry.is_hard_timed_out(now):
         hard.append(entry)
+      else:
+        touched.append(entry)
+    for entry in touched:
+      self._schedule(entry)
+    # In table order, as they were when this went through the whole table
+    idle = self._index.sorted(idle)
+    hard = self._index.sorted(hard)
     self._remove_specific_entries(idle, OFPRR_IDLE_TIMEOUT)
     self._remove_specific_entries(hard, OFPRR_HARD_TIMEOUT)
 
@@ -318,13 +668,7 @@ class FlowTable (EventMixin):
     on the given in_port, or None if no matching entry is found.
     """
     packet_match = ofp_match.from_packet(packet, in_port, spec_frags = True)
-
-    for entry in self._table:
-      if entry.match.matches_with_wildcards(packet_match,
-                                            consider_other_wildcards=False):
-        return entry
-
-    return None
+    return self._index.lookup(packet_match)
 
   def check_for_overlapping_entry (self, in_entry):
     """
@@ -333,22 +677,17 @@ class FlowTable (EventMixin):
     Returns true if there is an overlap, false otherwise. Since the table is
     sorted, there is only a need to check a certain portion of it.
     """
-    #NOTE: Assumes that entries are sorted by decreasing effective_priority
     #NOTE: Ambiguous whether matching should be based on effective_priority
     #      or the regular priority.  Doing it based on effective_priority
     #      since that's what actually affects packet matching.
-    #NOTE: We could improve performance by doing a binary search to find the
-    #      right priority entries.
 
     priority = in_entry.effective_priority
 
-    for e in self._table:
-      if e.effective_priority < priority:
-        break
-      elif e.effective_priority > priority:
-        continue
-      else:
-        if e.is_matched_by(in_entry.match) or in_entry.is_matched_by(e.match):
-          return True
+    for e in self._index.narrower(in_entry.match):
+      if e.effective_priority == priority and e.is_matched_by(in_entry.match):
+        return True
+    for e in self._index.wider(in_entry.match):
+      if e.effective_priority == priority and in_entry.is_matched_by(e.match):
+        return True
 
     return False
@@ -20,6 +20,7 @@ from __future__ import print_function
 
 import struct
 import operator
+from collections import namedtuple
 from itertools import chain, repeat
 import sys
 from pox.lib.packet.packet_base import packet_base
@@ -90,6 +91,7 @@ _PAD2 = _PAD*2
 _PAD3 = _PAD*3
 _PAD4 = _PAD*4
 _PAD6 = _PAD*6
+_EMPTY_ETH_RAW = EMPTY_ETH.toRaw()
 
 class UnderrunError (RuntimeError):
   """
@@ -97,6 +99,24 @@ class UnderrunError (RuntimeError):
   """
   pass
 
+# Precompiled codecs for the fixed parts of the most common messages, so
+# that each is packed or unpacked with a single call.
+_header_struct = struct.Struct("!BBHL")
+_match_struct = struct.Struct("!LH6s6sHBxHBBxxLLHH")
+_flow_mod_struct = struct.Struct("!BBHL40sQHHHHLHH") # Header, match, body
+_packet_in_struct = struct.Struct("!BBHLLHHBx")
+_packet_out_struct = struct.Struct("!BBHLLHH")
+
+_structs = {}
+def _struct (fmt):
+  """
+  Returns a compiled struct.Struct for fmt
+  """
+  s = _structs.get(fmt)
+  if s is None:
+    s = _structs[fmt] = struct.Struct(fmt)
+  return s
+
 def _read (data, offset, length):
   if (len(data)-offset) < length:
     raise UnderrunError("wanted %s bytes but only have %s"
@@ -104,9 +124,9 @@ def _read (data, offset, length):
   return (offset+length, data[offset:offset+length])
 
 def _unpack (fmt, data, offset):
-  size = struct.calcsize(fmt)
-  if (len(data)-offset) < size: raise UnderrunError()
-  return (offset+size, struct.unpack_from(fmt, data, offset))
+  s = _structs.get(fmt) or _struct(fmt)
+  if (len(data)-offset) < s.size: raise UnderrunError()
+  return (offset+s.size, s.unpack_from(data, offset))
 
 def _skip (data, offset, num):
   offset += num
@@ -126,6 +146,12 @@ def _readzs (data, offset, length):
   assert True if (len(d) == 1) else (len(d[1].replace("\x00", "")) == 0)
   return (offset, d[0])
 
+def _ip_unsigned (addr):
+  if addr is None: return 0
+  if type(addr) is int: return addr & 0xffFFffFF
+  if type(addr) is long: return addr & 0xffFFffFF
+  return addr.toUnsigned()
+
 def _readether (data, offset):
   (offset, d) = _read(data, offset, 6)
   return (offset, EthAddr(d))
@@ -565,19 +591,18 @@ class ofp_header (ofp_base):
   def pack (self):
     assert self._assert()
 
-    packed = b""
-    packed += struct.pack("!BBHL", self.version, self.header_type,
+    return _header_struct.pack(self.version, self.header_type,
         len(self), self.xid)
-    return packed
 
   def unpack (self, raw, offset=0):
     offset,length = self._unpack_header(raw, offset)
     return offset,length
 
   def _unpack_header (self, raw, offset):
-    offset,(self.version, self.header_type, length, self.xid) = \
-        _unpack("!BBHL", raw, offset)
-    return offset,length
+    if (len(raw)-offset) < 8: raise UnderrunError()
+    (self.version, self.header_type, length, self._xid) = \
+        _header_struct.unpack_from(raw, offset)
+    return offset+8,length
 
   def __eq__ (self, other):
     if type(self) != type(other): return False
@@ -916,6 +941,83 @@ class ofp_queue_prop_min_rate (ofp_base):
     return outstr
 
 
+def _wire_wildcards (wildcards, dl_type, nw_proto):
+  """
+  Clears the wildcard bits of fields that can't be matched anyway
+
+  See ofp_match._wire_wildcards().
+  """
+  if dl_type == 0x0800:
+      # IP
+      if  nw_proto not in (1,6,17):
+        # not TCP/UDP/ICMP -> Clear TP wildcards for the wire
+        return wildcards & ~(OFPFW_TP_SRC | OFPFW_TP_DST)
+      else:
+        return wildcards
+  elif dl_type == 0x0806:
+      # ARP: clear NW_TOS / TP wildcards for the wire
+      return wildcards & ~( OFPFW_NW_TOS | OFPFW_TP_SRC | OFPFW_TP_DST)
+  else:
+      # not even IP. Clear NW/TP wildcards for the wire
+      return wildcards & ~( OFPFW_NW_TOS | OFPFW_NW_PROTO
+          | OFPFW_NW_SRC_MASK | OFPFW_NW_DST_MASK
+          | OFPFW_TP_SRC | OFPFW_TP_DST)
+
+def _masked_ip (addr, bits):
+  """
+  Returns addr as an unsigned int, with its low (wildcarded) bits zeroed
+  """
+  if bits >= 32: return 0
+  return _ip_unsigned(addr) & (0xffffffff << bits) & 0xffffffff
+
+def _match_fields (d, wc, wire_wc):
+  """
+  Returns match fields in the order and form they are packed in
+
+  d maps '_' + field name to values as ofp_match stores them, and wc are
+  the wildcards.  Wildcarded fields and bits, and fields that can't be
+  matched given dl_type and nw_proto, are 0.  The wildcards are packed as
+  wire_wc.
+  """
+  dl_type = 0 if wc & OFPFW_DL_TYPE else (d['_dl_type'] or 0)
+  nw_proto = 0 if wc & OFPFW_NW_PROTO else (d['_nw_proto'] or 0)
+  ip = dl_type == 0x0800
+  ip_or_arp = ip or dl_type == 0x0806
+  tp = ip and nw_proto in (1,6,17)
+
+  if wc & OFPFW_DL_SRC:
+    dl_src = _EMPTY_ETH_RAW
+  else:
+    dl_src = d['_dl_src']
+    if type(dl_src) is not bytes: dl_src = dl_src.toRaw()
+    elif len(dl_src) != 6: dl_src = EthAddr(dl_src).toRaw()
+  if wc & OFPFW_DL_DST:
+    dl_dst = _EMPTY_ETH_RAW
+  else:
+    dl_dst = d['_dl_dst']
+    if type(dl_dst) is not bytes: dl_dst = dl_dst.toRaw()
+    elif len(dl_dst) != 6: dl_dst = EthAddr(dl_dst).toRaw()
+
+  if not ip_or_arp:
+    nw_proto = nw_src = nw_dst = 0
+  else:
+    nw_src = _masked_ip(d['_nw_src'], (wc & OFPFW_NW_SRC_MASK)
+                        >> OFPFW_NW_SRC_SHIFT)
+    nw_dst = _masked_ip(d['_nw_dst'], (wc & OFPFW_NW_DST_MASK)
+                        >> OFPFW_NW_DST_SHIFT)
+
+  return (wire_wc,
+          0 if wc & OFPFW_IN_PORT else (d['_in_port'] or 0),
+          dl_src, dl_dst,
+          0 if wc & OFPFW_DL_VLAN else (d['_dl_vlan'] or 0),
+          0 if wc & OFPFW_DL_VLAN_PCP else (d['_dl_vlan_pcp'] or 0),
+          dl_type,
+          0 if not ip or wc & OFPFW_NW_TOS else (d['_nw_tos'] or 0),
+          nw_proto, nw_src, nw_dst,
+          0 if not tp or wc & OFPFW_TP_SRC else (d['_tp_src'] or 0),
+          0 if not tp or wc & OFPFW_TP_DST else (d['_tp_dst'] or 0))
+
+
 ##2.3 Flow Match Structures
 class ofp_match (ofp_base):
   adjust_wildcards = True # Set to true to "fix" outgoing wildcards
@@ -1161,52 +1263,21 @@ class ofp_match (ofp_base):
 
   def pack (self, flow_mod=False):
     assert self._assert()
+    return _match_struct.pack(*self._wire_fields(flow_mod))
 
-    packed = b""
+  def _wire_fields (self, flow_mod=False):
+    """
+    Returns the fields in the order and form they are packed in
+    """
+    d = self.__dict__
+    wc = d['wildcards']
     if self.adjust_wildcards and flow_mod:
-      wc = self._wire_wildcards(self.wildcards)
+      wire_wc = self._wire_wildcards(wc)
       assert self._prereq_warning()
     else:
-      wc = self.wildcards
-    packed += struct.pack("!LH", wc, self.in_port or 0)
-    if self.dl_src is None:
-      packed += EMPTY_ETH.toRaw()
-    elif type(self.dl_src) is bytes:
-      packed += self.dl_src
-    else:
-      packed += self.dl_src.toRaw()
-    if self.dl_dst is None:
-      packed += EMPTY_ETH.toRaw()
-    elif type(self.dl_dst) is bytes:
-      packed += self.dl_dst
-    else:
-      packed += self.dl_dst.toRaw()
-
-    def check_ip(val):
-      return (val or 0) if self.dl_type == 0x0800 else 0
-    def check_ip_or_arp(val):
-      return (val or 0) if self.dl_type == 0x0800 \
-                           or self.dl_type == 0x0806 else 0
-    def check_tp(val):
-      return (val or 0) if self.dl_type == 0x0800 \
-                           and self.nw_proto in (1,6,17) else 0
-
-    packed += struct.pack("!HB", self.dl_vlan or 0, self.dl_vlan_pcp or 0)
-    packed += _PAD # Hardcode padding
-    packed += struct.pack("!HBB", self.dl_type or 0,
-        check_ip(self.nw_tos), check_ip_or_arp(self.nw_proto))
-    packed += _PAD2 # Hardcode padding
-    def fix (addr):
-      if addr is None: return 0
-      if type(addr) is int: return addr & 0xffFFffFF
-      if type(addr) is long: return addr & 0xffFFffFF
-      return addr.toUnsigned()
-
-    packed += struct.pack("!LLHH", check_ip_or_arp(fix(self.nw_src)),
-        check_ip_or_arp(fix(self.nw_dst)),
-        check_tp(self.tp_src), check_tp(self.tp_dst))
+      wire_wc = wc
 
-    return packed
+    return _match_fields(d, wc, wire_wc)
 
   def _normalize_wildcards (self, wildcards):
     """
@@ -1239,22 +1310,7 @@ class ofp_match (ofp_base):
     OpenFlow 1.0.1 Section 3.4 actually has an improved version of the above,
     but we won't quote it here because it seems to have a restrictive license.
     """
-    #TODO: Set the masked fields to 0.
-    if self.dl_type == 0x0800:
-        # IP
-        if  self.nw_proto not in (1,6,17):
-          # not TCP/UDP/ICMP -> Clear TP wildcards for the wire
-          return wildcards & ~(OFPFW_TP_SRC | OFPFW_TP_DST)
-        else:
-          return wildcards
-    elif self.dl_type == 0x0806:
-        # ARP: clear NW_TOS / TP wildcards for the wire
-        return wildcards & ~( OFPFW_NW_TOS | OFPFW_TP_SRC | OFPFW_TP_DST)
-    else:
-        # not even IP. Clear NW/TP wildcards for the wire
-        return wildcards & ~( OFPFW_NW_TOS | OFPFW_NW_PROTO
-            | OFPFW_NW_SRC_MASK | OFPFW_NW_DST_MASK
-            | OFPFW_TP_SRC | OFPFW_TP_DST)
+    return _wire_wildcards(wildcards, self.dl_type, self.nw_proto)
 
   def fix (self):
     """
@@ -1324,26 +1380,31 @@ class ofp_match (ofp_base):
     return not self.is_wildcarded
 
   def unpack (self, raw, offset=0, flow_mod=False):
-    _offset = offset
-    offset,(wildcards, self._in_port) = _unpack("!LH",raw, offset)
-    offset,self._dl_src = _readether(raw, offset)
-    offset,self._dl_dst = _readether(raw, offset)
-    offset,(self._dl_vlan, self._dl_vlan_pcp) = \
-        _unpack("!HB", raw, offset)
-    offset = _skip(raw, offset, 1)
-    offset,(self._dl_type, self._nw_tos, self._nw_proto) = \
-        _unpack("!HBB", raw, offset)
-    offset = _skip(raw, offset, 2)
-    offset,self._nw_src = _readip(raw, offset)
-    offset,self._nw_dst = _readip(raw, offset)
-    offset,(self._tp_src, self._tp_dst) = _unpack("!HH", raw, offset)
+    if (len(raw)-offset) < 40: raise UnderrunError()
+    if self._locked:
+      raise AttributeError('match object is locked')
+    (wildcards, in_port, dl_src, dl_dst, dl_vlan, dl_vlan_pcp, dl_type,
+     nw_tos, nw_proto, nw_src, nw_dst, tp_src, tp_dst) = \
+        _match_struct.unpack_from(raw, offset)
+    d = self.__dict__
+    d['_in_port'] = in_port
+    d['_dl_src'] = EthAddr(dl_src)
+    d['_dl_dst'] = EthAddr(dl_dst)
+    d['_dl_vlan'] = dl_vlan
+    d['_dl_vlan_pcp'] = dl_vlan_pcp
+    d['_dl_type'] = dl_type
+    d['_nw_tos'] = nw_tos
+    d['_nw_proto'] = nw_proto
+    d['_nw_src'] = IPAddr(nw_src)
+    d['_nw_dst'] = IPAddr(nw_dst)
+    d['_tp_src'] = tp_src
+    d['_tp_dst'] = tp_dst
 
     # Only unwire wildcards for flow_mod
-    self.wildcards = self._normalize_wildcards(
+    d['wildcards'] = self._normalize_wildcards(
         self._unwire_wildcards(wildcards) if flow_mod else wildcards)
 
-    assert offset - _offset == len(self)
-    return offset
+    return offset + 40
 
   @staticmethod
   def __len__ ():
@@ -1502,6 +1563,84 @@ class ofp_match (ofp_base):
     return outstr
 
 
+_match_tuple_fields = ('wildcards', 'in_port', 'dl_src', 'dl_dst', 'dl_vlan',
+    'dl_vlan_pcp', 'dl_type', 'nw_tos', 'nw_proto', 'nw_src', 'nw_dst',
+    'tp_src', 'tp_dst')
+
+class ofp_match_tuple (namedtuple('ofp_match_tuple', _match_tuple_fields)):
+  """
+  A lightweight, immutable ofp_match in wire form
+
+  The fields are as they are packed: wildcards as sent, MACs as six-byte
+  strings, IPs as unsigned ints and 0 for wildcarded fields.  These skip
+  ofp_match's per-field wildcard bookkeeping, and are hashable, so one
+  can be built once and used for any number of flow_mods.  They can be
+  used as the match of an ofp_flow_mod.
+  """
+  __slots__ = ()
+
+  @classmethod
+  def make (cls, **kw):
+    """
+    Makes a match of the given fields, wildcarding the others
+
+    Takes the same fields as ofp_match(), except that nw_src and nw_dst
+    must be single addresses.  Wildcards are adjusted like those of a
+    flow_mod's ofp_match.
+    """
+    d = dict(_match_tuple_defaults)
+    wc = OFPFW_ALL & ~(OFPFW_NW_SRC_MASK | OFPFW_NW_DST_MASK)
+    wc |= OFPFW_NW_SRC_ALL | OFPFW_NW_DST_ALL
+    for k,v in kw.iteritems():
+      if k not in ofp_match_data:
+        raise TypeError(cls.__name__ + ".make() got unexpected keyword "
+                        + "argument '" + k + "'")
+      if v is None: continue
+      if k == 'nw_src':
+        wc &= ~OFPFW_NW_SRC_MASK
+        v = IPAddr(v)
+      elif k == 'nw_dst':
+        wc &= ~OFPFW_NW_DST_MASK
+        v = IPAddr(v)
+      else:
+        wc &= ~ofp_match_data[k][1]
+        if k == 'dl_src' or k == 'dl_dst':
+          v = EthAddr(v)
+      d['_' + k] = v
+    wire_wc = _wire_wildcards(wc,
+        None if wc & OFPFW_DL_TYPE else d['_dl_type'],
+        None if wc & OFPFW_NW_PROTO else d['_nw_proto'])
+    return cls(*_match_fields(d, wc, wire_wc))
+
+  @classmethod
+  def from_match (cls, match, flow_mod=False):
+    """
+    Returns the wire form of an ofp_match
+    """
+    return cls(*match._wire_fields(flow_mod))
+
+  @classmethod
+  def unpack_new (cls, raw, offset=0):
+    """
+    Unpacks a packed match
+
+    Returns (next offset, new ofp_match_tuple).
+    """
+    if (len(raw)-offset) < 40: raise UnderrunError()
+    return offset + 40, cls(*_match_struct.unpack_from(raw, offset))
+
+  def to_match (self, flow_mod=False):
+    """
+    Returns an equivalent ofp_match
+    """
+    m = ofp_match()
+    m.unpack(self.pack(), flow_mod=flow_mod)
+    return m
+
+  def pack (self, flow_mod=False):
+    return _match_struct.pack(*self)
+
+
 class ofp_action_generic (ofp_action_base):
   _MIN_LENGTH = 8
   def __init__ (self, **kw):
@@ -2280,8 +2419,8 @@ class ofp_flow_mod (ofp_header):
     self._buffer_id = val
 
   def _validate (self):
-    if not isinstance(self.match, ofp_match):
-      return "match is not class ofp_match"
+    if not isinstance(self.match, (ofp_match, ofp_match_tuple)):
+      return "match is not class ofp_match or ofp_match_tuple"
     return None
 
   def pack (self):
@@ -2311,15 +2450,14 @@ class ofp_flow_mod (ofp_header):
       buffer_id = NO_BUFFER
 
     assert self._assert()
-    packed = b""
-    packed += ofp_header.pack(self)
-    packed += self.match.pack(flow_mod=True)
-    packed += struct.pack("!QHHHHLHH", self.cookie, self.command,
-                          self.idle_timeout, self.hard_timeout,
-                          self.priority, buffer_id, self.out_port,
-                          self.flags)
-    for i in self.actions:
-      packed += i.pack()
+    actions = b''.join([i.pack() for i in self.actions])
+    packed = _flow_mod_struct.pack(self.version, self.header_type,
+                                   72 + len(actions), self.xid,
+                                   self.match.pack(flow_mod=True),
+                                   self.cookie, self.command,
+                                   self.idle_timeout, self.hard_timeout,
+                                   self.priority, buffer_id, self.out_port,
+                                   self.flags) + actions
 
     if po:
       packed += ofp_barrier_request().pack()
@@ -2327,19 +2465,18 @@ class ofp_flow_mod (ofp_header):
     return packed
 
   def unpack (self, raw, offset=0):
-    offset,length = self._unpack_header(raw, offset)
-    offset = self.match.unpack(raw, offset, flow_mod=True)
-    offset,(self.cookie, self.command, self.idle_timeout,
-            self.hard_timeout, self.priority, self._buffer_id,
-            self.out_port, self.flags) = \
-            _unpack("!QHHHHLHH", raw, offset)
-    offset,self.actions = _unpack_actions(raw,
-        length-(32 + len(self.match)), offset)
+    if (len(raw)-offset) < 72: raise UnderrunError()
+    (self.version, self.header_type, length, self._xid, match,
+     self.cookie, self.command, self.idle_timeout, self.hard_timeout,
+     self.priority, self._buffer_id, self.out_port, self.flags) = \
+        _flow_mod_struct.unpack_from(raw, offset)
+    self.match.unpack(match, flow_mod=True)
+    offset,self.actions = _unpack_actions(raw, length-72, offset+72)
     assert length == len(self)
     return offset,length
 
   def __len__ (self):
-    l = 32 + len(self.match)
+    l = 72 # Header, match and the rest of the fixed part
     for i in self.actions:
       l += len(i)
     return l
@@ -3587,24 +3724,20 @@ class ofp_packet_out (ofp_header):
   def pack (self):
     assert self._assert()
 
-    actions = b''.join((i.pack() for i in self.actions))
+    actions = b''.join([i.pack() for i in self.actions])
     actions_len = len(actions)
+    data = self._data
 
-    if self.data is not None:
-      return b''.join((ofp_header.pack(self),
-        struct.pack("!LHH", self._buffer_id, self.in_port, actions_len),
-        actions, self.data))
-    else:
-      return b''.join((ofp_header.pack(self),
-      struct.pack("!LHH", self._buffer_id, self.in_port, actions_len),
-      actions))
+    return b''.join((_packet_out_struct.pack(self.version, self.header_type,
+        16 + actions_len + len(data), self.xid, self._buffer_id,
+        self.in_port, actions_len), actions, data))
 
   def unpack (self, raw, offset=0):
     _offset = offset
-    offset,length = self._unpack_header(raw, offset)
-    offset,(self._buffer_id, self.in_port, actions_len) = \
-        _unpack("!LHH", raw, offset)
-    offset,self.actions = _unpack_actions(raw, actions_len, offset)
+    if (len(raw)-offset) < 16: raise UnderrunError()
+    (self.version, self.header_type, length, self._xid, self._buffer_id,
+     self.in_port, actions_len) = _packet_out_struct.unpack_from(raw, offset)
+    offset,self.actions = _unpack_actions(raw, actions_len, offset+16)
 
     remaining = length - (offset - _offset)
     if remaining <= 0:
@@ -3772,13 +3905,11 @@ class ofp_packet_in (ofp_header):
   def pack (self):
     assert self._assert()
 
-    packed = b""
-    packed += ofp_header.pack(self)
-    packed += struct.pack("!LHHBB", self._buffer_id, self.total_len,
-                          self.in_port, self.reason, 0)
-    packed += self.data
+    data = self._data
     #TODO: Padding?  See __len__
-    return packed
+    return _packet_in_struct.pack(self.version, self.header_type,
+        18 + len(data), self.xid, self._buffer_id, self.total_len,
+        self.in_port, self.reason) + data
 
   @property
   def is_complete (self):
@@ -3786,10 +3917,11 @@ class ofp_packet_in (ofp_header):
     return len(self.data) == self.total_len
 
   def unpack (self, raw, offset=0):
-    offset,length = self._unpack_header(raw, offset)
-    offset,(self._buffer_id, self._total_len, self.in_port, self.reason,
-            pad) = _unpack("!LHHBB", raw, offset)
-    offset,self.data = _read(raw, offset, length-18)
+    if (len(raw)-offset) < 18: raise UnderrunError()
+    (self.version, self.header_type, length, self._xid, self._buffer_id,
+     self._total_len, self.in_port, self.reason) = \
+        _packet_in_struct.unpack_from(raw, offset)
+    offset,self._data = _read(raw, offset+18, length-18)
     assert length == len(self)
     return offset,length
 
@@ -4452,3 +4584,5 @@ ofp_match_data = {
   'tp_src' : (0, OFPFW_TP_SRC),
   'tp_dst' : (0, OFPFW_TP_DST),
 }
+_match_tuple_defaults = dict(('_' + k, v[0]) for k,v
+                             in ofp_match_data.iteritems())
@@ -879,6 +879,103 @@ class nx_action_resubmit (of.ofp_action_vendor_base):
     return s
 
 
+# Fields hashed by nx_action_multipath
+NX_HASH_FIELDS_ETH_SRC = 0      # Ethernet source only
+NX_HASH_FIELDS_SYMMETRIC_L4 = 1 # Addresses, protocol and L4 ports, such
+                                # that both directions of a flow match
+
+# How nx_action_multipath maps the hash to a link
+NX_MP_ALG_MODULO_N = 0       # hash % n_links
+NX_MP_ALG_HASH_THRESHOLD = 1 # Splits the hash space into n_links ranges
+NX_MP_ALG_HRW = 2            # Highest random weight
+NX_MP_ALG_ITER_HASH = 3      # Rehashes until below n_links
+
+class nx_action_multipath (of.ofp_action_vendor_base):
+  """
+  Hashes some of a packet's fields and stores a link number in a register
+
+  The link number is in [0, max_link], and is picked from the hash by
+  algorithm (one of NX_MP_ALG_*), with the help of arg for the ones that
+  take one.  fields is one of NX_HASH_FIELDS_*, and basis a seed for the
+  hash.
+  """
+  def _init (self, kw):
+    self.vendor = NX_VENDOR_ID
+    self.subtype = NXAST_MULTIPATH
+    self.fields = NX_HASH_FIELDS_SYMMETRIC_L4
+    self.basis = 0
+    self.algorithm = NX_MP_ALG_MODULO_N
+    self.max_link = 0
+    self.arg = 0
+    self.offset = 0
+    self.nbits = None
+    self.dst = None # an nxm_entry class
+
+  def _eq (self, other):
+    if self.subtype != other.subtype: return False
+    if self.fields != other.fields: return False
+    if self.basis != other.basis: return False
+    if self.algorithm != other.algorithm: return False
+    if self.max_link != other.max_link: return False
+    if self.arg != other.arg: return False
+    if self.offset != other.offset: return False
+    if self.nbits != other.nbits: return False
+    if self.dst != other.dst: return False
+    return True
+
+  def _pack_body (self):
+    if self.nbits is None:
+      self.nbits = self.dst._get_size_hint() - self.offset
+    nbits = self.nbits - 1
+    assert nbits >= 0 and nbits <= 63
+    assert self.offset >= 0 and self.offset < (1 << 10)
+    assert self.max_link < (1 << self.nbits)
+    ofs_nbits = self.offset << 6 | nbits
+
+    o = self.dst()
+    o._force_mask = False
+    dst = o.pack(omittable=False, header_only=True)
+
+    p = struct.pack('!HHH', self.subtype, self.fields, self.basis)
+    p += _PAD2
+    p += struct.pack('!HHL', self.algorithm, self.max_link, self.arg)
+    p += _PAD2
+    p += struct.pack('!H4s', ofs_nbits, dst)
+    return p
+
+  def _unpack_body (self, raw, offset, avail):
+    offset,(self.subtype, self.fields, self.basis) = \
+        of._unpack('!HHH', raw, offset)
+    offset = of._skip(raw, offset, 2)
+    offset,(self.algorithm, self.max_link, self.arg) = \
+        of._unpack('!HHL', raw, offset)
+    offset = of._skip(raw, offset, 2)
+    offset,(ofs_nbits, dst) = of._unpack('!H4s', raw, offset)
+
+    self.offset = ofs_nbits >> 6
+    self.nbits = (ofs_nbits & 0x3f) + 1
+
+    self.dst = _class_for_nxm_header(dst)
+
+    return offset
+
+  def _body_length (self):
+    return 24
+
+  def _show (self, prefix):
+    s = ''
+    s += prefix + ('subtype: %s\n' % (self.subtype,))
+    s += prefix + ('fields: %s\n' % (self.fields,))
+    s += prefix + ('basis: %s\n' % (self.basis,))
+    s += prefix + ('algorithm: %s\n' % (self.algorithm,))
+    s += prefix + ('max_link: %s\n' % (self.max_link,))
+    s += prefix + ('arg: %s\n' % (self.arg,))
+    s += prefix + ('offset: %s\n' % (self.offset,))
+    s += prefix + ('nbits: %s\n' % (self.nbits,))
+    s += prefix + ('dst: %s\n' % (self.dst,))
+    return s
+
+
 class nx_action_set_tunnel (of.ofp_action_vendor_base):
   """
   Set a 32-bit tunnel ID
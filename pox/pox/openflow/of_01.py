@@ -26,6 +26,7 @@ from pox.lib.revent.revent import EventMixin
 import datetime
 import time
 from pox.lib.socketcapture import CaptureSocket
+from pox.lib.epoll_select import EdgeEpoll
 import pox.openflow.debug
 from pox.openflow.util import make_type_to_unpacker_table
 from pox.openflow import *
@@ -40,25 +41,18 @@ import select
 # type into a message object.
 unpackers = make_type_to_unpacker_table()
 
-try:
-  PIPE_BUF = select.PIPE_BUF
-except:
-  try:
-    # Try to get it from where PyPy (sometimes) has it
-    import IN
-    PIPE_BUF = IN.PIPE_BUF
-  except:
-    # (Hopefully) reasonable default
-    PIPE_BUF = 512
-
 import pox.openflow.libopenflow_01 as of
 
 import threading
+import thread
 import os
 import sys
 import exceptions
 from errno import EAGAIN, ECONNRESET, EADDRINUSE, EADDRNOTAVAIL
 
+# Python 2 doesn't have it (this is its value on Linux)
+SO_REUSEPORT = getattr(socket, 'SO_REUSEPORT', 15)
+
 
 import traceback
 
@@ -270,113 +264,6 @@ statsHandlerMap = {
   of.OFPST_QUEUE : handle_OFPST_QUEUE,
 }
 
-# Deferred sending should be unusual, so don't worry too much about
-# efficiency
-class DeferredSender (threading.Thread):
-  """
-  Class that handles sending when a socket write didn't complete
-  """
-  def __init__ (self):
-    threading.Thread.__init__(self)
-    core.addListeners(self)
-    self._dataForConnection = {}
-    self._lock = threading.RLock()
-    self._waker = pox.lib.util.makePinger()
-    self.sending = False
-
-    self.start()
-
-  def _handle_GoingDownEvent (self, event):
-    self._waker.ping()
-
-  def _sliceup (self, data):
-    """
-    Takes an array of data bytes, and slices into elements of
-    PIPE_BUF bytes each
-    """
-    out = []
-    while len(data) > PIPE_BUF:
-      out.append(data[0:PIPE_BUF])
-      data = data[PIPE_BUF:]
-    if len(data) > 0:
-      out.append(data)
-    return out
-
-  def send (self, con, data):
-    with self._lock:
-      self.sending = True
-
-      data = self._sliceup(data)
-
-      if con not in self._dataForConnection:
-        self._dataForConnection[con] = data
-      else:
-        self._dataForConnection[con].extend(data)
-
-      self._waker.ping()
-
-  def kill (self, con):
-    with self._lock:
-      try:
-        del self._dataForConnection[con]
-      except:
-        pass
-
-      self._waker.ping()
-
-  def run (self):
-    while core.running:
-
-      with self._lock:
-        cons = self._dataForConnection.keys()
-
-      rlist, wlist, elist = select.select([self._waker], cons, cons, 5)
-      if not core.running: break
-
-      with self._lock:
-        if len(rlist) > 0:
-          self._waker.pongAll()
-
-        for con in elist:
-          try:
-            del self._dataForConnection[con]
-          except:
-            pass
-
-        for con in wlist:
-          try:
-            alldata = self._dataForConnection[con]
-            while len(alldata):
-              data = alldata[0]
-              try:
-                l = con.sock.send(data)
-                if l != len(data):
-                  alldata[0] = data[l:]
-                  break
-                del alldata[0]
-              except socket.error as (errno, strerror):
-                if errno != EAGAIN:
-                  con.msg("DeferredSender/Socket error: " + strerror)
-                  con.disconnect()
-                  del self._dataForConnection[con]
-                break
-              except:
-                con.msg("Unknown error doing deferred sending")
-                break
-            if len(alldata) == 0:
-              try:
-                del self._dataForConnection[con]
-                if len(self._dataForConnection) == 0:
-                  self.sending = False
-                  break
-              except:
-                pass
-          except:
-            try:
-              del self._dataForConnection[con]
-            except:
-              pass
-
 class DummyOFNexus (object):
   def raiseEventNoErrors (self, event, *args, **kw):
     log.warning("%s raised on dummy OpenFlow nexus" % event)
@@ -589,6 +476,13 @@ class Connection (EventMixin):
   # Globally unique identifier for the Connection instance
   ID = 0
 
+  # Most bytes read from the socket per read() (see launch())
+  read_size = 16384
+
+  # Buffered bytes at which send() flushes without waiting for the end of
+  # the OpenFlow loop's cycle (see launch())
+  flush_size = 65536
+
   def msg (self, m):
     #print str(self), m
     log.debug(str(self) + " " + str(m))
@@ -605,7 +499,14 @@ class Connection (EventMixin):
 
     self.ofnexus = _dummyOFNexus
     self.sock = sock
-    self.buf = ''
+    # Received data lives in _rbuf[:_rlen]; see read().  The buffer is
+    # allocated by the first read, so idle connections don't hold one.
+    self._rbuf = bytearray()
+    self._rlen = 0
+    # Data waiting to be sent; see send() and flush()
+    self._wbuf = []
+    self._wlen = 0
+    self._wlock = threading.Lock()
     Connection.ID += 1
     self.ID = Connection.ID
     # TODO: dpid and features don't belong here; they should be eventually
@@ -661,11 +562,8 @@ class Connection (EventMixin):
         self.ofnexus.raiseEventNoErrors(ConnectionDown, self)
         self.raiseEventNoErrors(ConnectionDown, self)
 
-    try:
-      #deferredSender.kill(self)
-      pass
-    except:
-      pass
+    _unflushed.discard(self)
+    _blocked.discard(self)
     try:
       self.sock.shutdown(socket.SHUT_RDWR)
     except:
@@ -682,6 +580,11 @@ class Connection (EventMixin):
 
     Data should probably either be raw bytes in OpenFlow wire format, or
     an OpenFlow controller-to-switch message object from libopenflow.
+
+    Messages sent while the OpenFlow loop is handling received messages
+    are buffered, and all of them go out in one socket send per connection
+    when it is done (or once flush_size bytes are buffered).  Elsewhere,
+    send() flushes straight away.
     """
     if self.disconnected: return
     if type(data) is not bytes:
@@ -691,64 +594,129 @@ class Connection (EventMixin):
       assert isinstance(data, of.ofp_header)
       data = data.pack()
 
-    if deferredSender.sending:
-      log.debug("deferred sender is sending!")
-      deferredSender.send(self, data)
-      return
-    try:
-      l = self.sock.send(data)
-      if l != len(data):
-        self.msg("Didn't send complete buffer.")
-        data = data[l:]
-        deferredSender.send(self, data)
-    except socket.error as (errno, strerror):
-      if errno == EAGAIN:
+    with self._wlock:
+      self._wbuf.append(data)
+      self._wlen += len(data)
+      if self in _blocked:
+        # The OpenFlow loop sends it when the socket is writable again.
+        return
+      if _batching == thread.get_ident() and self._wlen < self.flush_size:
+        _unflushed.add(self)
+        return
+    self.flush()
+
+  def flush (self):
+    """
+    Send what send() has buffered.
+
+    If the socket can't take all of it, the rest stays buffered and the
+    OpenFlow loop sends it once the socket is writable.
+    """
+    with self._wlock:
+      if self.disconnected:
+        self._wbuf = []
+        self._wlen = 0
+      if not self._wbuf: return
+      if len(self._wbuf) == 1:
+        data = self._wbuf[0]
+      else:
+        data = b''.join(self._wbuf)
+      self._wbuf = []
+      self._wlen = 0
+      try:
+        l = self.sock.send(data)
+      except socket.error as (errno, strerror):
+        if errno != EAGAIN:
+          error = strerror
+          l = None
+        else:
+          l = 0
+      if l is not None and l < len(data):
+        self._wbuf.append(data[l:])
+        self._wlen = len(data) - l
+
+    if l is None:
+      self.msg("Socket error: " + error)
+      self.disconnect(defer_event=True)
+    elif self._wlen:
+      if self not in _blocked:
         self.msg("Out of send buffer space.  " +
                  "Consider increasing SO_SNDBUF.")
-        deferredSender.send(self, data)
-      else:
-        self.msg("Socket error: " + strerror)
-        self.disconnect(defer_event=True)
+        _blocked.add(self)
+        if _waker is not None: _waker.ping()
+    else:
+      _blocked.discard(self)
 
   def read (self):
     """
     Read data from this connection.  Generally this is just called by the
     main OpenFlow loop below.
 
+    Data is received straight into a bytearray that is reused across
+    calls.  Only complete messages are ever copied out of it, once per
+    call, and the unpackers parse them at their offsets in that copy.
+
     Note: This function will block if data is not available.
     """
+    rbuf = self._rbuf
+    rlen = self._rlen
+    if len(rbuf) < rlen + self.read_size:
+      rbuf.extend(bytearray(rlen + self.read_size - len(rbuf)))
     try:
-      d = self.sock.recv(2048)
+      n = self.sock.recv_into(memoryview(rbuf)[rlen:], self.read_size)
+    except socket.error as (errno, strerror):
+      if errno != EAGAIN:
+        return False
+      n = None
     except:
       return False
-    if len(d) == 0:
+    if n == 0:
       return False
-    self.buf += d
-    buf_len = len(self.buf)
-
+    # A short read means the socket had nothing more to read
+    self._rdrained = n is None or n < self.read_size
+    if n is None:
+      return True
+    rlen += n
+
+    # Find where the last complete message ends by walking the headers.
+    end = 0
+    while rlen - end >= 8: # 8 bytes is minimum OF message size
+      msg_length = rbuf[end+2] << 8 | rbuf[end+3]
+      if msg_length < 8:
+        log.warning("Bad OpenFlow message length (%i) on connection %s"
+                    % (msg_length, self))
+        return False # Throw connection away
+      if rlen - end < msg_length: break
+      end += msg_length
+
+    self._rlen = rlen
+    if end == 0:
+      return True
+    buf = memoryview(rbuf)[:end].tobytes()
+    # Keep the start of the next message for the next read.
+    rbuf[:rlen-end] = rbuf[end:rlen]
+    self._rlen = rlen - end
 
     offset = 0
-    while buf_len - offset >= 8: # 8 bytes is minimum OF message size
+    while offset < end:
       # We pull the first four bytes of the OpenFlow header off by hand
       # (using ord) to find the version/length/type so that we can
       # correctly call libopenflow to unpack it.
 
-      ofp_type = ord(self.buf[offset+1])
+      ofp_type = ord(buf[offset+1])
 
-      if ord(self.buf[offset]) != of.OFP_VERSION:
+      if ord(buf[offset]) != of.OFP_VERSION:
         if ofp_type == of.OFPT_HELLO:
           # We let this through and hope the other side switches down.
           pass
         else:
           log.warning("Bad OpenFlow version (0x%02x) on connection %s"
-                      % (ord(self.buf[offset]), self))
+                      % (ord(buf[offset]), self))
           return False # Throw connection away
 
-      msg_length = ord(self.buf[offset+2]) << 8 | ord(self.buf[offset+3])
-
-      if buf_len - offset < msg_length: break
+      msg_length = ord(buf[offset+2]) << 8 | ord(buf[offset+3])
 
-      new_offset,msg = unpackers[ofp_type](self.buf, offset)
+      new_offset,msg = unpackers[ofp_type](buf, offset)
       assert new_offset - offset == msg_length
       offset = new_offset
 
@@ -761,9 +729,6 @@ class Connection (EventMixin):
                       ("\n" + str(self) + " ").join(str(msg).split('\n')))
         continue
 
-    if offset != 0:
-      self.buf = self.buf[offset:]
-
     return True
 
   def _incoming_stats_reply (self, ofp):
@@ -831,11 +796,23 @@ class OpenFlow_01_Task (Task):
   """
   The main recoco thread for listening to openflow messages
   """
-  def __init__ (self, port = 6633, address = '0.0.0.0'):
+  def __init__ (self, port = 6633, address = '0.0.0.0', use_epoll = None,
+                reuse_port = False):
+    """
+    use_epoll picks the edge-triggered epoll loop over the select() one.
+    By default, it is used where epoll is available (i.e., on Linux).
+
+    reuse_port lets other processes listen on the same port (see
+    openflow.shards).
+    """
     Task.__init__(self)
     self.port = int(port)
     self.address = address
+    self.reuse_port = reuse_port
     self.started = False
+    if use_epoll is None:
+      use_epoll = hasattr(select, 'epoll')
+    self.use_epoll = use_epoll
 
     core.addListener(pox.core.GoingUpEvent, self._handle_GoingUpEvent)
 
@@ -849,11 +826,15 @@ class OpenFlow_01_Task (Task):
     return super(OpenFlow_01_Task,self).start()
 
   def run (self):
+    global _waker, _batching
+
     # List of open sockets/connections to select on
     sockets = []
 
     listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if self.reuse_port:
+      listener.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
     try:
       listener.bind((self.address, self.port))
     except socket.error as (errno, strerror):
@@ -867,9 +848,21 @@ class OpenFlow_01_Task (Task):
                   "another port.")
       return
 
-    listener.listen(16)
+    listener.listen(socket.SOMAXCONN)
     sockets.append(listener)
 
+    _waker = pox.lib.util.make_pinger()
+    sockets.append(_waker)
+
+    # With epoll, sockets are registered with the poller once, and only
+    # the poller itself is selected on.
+    poller = None
+    if self.use_epoll:
+      poller = EdgeEpoll()
+      listener.setblocking(0)
+      poller.register(listener, write=False)
+      poller.register(_waker, write=False)
+
     log.debug("Listening on %s:%s" %
               (self.address, self.port))
 
@@ -878,12 +871,20 @@ class OpenFlow_01_Task (Task):
       try:
         while True:
           con = None
-          rlist, wlist, elist = yield Select(sockets, [], sockets, 5)
+          if poller is None:
+            rlist, wlist, elist = yield Select(sockets, list(_blocked),
+                                               sockets, 5)
+          else:
+            yield Select([poller], [], [], 0 if poller.pending else 5)
+            rlist, wlist, elist = poller.poll()
+            # Reading finds out what went wrong, and reads what came first.
+            rlist.extend(con for con in elist if con not in rlist)
+            elist = []
           if len(rlist) == 0 and len(wlist) == 0 and len(elist) == 0:
             if not core.running: break
 
           for con in elist:
-            if con is listener:
+            if con is listener or con is _waker:
               raise RuntimeError("Error on listener socket")
             else:
               try:
@@ -895,46 +896,54 @@ class OpenFlow_01_Task (Task):
               except:
                 pass
 
-          timestamp = time.time()
+          for con in wlist:
+            if con in _blocked:
+              try:
+                con.flush()
+              except:
+                _log_connection_error(con)
+                _drop_connection(con, poller, sockets)
+
+          # Messages sent while handling what we read are buffered, and
+          # flushed once everything has been read.
+          _batching = thread.get_ident()
+          cons = []
           for con in rlist:
-            if con is listener:
-              new_sock = listener.accept()[0]
-              if pox.openflow.debug.pcap_traces:
-                new_sock = wrap_socket(new_sock)
-              new_sock.setblocking(0)
-              # Note that instantiating a Connection object fires a
-              # ConnectionUp event (after negotation has completed)
-              newcon = Connection(new_sock)
-              sockets.append( newcon )
-              #print str(newcon) + " connected"
+            if con is _waker:
+              _waker.pongAll()
+            elif con is listener:
+              while True:
+                try:
+                  new_sock = listener.accept()[0]
+                except socket.error as (errno, strerror):
+                  # The epoll loop accepts everything that is waiting.
+                  if errno == EAGAIN and poller is not None: break
+                  raise
+                if pox.openflow.debug.pcap_traces:
+                  new_sock = wrap_socket(new_sock)
+                new_sock.setblocking(0)
+                # Note that instantiating a Connection object fires a
+                # ConnectionUp event (after negotation has completed)
+                newcon = Connection(new_sock)
+                sockets.append( newcon )
+                #print str(newcon) + " connected"
+                if poller is None: break
+                poller.register(newcon)
             else:
-              con.idle_time = timestamp
-              if con.read() is False:
-                con.close()
-                sockets.remove(con)
+              cons.append(con)
+          con = None
+          _read_connections(cons, poller, sockets)
+          _flush_all()
       except exceptions.KeyboardInterrupt:
         break
       except:
-        doTraceback = True
-        if sys.exc_info()[0] is socket.error:
-          if sys.exc_info()[1][0] == ECONNRESET:
-            con.info("Connection reset")
-            doTraceback = False
-
-        if doTraceback:
-          log.exception("Exception reading connection " + str(con))
+        _flush_all()
+        _log_connection_error(con)
 
         if con is listener:
           log.error("Exception on OpenFlow listener.  Aborting.")
           break
-        try:
-          con.close()
-        except:
-          pass
-        try:
-          sockets.remove(con)
-        except:
-          pass
+        _drop_connection(con, poller, sockets)
 
     log.debug("No longer listening for connections")
 
@@ -949,19 +958,97 @@ def _set_handlers ():
 _set_handlers()
 
 
-# Used by the Connection class
-deferredSender = None
+# Used by the Connection class, see Connection.send()
+_batching = None   # Thread ident of the OpenFlow loop while it reads
+_unflushed = set() # Connections with messages buffered this cycle
+_blocked = set()   # Connections waiting for their socket to be writable
+_waker = None      # Wakes the OpenFlow loop when a socket blocks
 
-def launch (port = 6633, address = "0.0.0.0"):
+def _read_connections (cons, poller, sockets):
+  """
+  Reads from each of the connections in cons, which were ready to read.
+
+  A connection whose read fails is dropped without stopping the others:
+  with an edge-triggered poller, a connection skipped here would not be
+  reported again until more data arrived for it.
+  """
+  timestamp = time.time()
+  for con in cons:
+    con.idle_time = timestamp
+    try:
+      ok = con.read()
+    except:
+      _log_connection_error(con)
+      ok = False
+    if ok is False:
+      _drop_connection(con, poller, sockets)
+    elif poller is not None and not con._rdrained:
+      # Let the other connections read before reading the rest.
+      poller.again(con)
+
+def _log_connection_error (con):
+  """
+  Logs the exception being handled, which con raised.
+  """
+  exc_type, exc = sys.exc_info()[:2]
+  if exc_type is socket.error and exc[0] == ECONNRESET:
+    con.info("Connection reset")
+  else:
+    log.exception("Exception reading connection " + str(con))
+
+def _drop_connection (con, poller, sockets):
+  """
+  Closes con and stops watching it.
+  """
+  if poller is not None:
+    poller.unregister(con)
+  try:
+    con.close()
+  except:
+    pass
+  try:
+    sockets.remove(con)
+  except:
+    pass
+
+def _flush_all ():
+  """
+  Ends the OpenFlow loop's cycle: sends everything buffered during it.
+  """
+  global _batching
+  _batching = None
+  while _unflushed:
+    _unflushed.pop().flush()
+
+def launch (port = 6633, address = "0.0.0.0", read_size = None,
+            flush_size = None, no_epoll = False, workers = 1):
+  """
+  read_size is the most bytes read from a switch connection at a time, and
+  flush_size the most buffered for one before it is sent.
+
+  --no_epoll uses the select() loop even where epoll is available.
+
+  --workers=N spreads switch connections over N processes; see
+  openflow.shards.
+  """
   if core.hasComponent('of_01'):
     return None
 
-  global deferredSender
-  deferredSender = DeferredSender()
+  workers = int(workers)
+  if workers > 1:
+    import pox.openflow.shards
+    pox.openflow.shards.launch(int(port), workers)
+
+  if read_size is not None:
+    Connection.read_size = int(read_size)
+  if flush_size is not None:
+    Connection.flush_size = int(flush_size)
 
   if of._logger is None:
     of._logger = core.getLogger('libopenflow_01')
 
-  l = OpenFlow_01_Task(port = int(port), address = address)
+  l = OpenFlow_01_Task(port = int(port), address = address,
+                       use_epoll = False if no_epoll else None,
+                       reuse_port = workers > 1)
   core.register("of_01", l)
   return l
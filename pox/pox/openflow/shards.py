@@ -0,0 +1,279 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Spreads switch connections over several POX processes ("shards").
+
+With openflow.of_01 --workers=N, the POX process started from the command
+line is shard 0, and once it is up it starts shards 1..N-1 by running the
+same command line again.  Every shard launches all the same components,
+and listens on the OpenFlow port with SO_REUSEPORT, so the kernel spreads
+incoming switch connections over them.  Each shard then reads, parses and
+handles the messages of its own switches on its own core.
+
+Topology-wide state is kept by every shard for itself.  Since every shard
+runs the same launch code, it starts out the same everywhere.  Shard 0
+only starts the others once its components have launched, so state it
+computes and saves there, like the jellyfish controller's route cache,
+can be loaded by the other shards instead of computed again.  To keep it
+the same, shards tell each other about switches coming and going and
+about port status changes, over unix datagram sockets.  These are raised
+on core.openflow_shards as RemoteConnectionUp, RemoteConnectionDown and
+RemotePortStatus, whose .connection is a RemoteConnection for a switch
+of another shard.  Sending to a RemoteConnection (or
+core.openflow.sendToDPID() for a switch of another shard) forwards the
+message to that shard.
+
+Components opt in by listening to core.openflow_shards.  They should only
+send to their own switches in response to remote events, as the shard
+that owns a switch gets the local event too.
+"""
+
+from pox.core import core
+from pox.lib.revent import EventMixin
+from pox.lib.util import dpidToStr
+from pox.lib.recoco import Task, Select, Timer
+from pox.openflow import ConnectionUp, ConnectionDown, PortStatus
+import pox.openflow.libopenflow_01 as of
+import pox.openflow.of_01 as of_01
+
+from collections import deque
+from errno import EAGAIN
+import os
+import socket
+import struct
+import subprocess
+import sys
+
+log = core.getLogger()
+
+# Environment variable that tells a shard which one it is
+SHARD_ENV = "POX_OF_01_SHARD"
+
+# Shard messages: kind, sending shard, dpid, then a packed OpenFlow message
+_header = struct.Struct("!cBQ")
+HELLO = 'H'     # A shard started; tell it about your switches
+UP = 'U'        # A switch connected (features reply)
+DOWN = 'D'      # A switch disconnected
+PORT = 'P'      # Port status
+MESSAGE = 'M'   # Send this to your switch
+
+# Biggest shard message: header plus the biggest OpenFlow message
+_MAX_MESSAGE = _header.size + 0xffff
+
+
+class RemoteConnection (object):
+  """
+  Stands in for the Connection to a switch of another shard.
+  """
+  def __init__ (self, shards, dpid, shard):
+    self.shards = shards
+    self.dpid = dpid
+    self.shard = shard
+    self.features = None
+
+  def send (self, data):
+    if type(data) is not bytes:
+      assert isinstance(data, of.ofp_header)
+      data = data.pack()
+    self.shards._send(self.shard, MESSAGE, self.dpid, data)
+
+  def __str__ (self):
+    return "[%s shard %i]" % (dpidToStr(self.dpid), self.shard)
+
+
+class RemoteConnectionUp (ConnectionUp):
+  """ A switch connected to another shard """
+  pass
+
+class RemoteConnectionDown (ConnectionDown):
+  """ A switch disconnected from another shard """
+  pass
+
+class RemotePortStatus (PortStatus):
+  """ A switch of another shard sent a port status """
+  pass
+
+
+class OpenFlowShards (EventMixin, Task):
+  """
+  The messaging between this shard and the others.
+  """
+  _eventMixin_events = set([
+    RemoteConnectionUp,
+    RemoteConnectionDown,
+    RemotePortStatus,
+  ])
+
+  def __init__ (self, port, workers, index):
+    Task.__init__(self)
+    self.port = port
+    self.workers = workers
+    self.index = index
+    self.remotes = {} # DPID -> RemoteConnection
+    self._children = []
+    self._parent = os.getppid()
+    self._unsent = deque() # (address, data) that didn't fit
+
+    self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    self.sock.bind(self._address(index))
+    self.sock.setblocking(0)
+
+    core.openflow.addListeners(self)
+    core.openflow.remote = self
+    core.addListeners(self)
+
+  def _address (self, index):
+    # In the abstract namespace, so nothing is left behind in the filesystem
+    return "\0pox-of_01-%i-%i" % (self.port, index)
+
+  def _handle_GoingUpEvent (self, event):
+    if self.index == 0:
+      env = dict(os.environ)
+      for i in range(1, self.workers):
+        env[SHARD_ENV] = str(i)
+        self._children.append(subprocess.Popen([sys.executable] + sys.argv,
+                                               env=env))
+      log.info("Started %i more OpenFlow shards", self.workers - 1)
+    else:
+      # Exit along with shard 0
+      Timer(2, self._check_parent, recurring=True)
+    self.start()
+    self._broadcast(HELLO, 0)
+
+  def _handle_DownEvent (self, event):
+    for child in self._children:
+      try:
+        child.terminate()
+      except OSError:
+        pass
+    self.sock.close()
+
+  def _check_parent (self):
+    if os.getppid() != self._parent:
+      log.info("Shard 0 is gone; quitting")
+      core.quit()
+      return False
+
+  def _send (self, shard, kind, dpid, data = b''):
+    msg = _header.pack(kind, self.index, dpid) + data
+    address = self._address(shard)
+    if self._unsent:
+      self._unsent.append((address, msg))
+      return
+    try:
+      self.sock.sendto(msg, address)
+    except socket.error as (errno, strerror):
+      if errno != EAGAIN:
+        log.debug("Couldn't reach shard %i: %s", shard, strerror)
+        return
+      # The other shard's queue is full; run() retries.
+      self._unsent.append((address, msg))
+
+  def _broadcast (self, kind, dpid, data = b''):
+    for shard in range(self.workers):
+      if shard != self.index:
+        self._send(shard, kind, dpid, data)
+
+  def _flush (self):
+    while self._unsent:
+      address, msg = self._unsent[0]
+      try:
+        self.sock.sendto(msg, address)
+      except socket.error as (errno, strerror):
+        if errno == EAGAIN: return
+      self._unsent.popleft()
+
+  def sendToDPID (self, dpid, data):
+    """
+    Sends data to a switch of another shard.
+    """
+    con = self.remotes.get(dpid)
+    if con is None: return False
+    con.send(data)
+    return True
+
+  # Local events, for the other shards
+
+  def _handle_ConnectionUp (self, event):
+    self._broadcast(UP, event.dpid, event.ofp.pack())
+
+  def _handle_ConnectionDown (self, event):
+    self._broadcast(DOWN, event.dpid)
+
+  def _handle_PortStatus (self, event):
+    self._broadcast(PORT, event.dpid, event.ofp.pack())
+
+  # Remote events
+
+  def _unpack (self, data):
+    return of_01.unpackers[ord(data[1])](data, 0)[1]
+
+  def _handle_message (self, kind, shard, dpid, data):
+    if kind == MESSAGE:
+      con = core.openflow.getConnection(dpid)
+      if con is not None:
+        con.send(data)
+      else:
+        log.warn("Shard %i sent to %s, which isn't connected here", shard,
+                 dpidToStr(dpid))
+    elif kind == HELLO:
+      for con in core.openflow.connections:
+        if con.features is not None:
+          self._send(shard, UP, con.dpid, con.features.pack())
+    elif kind == UP:
+      con = RemoteConnection(self, dpid, shard)
+      con.features = self._unpack(data)
+      self.remotes[dpid] = con
+      self.raiseEventNoErrors(RemoteConnectionUp, con, con.features)
+    elif kind == DOWN:
+      con = self.remotes.pop(dpid, None)
+      if con is not None:
+        self.raiseEventNoErrors(RemoteConnectionDown, con)
+    elif kind == PORT:
+      con = self.remotes.get(dpid)
+      if con is not None:
+        self.raiseEventNoErrors(RemotePortStatus, con, self._unpack(data))
+
+  def run (self):
+    while core.running:
+      rlist, wlist, elist = yield Select([self.sock], [], [],
+                                         0.01 if self._unsent else 5)
+      self._flush()
+      self._receive()
+
+  def _receive (self):
+    """
+    Handles every message waiting on the socket.
+    """
+    while True:
+      try:
+        msg = self.sock.recv(_MAX_MESSAGE)
+      except socket.error as (errno, strerror):
+        if errno == EAGAIN: break
+        raise
+      kind, shard, dpid = _header.unpack_from(msg)
+      try:
+        self._handle_message(kind, shard, dpid, msg[_header.size:])
+      except Exception:
+        log.exception("Exception handling message from shard %i", shard)
+
+
+def launch (port, workers):
+  """
+  Makes this process an OpenFlow shard; called by openflow.of_01.launch().
+
+  Returns the shard's index.
+  """
+  index = int(os.environ.get(SHARD_ENV, 0))
+  core.register("openflow_shards", OpenFlowShards(port, workers, index))
+  return index
@@ -323,6 +323,29 @@ class ProcessFlowModTest(unittest.TestCase):
     self.assertEquals([e.cookie for e in t.entries if e.actions == [ofp_action_output(port=8)] ], [2])
     self.assertEquals(len(t.entries), 3)
 
+  def test_flow_mod_batch(self):
+    """ test that flow_mods up to a barrier make one table modification """
+    c = self.conn
+    c.on_messages_done = None
+    s = self.switch
+    s.set_connection(c)
+    events = []
+    s.table.addListenerByName("FlowTableModification", events.append)
+
+    for port in (1, 2, 3):
+      c.to_switch(ofp_flow_mod(match=ofp_match(in_port=port), actions=[ofp_action_output(port=4)]))
+    self.assertEqual(len(s.table), 3) # Applied already
+    self.assertEqual(len(events), 0) # But not announced
+    c.to_switch(ofp_barrier_request(xid=123))
+    self.assertEqual([len(e.added) for e in events], [3])
+    self.assertTrue(isinstance(c.last, ofp_barrier_reply))
+
+    c.to_switch(ofp_flow_mod(command=OFPFC_DELETE, match=ofp_match(in_port=1)))
+    c.to_switch(ofp_flow_mod(match=ofp_match(in_port=5), actions=[ofp_action_output(port=4)]))
+    c.on_messages_done(c)
+    self.assertEqual([(len(e.added), len(e.removed), e.reason) for e in events[1:]],
+                     [(1, 0, None), (0, 1, OFPRR_DELETE)])
+
 
 
 
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+import os.path
+import unittest
+
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+sys.path.append(os.path.dirname(__file__) + "/../../../pox/ext")
+from pox.lib.addresses import IPAddr
+from routing import source_buckets
+from topologies import jellyfish_graph, node_name_to_dpid
+
+
+class SourceBucketsTest (unittest.TestCase):
+  def assertEvenBuckets (self, ids, buckets):
+    prefixes = source_buckets(ids, buckets)
+    self.assertEqual(len(prefixes), buckets)
+    counts = [0] * buckets
+    for i in ids:
+      ip = IPAddr((10 << 24) | i)
+      found = [b for b, bucket in enumerate(prefixes)
+               for prefix in bucket if ip.inNetwork(prefix)]
+      self.assertEqual(len(found), 1, "%s is in buckets %s" % (ip, found))
+      counts[found[0]] += 1
+    self.assertTrue(max(counts) - min(counts) <= 1, counts)
+
+  def test_jellyfish_hosts (self):
+    """ Every bucket gets as many of a topology's hosts """
+    topo = jellyfish_graph(random_seed=0, n=30, k=6, r=4)
+    ids = [node_name_to_dpid(h) for h in topo.hosts()]
+    for buckets in (1, 2, 3, 4, 8):
+      self.assertEvenBuckets(ids, buckets)
+
+  def test_uneven_ids (self):
+    """ Buckets split hosts evenly whatever their ids """
+    self.assertEvenBuckets(range(2, 8919, 13), 4)
+    self.assertEvenBuckets([1, 2, 3, 1000, 1 << 20, (1 << 24) - 1], 4)
+    self.assertEvenBuckets([5, 6], 4)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -21,12 +21,13 @@ import SocketServer
 import threading
 import socket
 import signal
+import select
 
 from copy import copy
 
 sys.path.append(os.path.dirname(__file__) + "/../../..")
 
-from pox.lib.epoll_select import EpollSelect
+from pox.lib.epoll_select import EpollSelect, EdgeEpoll
 
 class TCPEcho(SocketServer.StreamRequestHandler):
   def handle(self):
@@ -100,5 +101,44 @@ class EpollSelectTest(unittest.TestCase):
       check( ([],[],[]), self.es.select(sockets, [], sockets, 0))
       check( ([],sockets,[]), self.es.select(sockets, sockets, sockets, 0))
 
+@unittest.skipUnless(sys.platform.startswith("linux"), "requires Linux")
+class EdgeEpollTest(unittest.TestCase):
+  def setUp(self):
+    self.ep = EdgeEpoll()
+    self.a, self.b = socket.socketpair()
+    self.ep.register(self.a)
+
+  def tearDown(self):
+    self.ep.close()
+    self.a.close()
+    self.b.close()
+
+  def test_edges(self):
+    # registering reports the socket writable once
+    self.assertEqual(([],[self.a],[]), self.ep.poll(0))
+    self.assertEqual(([],[],[]), self.ep.poll(0))
+    self.b.send("Hallo")
+    # (the new edge may report it writable again too)
+    self.assertEqual([self.a], self.ep.poll(0)[0])
+    # still unread, but no new edge
+    self.assertEqual(([],[],[]), self.ep.poll(0))
+    self.ep.again(self.a)
+    self.assertTrue(self.ep.pending)
+    self.assertEqual(([self.a],[],[]), self.ep.poll(0))
+    self.assertFalse(self.ep.pending)
+
+  def test_selectable(self):
+    self.ep.poll(0)
+    self.assertEqual([], select.select([self.ep], [], [], 0)[0])
+    self.b.send("Hallo")
+    self.assertEqual([self.ep], select.select([self.ep], [], [], 0)[0])
+
+  def test_unregister(self):
+    self.ep.again(self.a)
+    self.ep.unregister(self.a)
+    self.b.send("Hallo")
+    self.assertEqual(([],[],[]), self.ep.poll(0))
+    self.ep.unregister(self.a)
+
 if __name__ == '__main__':
   unittest.main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import sys
+import os.path
+
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+from pox.lib.packet import *
+from pox.lib.packet.ethernet import ETHER_BROADCAST
+from pox.lib.addresses import EthAddr, IPAddr
+
+
+def frame (l4=None, proto=ipv4.TCP_PROTOCOL, vlan_id=None):
+  ip = ipv4(srcip=IPAddr("10.0.0.1"), dstip=IPAddr("10.0.0.2"),
+            protocol=proto)
+  ip.tos = 8
+  if l4 is not None:
+    ip.payload = l4
+  eth = ethernet(src=EthAddr("00:00:00:00:00:01"),
+                 dst=EthAddr("00:00:00:00:00:02"), type=ethernet.IP_TYPE)
+  if vlan_id is None:
+    eth.payload = ip
+  else:
+    eth.type = ethernet.VLAN_TYPE
+    eth.payload = vlan(id=vlan_id, eth_type=ethernet.IP_TYPE, next=ip)
+  return eth.pack()
+
+
+class EthernetViewTest (unittest.TestCase):
+  def check (self, raw):
+    """ The view has the same fields as the fully parsed packet """
+    view = ethernet_view(raw)
+    packet = ethernet(raw)
+    self.assertEqual(view.parsed, packet.parsed)
+    if not view.parsed: return view
+    self.assertEqual(view.src, packet.src)
+    self.assertEqual(view.dst, packet.dst)
+    self.assertEqual(view.type, packet.type)
+    self.assertEqual(view.effective_ethertype, packet.effective_ethertype)
+    ip = packet.find('ipv4')
+    self.assertEqual(view.is_ipv4, ip is not None)
+    if ip is not None:
+      self.assertEqual(view.srcip, ip.srcip)
+      self.assertEqual(view.nw_dst, ip.dstip.toUnsigned())
+      self.assertEqual(view.nw_proto, ip.protocol)
+      self.assertEqual(view.nw_tos, ip.tos)
+    l4 = packet.find('tcp') or packet.find('udp')
+    if l4 is None:
+      self.assertEqual(view.five_tuple, None)
+    else:
+      self.assertEqual(view.five_tuple, (ip.srcip.toUnsigned(),
+          ip.dstip.toUnsigned(), ip.protocol, l4.srcport, l4.dstport))
+    return view
+
+  def test_tcp (self):
+    view = self.check(frame(tcp(srcport=1234, dstport=80, off=5)))
+    self.assertEqual((view.tp_src, view.tp_dst), (1234, 80))
+    self.assertEqual(view._packet, None) # Never parsed
+
+  def test_udp (self):
+    self.check(frame(udp(srcport=53, dstport=5353), ipv4.UDP_PROTOCOL))
+
+  def test_icmp (self):
+    view = self.check(frame(icmp(), ipv4.ICMP_PROTOCOL))
+    self.assertEqual(view.tp_src, None)
+
+  def test_vlan (self):
+    self.check(frame(tcp(srcport=1, dstport=2, off=5), vlan_id=5))
+
+  def test_not_ip (self):
+    eth = ethernet(src=EthAddr("00:00:00:00:00:01"), dst=ETHER_BROADCAST,
+                   type=ethernet.ARP_TYPE)
+    eth.payload = arp()
+    view = self.check(eth.pack())
+    self.assertEqual(view.nw_src, None)
+
+  def test_truncated (self):
+    raw = frame(tcp(srcport=1234, dstport=80, off=5))
+    for length in (10, 14, 30, 40):
+      self.check(raw[:length])
+
+  def test_deeper_layers (self):
+    raw = frame(tcp(srcport=1234, dstport=80, off=5))
+    view = ethernet_view(raw)
+    self.assertTrue(isinstance(view.next, ipv4))
+    self.assertEqual(view.find('tcp').dstport, 80)
+    self.assertEqual(view.pack(), raw)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -18,6 +18,8 @@
 
 import itertools
 import os.path
+import select
+import socket
 import sys
 import unittest
 
@@ -74,7 +76,7 @@ class RecocoIOLoopTest(unittest.TestCase):
     loop.stop()
 
   def test_run_read(self):
-    loop = RecocoIOLoop()
+    loop = RecocoIOLoop(use_epoll=False)
     (left, right) = MockSocket.pair()
     worker = loop.new_worker(left)
 
@@ -118,7 +120,7 @@ class RecocoIOLoopTest(unittest.TestCase):
         "Should have added pending close() command")
 
   def test_run_write(self):
-    loop = RecocoIOLoop()
+    loop = RecocoIOLoop(use_epoll=False)
     (left, right) = MockSocket.pair()
     worker = loop.new_worker(left)
 
@@ -134,3 +136,41 @@ class RecocoIOLoopTest(unittest.TestCase):
 
     # that should result in the stuff being sent on the socket
     self.assertEqual(right.recv(), "heppo")
+
+@unittest.skipUnless(hasattr(select, "epoll"), "requires epoll")
+class RecocoIOLoopEpollTest(unittest.TestCase):
+  def setUp(self):
+    self.loop = RecocoIOLoop(use_epoll=True)
+    (self.left, self.right) = socket.socketpair()
+    self.left.setblocking(0)
+    self.worker = self.loop.new_worker(self.left)
+    self.received = []
+    self.worker.rx_handler = lambda worker: \
+        self.received.append(worker.read())
+    self.g = self.loop.run()
+    self.g.next() # registers the worker, and waits on the poller
+
+  def tearDown(self):
+    self.left.close()
+    self.right.close()
+
+  def test_run_read(self):
+    self.right.send("hallo")
+    # The poller reports the worker readable; the select result is unused
+    self.g.send(([], [], []))
+    self.assertEqual(self.received, ["hallo"])
+
+  def test_run_read_more_than_buffer(self):
+    data = "x" * (RecocoIOLoop._BUF_SIZE + 10)
+    self.right.sendall(data)
+    self.g.send(([], [], []))
+    self.assertEqual(len(self.received), 1)
+    # No new data arrives, but the rest is read on the next cycle
+    self.assertTrue(self.loop._poller.pending)
+    self.g.send(([], [], []))
+    self.assertEqual("".join(self.received), data)
+
+  def test_run_write(self):
+    self.worker.send("heppo")
+    self.g.send(([], [], []))
+    self.assertEqual(self.right.recv(100), "heppo")
@@ -111,6 +111,76 @@ class FlowTableTest(unittest.TestCase):
       t.remove_expired_entries(now=time)
       self.assertEqual(sorted([e.cookie for e in t.entries]), remaining)
 
+  def test_expiry_after_changes(self):
+    """ test that expiry keeps up with touched, removed and re-added flows """
+    t = FlowTable()
+    entries = dict((cookie, TableEntry(now=0, cookie=cookie, idle_timeout=idle, hard_timeout=hard))
+                   for (cookie, idle, hard) in ( (1, 5, 0), (2, 5, 0), (3, 0, 10) ))
+    for cookie in sorted(entries):
+      t.add_entry(entries[cookie])
+
+    for (time, touch, remove, add, remaining) in (
+            (4, [1], [], [], [1,2,3]), # flow 1 touched just before its deadline
+            (6, [1], [2], [], [1,3]), # flow 2 removed by hand before it expires
+            (7, [1], [], [2], [1,3]), # added back idle since 0, it expires at once
+            (11, [], [], [], [1]), # flow 3 reaches its hard timeout
+            (13, [], [], [], []), # flow 1, last touched at 7, goes idle
+            ):
+      [entries[c].touch_packet(1, now=time) for c in touch]
+      [t.remove_entry(entries[c]) for c in remove]
+      [t.add_entry(entries[c]) for c in add]
+      t.remove_expired_entries(now=time)
+      self.assertEqual(sorted([e.cookie for e in t.entries]), remaining)
+
+  def test_batch(self):
+    """ test that a batch of changes raises events at its end """
+    t = FlowTable()
+    events = []
+    t.addListenerByName("FlowTableModification", events.append)
+    t.add_entries([TableEntry(cookie=cookie, match=ofp_match(in_port=cookie)) for cookie in (1, 2, 3)])
+    self.assertEqual([[e.cookie for e in ev.added] for ev in events], [[1, 2, 3]])
+
+    del events[:]
+    t.start_batch()
+    t.add_entry(TableEntry(cookie=4, match=ofp_match(in_port=4)))
+    t.remove_matching_entries(ofp_match(in_port=1), reason=OFPRR_DELETE)
+    t.remove_matching_entries(ofp_match(in_port=2))
+    t.add_entries([TableEntry(cookie=5, match=ofp_match(in_port=5))])
+    self.assertEqual(sorted([e.cookie for e in t.entries]), [3, 4, 5])
+    self.assertEqual(events, [])
+    t.end_batch()
+    self.assertEqual([([e.cookie for e in ev.added], [e.cookie for e in ev.removed], ev.reason) for ev in events],
+                     [([4, 5], [2], None), ([], [1], OFPRR_DELETE)])
+
+  def test_entry_for_packet(self):
+    """ test that lookups find the highest priority, newest matching flow """
+    from pox.lib.packet import ethernet, ipv4, tcp
+    ip = ipv4(srcip=IPAddr("1.2.3.4"), dstip=IPAddr("1.2.4.1"), protocol=ipv4.TCP_PROTOCOL)
+    ip.payload = tcp(srcport=1234, dstport=80, off=5)
+    eth = ethernet(src=EthAddr("00:00:00:00:00:01"), dst=EthAddr("00:00:00:00:00:02"), type=ethernet.IP_TYPE)
+    eth.payload = ip
+    packet = ethernet(eth.pack())
+    exact = ofp_match.from_packet(packet, 1)
+
+    t = FlowTable()
+    def cookie():
+      entry = t.entry_for_packet(packet, 1)
+      return entry.cookie if entry is not None else None
+    self.assertEqual(cookie(), None)
+    for (entry, expected) in (
+          (TableEntry(priority=1, cookie=0x1, match=ofp_match()), 1),
+          (TableEntry(priority=5, cookie=0x2, match=ofp_match(dl_type=0x800, nw_src="1.2.3.0/24")), 2),
+          (TableEntry(priority=5, cookie=0x3, match=ofp_match(dl_type=0x800, nw_dst="1.2.4.0/24")), 3), # newest of a tie
+          (TableEntry(priority=5, cookie=0x4, match=ofp_match(dl_type=0x800, nw_dst="1.2.5.0/24")), 3), # does not match
+          (TableEntry(priority=1, cookie=0x5, match=exact), 5), # exact matches win regardless
+          (TableEntry(priority=9, cookie=0x6, match=exact), 6), # newest of two exact ones
+          ):
+      t.add_entry(entry)
+      self.assertEqual(cookie(), expected)
+    for (removed, expected) in ((6, 5), (5, 3), (3, 2), (2, 1), (1, None)):
+      t.remove_entry([e for e in t.entries if e.cookie == removed][0])
+      self.assertEqual(cookie(), expected)
+
   # def test_check_for_overlap_entries(self):
 
 
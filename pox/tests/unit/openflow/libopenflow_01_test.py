@@ -83,6 +83,21 @@ class ofp_match_test(unittest.TestCase):
       self.assertEquals(getattr(m, "get_"+attr)(), (None, 0), "get_%s for unset %s should return (None,0)" % (attr, attr))
       self.assertTrue( ((m.wildcards & bitmask) >> shift) >= 32)
 
+  def test_pack_masked_ip(self):
+    """ ofp_match: wildcarded IP address bits are packed as 0 """
+    m = ofp_match(dl_type=0x0800)
+    m.set_nw_src("10.0.0.5", 24)
+    m.set_nw_dst("11.1.2.3", 30)
+    for flow_mod in (False, True):
+      u = ofp_match()
+      u.unpack(m.pack(flow_mod=flow_mod))
+      self.assertEqual(u.get_nw_src(), ("10.0.0.0", 24))
+      self.assertEqual(u.get_nw_dst(), ("11.1.2.0", 30))
+    m.set_nw_src("10.0.0.5", 0)
+    u = ofp_match()
+    u.unpack(m.pack())
+    self.assertEqual(u.get_nw_src(), (None, 0))
+
   def test_match_with_wildcards(self):
     """ ofp_match: test the matches_with_wildcards method """
     def create(wildcards=(), **kw):
@@ -135,6 +150,23 @@ class ofp_match_test(unittest.TestCase):
     assertMatch(create(nw_src="10.0.0.0/25"), create(nw_src="10.0.0.127"))
     assertNoMatch(create(nw_src="10.0.0.0/25"), create(nw_src="10.0.0.128"))
 
+  def test_match_tuple(self):
+    """ ofp_match_tuple packs like the equivalent ofp_match in a flow_mod """
+    for kw in ( {},
+        { "in_port": 1, "dl_type": 0x88cc, "dl_dst": "00:00:00:00:00:02" },
+        { "dl_type": 0x0806, "nw_src": "10.0.0.1", "tp_dst": 80 },
+        { "dl_type": 0x0800, "dl_src": EthAddr("00:00:00:00:00:01"), "dl_vlan": 5, "nw_proto": 6, "nw_dst": IPAddr("11.0.0.1"), "tp_src": 12345 } ):
+      match = ofp_match(**kw)
+      t = ofp_match_tuple.make(**kw)
+      self.assertEquals(t.pack(), match.pack(flow_mod=True))
+      self.assertEquals(t, ofp_match_tuple.from_match(match, flow_mod=True))
+      self.assertEquals(t.to_match(flow_mod=True).pack(flow_mod=True), t.pack())
+      self.assertEquals(ofp_match_tuple.unpack_new(t.pack()), (40, t))
+
+      fm = ofp_flow_mod(xid=1, match=t, action=ofp_action_output(port=2))
+      self.assertEquals(fm.pack(), ofp_flow_mod(xid=1, match=match, action=ofp_action_output(port=2)).pack())
+    self.assertRaises(TypeError, ofp_match_tuple.make, nw_foo=1)
+
 class ofp_command_test(unittest.TestCase):
   # custom map of POX class to header type, for validation
   ofp_type = {
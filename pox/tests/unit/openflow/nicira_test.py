@@ -46,6 +46,9 @@ class basics_test (unittest.TestCase):
     # Use a factory method
     return cls.resubmit_table()
 
+  def _init_action_nx_action_multipath (self, cls):
+    return cls(dst=nx.NXM_NX_REG0,max_link=2,nbits=16,basis=7)
+
   def _init_action_nx_action_set_tunnel (self, cls):
     return cls(tun_id=101)
 
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import sys
+import os.path
+import socket
+import thread
+
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+import pox.openflow.libopenflow_01 as of
+import pox.openflow.of_01 as of_01
+from pox.lib.epoll_select import EdgeEpoll
+
+
+class ConnectionReadTest(unittest.TestCase):
+  def setUp(self):
+    self.received = []
+    self.old_handler = of_01.handlers[of.OFPT_PACKET_IN]
+    of_01.handlers[of.OFPT_PACKET_IN] = lambda con, msg: \
+        self.received.append(msg)
+    self.old_read_size = of_01.Connection.read_size
+    self.sock, self.peer = socket.socketpair()
+    self.con = of_01.Connection(self.sock)
+    self.peer.recv(1024) # The connection's hello
+
+  def tearDown(self):
+    of_01.handlers[of.OFPT_PACKET_IN] = self.old_handler
+    of_01.Connection.read_size = self.old_read_size
+    self.sock.close()
+    self.peer.close()
+
+  def packet_ins(self, count, size):
+    return [of.ofp_packet_in(xid=i, in_port=1, buffer_id=i,
+                             data='x' * size) for i in range(count)]
+
+  def feed(self, data, chunk):
+    for i in range(0, len(data), chunk):
+      self.peer.sendall(data[i:i+chunk])
+      self.assertTrue(self.con.read())
+
+  def test_split_messages(self):
+    """ Messages cut at every possible point are all handled once """
+    msgs = self.packet_ins(20, 30)
+    data = ''.join(m.pack() for m in msgs)
+    for chunk in (1, 7, 8, 45, len(data)):
+      self.received = []
+      self.feed(data, chunk)
+      self.assertEqual([m.xid for m in self.received], range(20))
+      self.assertEqual(self.received[-1].data, 'x' * 30)
+      self.assertEqual(self.con._rlen, 0)
+
+  def test_message_larger_than_read_size(self):
+    of_01.Connection.read_size = 64
+    msgs = self.packet_ins(3, 1500)
+    self.feed(''.join(m.pack() for m in msgs), 1000)
+    while len(self.received) < 3:
+      self.assertTrue(self.con.read())
+    self.assertEqual([m.xid for m in self.received], [0, 1, 2])
+    self.assertEqual(self.received[1].data, 'x' * 1500)
+
+  def test_bad_length(self):
+    self.peer.sendall('\x01\x0a\x00\x04\x00\x00\x00\x00')
+    self.assertFalse(self.con.read())
+
+  def test_closed(self):
+    self.peer.close()
+    self.assertFalse(self.con.read())
+
+
+class ConnectionSendTest(unittest.TestCase):
+  def setUp(self):
+    self.sock, self.peer = socket.socketpair()
+    self.sock.setblocking(0)
+    self.con = of_01.Connection(self.sock)
+    self.peer.recv(1024) # The connection's hello
+
+  def tearDown(self):
+    of_01._flush_all()
+    of_01._blocked.clear()
+    self.sock.close()
+    self.peer.close()
+
+  def test_batched_until_cycle_end(self):
+    of_01._batching = thread.get_ident()
+    msgs = [of.ofp_flow_mod(xid=1), of.ofp_packet_out(xid=2)]
+    for msg in msgs:
+      self.con.send(msg)
+    self.peer.setblocking(0)
+    self.assertRaises(socket.error, self.peer.recv, 1024)
+    of_01._flush_all()
+    self.assertEqual(self.peer.recv(1024), ''.join(m.pack() for m in msgs))
+
+  def test_not_batched_elsewhere(self):
+    self.con.send(of.ofp_barrier_request(xid=3))
+    self.assertEqual(self.peer.recv(1024),
+                     of.ofp_barrier_request(xid=3).pack())
+
+  def test_blocked_socket(self):
+    data = of.ofp_packet_out(xid=4, data='x' * 60000).pack()
+    sent = ''
+    while self.con not in of_01._blocked:
+      self.con.send(data)
+      sent += data
+    self.con.send(of.ofp_barrier_request(xid=5))
+    sent += of.ofp_barrier_request(xid=5).pack()
+    received = ''
+    while len(received) < len(sent):
+      received += self.peer.recv(65536)
+      self.con.flush()
+    self.assertEqual(received, sent)
+    self.assertFalse(self.con in of_01._blocked)
+
+
+class ReadConnectionsTest(unittest.TestCase):
+  def setUp(self):
+    self.received = []
+    self.old_handler = of_01.handlers[of.OFPT_PACKET_IN]
+    of_01.handlers[of.OFPT_PACKET_IN] = lambda con, msg: \
+        self.received.append((con, msg))
+    self.poller = EdgeEpoll()
+    self.pairs = [socket.socketpair() for i in range(2)]
+    self.cons = []
+    for sock, peer in self.pairs:
+      sock.setblocking(0)
+      con = of_01.Connection(sock)
+      peer.recv(1024) # The connection's hello
+      self.poller.register(con)
+      self.cons.append(con)
+    self.poller.poll() # Writable
+
+  def tearDown(self):
+    of_01.handlers[of.OFPT_PACKET_IN] = self.old_handler
+    self.poller.close()
+    for sock, peer in self.pairs:
+      sock.close()
+      peer.close()
+
+  def test_failed_read_does_not_skip_others(self):
+    """ One connection raising while reading drops it, not the others """
+    bad, good = self.cons
+    def fail():
+      raise RuntimeError("read failed")
+    bad.read = fail
+    for sock, peer in self.pairs:
+      peer.sendall(of.ofp_packet_in(xid=7, in_port=1, data='x').pack())
+    rlist, wlist, elist = self.poller.poll()
+    self.assertEqual(sorted(rlist), sorted(self.cons))
+
+    sockets = list(self.cons)
+    of_01._read_connections(rlist, self.poller, sockets)
+    self.assertEqual([(con, msg.xid) for con, msg in self.received],
+                     [(good, 7)])
+    self.assertEqual(sockets, [good])
+    self.assertFalse(bad in self.poller.obj_to_fd)
+    self.assertTrue(good in self.poller.obj_to_fd)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import itertools
+import os
+import sys
+import os.path
+import unittest
+
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+from pox.core import core
+from pox.openflow import OpenFlowNexus
+import pox.openflow.libopenflow_01 as of
+import pox.openflow.shards as shards
+
+# Ports are only used to name the shards' sockets
+_ports = itertools.count(40000 + os.getpid() % 10000)
+
+
+class FakeConnection (object):
+  def __init__ (self, dpid):
+    self.dpid = dpid
+    self.features = of.ofp_features_reply(datapath_id=dpid)
+    self.sent = []
+
+  def send (self, data):
+    self.sent.append(data)
+
+
+class FakeEvent (object):
+  def __init__ (self, dpid, ofp=None):
+    self.dpid = dpid
+    self.ofp = ofp
+
+
+class ShardsTest (unittest.TestCase):
+  """
+  Two shards of one process, talking over their unix sockets
+  """
+  def setUp (self):
+    # A fresh core.openflow, shared by both shards
+    self.old_openflow = core.components.get('openflow')
+    core.components['openflow'] = OpenFlowNexus()
+    port = next(_ports)
+    self.shards = [shards.OpenFlowShards(port, 2, i) for i in range(2)]
+    self.events = []
+    for s in self.shards:
+      s.addListenerByName("RemoteConnectionUp", self.events.append)
+      s.addListenerByName("RemoteConnectionDown", self.events.append)
+      s.addListenerByName("RemotePortStatus", self.events.append)
+
+  def tearDown (self):
+    for s in self.shards:
+      s.sock.close()
+    if self.old_openflow is None:
+      del core.components['openflow']
+    else:
+      core.components['openflow'] = self.old_openflow
+
+  def connect (self, dpid):
+    con = FakeConnection(dpid)
+    core.openflow._connect(con)
+    return con
+
+  def test_remote_events (self):
+    """ Switches of one shard show up as remote ones on the other """
+    a, b = self.shards
+    a._handle_ConnectionUp(FakeEvent(5, of.ofp_features_reply(datapath_id=5)))
+    b._receive()
+    self.assertEqual([type(e) for e in self.events],
+                     [shards.RemoteConnectionUp])
+    con = self.events[0].connection
+    self.assertEqual((con.dpid, con.shard), (5, 0))
+    self.assertEqual(con.features.datapath_id, 5)
+    self.assertTrue(b.remotes[5] is con)
+
+    del self.events[:]
+    port = of.ofp_phy_port(port_no=3)
+    a._handle_PortStatus(FakeEvent(5, of.ofp_port_status(desc=port)))
+    b._receive()
+    self.assertEqual([type(e) for e in self.events],
+                     [shards.RemotePortStatus])
+    self.assertTrue(self.events[0].connection is con)
+    self.assertEqual(self.events[0].port, 3)
+
+    del self.events[:]
+    a._handle_ConnectionDown(FakeEvent(5))
+    b._receive()
+    self.assertEqual([type(e) for e in self.events],
+                     [shards.RemoteConnectionDown])
+    self.assertEqual(b.remotes, {})
+
+  def test_hello (self):
+    """ A new shard hears about the switches already connected """
+    a, b = self.shards
+    self.connect(7)
+    b._broadcast(shards.HELLO, 0)
+    a._receive()
+    b._receive()
+    self.assertEqual(sorted(b.remotes), [7])
+    self.assertEqual([type(e) for e in self.events],
+                     [shards.RemoteConnectionUp])
+
+  def test_send_to_dpid (self):
+    """ Messages for a remote switch reach the owning shard's connection """
+    a, b = self.shards
+    a._handle_ConnectionUp(FakeEvent(9, of.ofp_features_reply(datapath_id=9)))
+    b._receive()
+    self.assertTrue(b.sendToDPID(9, of.ofp_barrier_request(xid=1)))
+    self.assertFalse(b.sendToDPID(10, of.ofp_barrier_request(xid=2)))
+
+    con = self.connect(9)
+    a._receive()
+    self.assertEqual(con.sent, [of.ofp_barrier_request(xid=1).pack()])
+
+  def test_unsent (self):
+    """ Messages that do not fit are queued and sent in order """
+    a, b = self.shards
+    con = self.connect(11)
+    remote = shards.RemoteConnection(a, 11, 1)
+    count = 0
+    while not a._unsent:
+      remote.send(of.ofp_barrier_request(xid=count))
+      count += 1
+      self.assertTrue(count < 100000, "Shard socket never filled up")
+    for i in range(5):
+      remote.send(of.ofp_barrier_request(xid=count))
+      count += 1
+
+    while a._unsent or len(con.sent) < count:
+      b._receive()
+      a._flush()
+    self.assertEqual(con.sent, [of.ofp_barrier_request(xid=i).pack()
+                                for i in range(count)])
+
+  def test_start_shards (self):
+    """ Shard 0 runs the command line again for every other shard """
+    a, b = self.shards
+    started = []
+    class FakePopen (object):
+      def __init__ (self, args, env):
+        started.append((args, env[shards.SHARD_ENV]))
+    old_popen = shards.subprocess.Popen
+    shards.subprocess.Popen = FakePopen
+    a.start = lambda: None
+    try:
+      self.connect(13)
+      a._handle_GoingUpEvent(None)
+    finally:
+      shards.subprocess.Popen = old_popen
+    self.assertEqual(started, [([sys.executable] + sys.argv, '1')])
+    self.assertEqual(len(a._children), 1)
+    # Its HELLO asks the other shards for their switches
+    b._receive()
+    a._receive()
+    self.assertEqual(sorted(a.remotes), [13])
+
+
+if __name__ == '__main__':
+  unittest.main()